@@ -0,0 +1,284 @@
+# benchmarks.py
+# Reproducible ingest and query benchmarks against an in-process moto DynamoDB, using synthetic
+# minute-resolution readings. Consumed capacity and DynamoDB call counts come from the Lambdas'
+# own tracing summaries. Results are written as JSON so runs on different commits can be
+# compared with --compare.
+#
+#   python bench/benchmarks.py [--spans 1,7,30] [--query-days 1,7,30] [--json results.json]
+#   python bench/benchmarks.py --spans 1,7,30,365,1825 --query-days 1,7,30,365,1825   # full range, slow
+#   python bench/benchmarks.py --compare before.json --json after.json
+import argparse
+import base64
+import gzip
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from unittest.mock import patch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'service'), os.path.join(ROOT, 'shared')]
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:eu-west-2:123456789012:aurora-bench')
+
+from moto import mock_aws  # noqa: E402
+
+import aurora_store  # noqa: E402
+import rollups  # noqa: E402
+import tracing  # noqa: E402
+
+DAY = 24 * 60 * 60
+THRESHOLDS = [('green', 0), ('yellow', 50), ('amber', 100), ('red', 200)]
+
+
+class TraceCollector:
+    """Keeps the tracing summary of every handler invocation, so the results report the same consumed
+    capacity and DynamoDB call counts the Lambdas emit in production."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.summaries = []
+        self.finish = tracing.finish
+        self.metrics_enabled = tracing.METRICS_ENABLED
+        tracing.METRICS_ENABLED = False  # An EMF line per invocation would drown the report
+        tracing.finish = self.record
+
+    def record(self, **properties):
+        summary = self.finish(**properties)
+        if summary is not None:
+            with self.lock:
+                self.summaries.append(summary)
+        return summary
+
+    def close(self):
+        tracing.finish = self.finish
+        tracing.METRICS_ENABLED = self.metrics_enabled
+
+    def take(self):
+        with self.lock:
+            summaries, self.summaries = self.summaries, []
+        units = sum(summary['capacity']['read'] + summary['capacity']['write'] for summary in summaries)
+        calls = Counter()
+        for summary in summaries:
+            for name, span in summary['spans'].items():
+                if name.startswith('dynamodb'):
+                    calls[name.removeprefix('dynamodb')] += span['count']
+        return {'capacity_units': round(units, 1), 'calls': dict(calls)}
+
+
+def reading(epochtime):
+    # A smooth daily swell with sharper storms every few days, so every status appears
+    value = 40 + 35 * math.sin(epochtime / DAY * 2 * math.pi) + 180 * max(0.0, math.sin(epochtime / (3.7 * DAY))) ** 8
+    value = round(max(0.0, value), 1)
+    status_id = [status for status, lower in THRESHOLDS if value >= lower][-1]
+    return {'epochtime': epochtime, 'status_id': status_id, 'value': Decimal(str(value))}
+
+
+def load_dataset(end, span_days, interval):
+    """Write span_days of readings ending at `end`, a day at a time, with their rollups."""
+    started = time.perf_counter()
+    records = 0
+    hourly = []
+    first_day = rollups.period_start(end - span_days * DAY, 'day')
+    for day in range(first_day, end, DAY):
+        readings = [aurora_store.with_bucket(reading(epochtime))
+                    for epochtime in range(max(day, end - span_days * DAY), min(day + DAY, end), interval)]
+        aurora_store.batch_write(readings)
+        hours = rollups.summarise(readings, 'hour')
+        aurora_store.batch_write(hours, rollups.ROLLUPS_TABLE)
+        hourly.extend(hours)
+        records += len(readings)
+    aurora_store.batch_write(rollups.combine(hourly, 'day'), rollups.ROLLUPS_TABLE)
+    elapsed = time.perf_counter() - started
+    return {'records': records, 'seconds': round(elapsed, 2), 'records_per_sec': round(records / elapsed, 1)}
+
+
+def feed_xml(end, count, interval, updated):
+    rows = ''.join(
+        f'<activity status_id="{item["status_id"]}"><datetime>'
+        f'{time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(item["epochtime"]))}</datetime>'
+        f'<value>{item["value"]}</value></activity>'
+        for item in (reading(end - (count - i) * interval) for i in range(count)))
+    thresholds = ''.join(f'<lower_threshold status_id="{status}">{lower}</lower_threshold>' for status, lower in THRESHOLDS)
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(updated))
+    return f'<root><updated><datetime>{stamp}</datetime></updated>{thresholds}{rows}</root>'.encode()
+
+
+def measure_ingest(meter, end, count, interval):
+    """lambda_handler throughput: a run where every activity is new, then one where none changed."""
+    import aurora_watch_lambda
+    results = {}
+    with patch('aurora_watch_lambda.urllib.request.urlopen') as urlopen, \
+            patch.object(aurora_watch_lambda.sns, 'publish', return_value={'MessageId': 'bench'}):
+        response = urlopen.return_value.__enter__.return_value
+        response.headers = {}
+        for name, updated in [('new', end), ('unchanged', end + 60)]:
+            response.read.return_value = feed_xml(end, count, interval, updated)
+            meter.take()
+            started = time.perf_counter()
+            result = aurora_watch_lambda.lambda_handler(None, None)
+            elapsed = time.perf_counter() - started
+            if result['statusCode'] != 200:
+                raise RuntimeError(result['body'])
+            results[name] = {
+                'activities': count,
+                'ms': round(elapsed * 1000, 1),
+                'activities_per_sec': round(count / elapsed, 1),
+                **meter.take()
+            }
+    return results
+
+
+def invoke(query, accept=None):
+    import lambda_function
+    event = {'body': json.dumps({'query': query}), 'headers': {'Accept': accept} if accept else {}}
+    started = time.perf_counter()
+    response = lambda_function.lambda_handler(event, None)
+    elapsed = time.perf_counter() - started
+    if response['statusCode'] != 200:
+        raise RuntimeError(response['body'])
+    body = base64.b64decode(response['body']) if response.get('isBase64Encoded') else response['body'].encode()
+    return elapsed * 1000, body
+
+
+def measure_query(meter, days, repeat):
+    """Latency, capacity and response size of auroraEntries and auroraSeries for one window."""
+    import columnar
+    import lambda_function
+    entries = f'query {{ auroraEntries(days: {days}) {{ epochtime statusId value }} }}'
+    series = f'query {{ auroraSeries(days: {days}) {{ epochtime min max mean count statusId }} }}'
+
+    lambda_function.readings_cache.clear()
+    meter.take()
+    cold_ms, body = invoke(entries)
+    cold_capacity = meter.take()
+    warm_ms = min(invoke(entries)[0] for _ in range(repeat))
+    rows = len(json.loads(body)['data']['auroraEntries'])
+    _, columnar_body = invoke(entries, columnar.CONTENT_TYPE)
+
+    lambda_function.readings_cache.clear()
+    meter.take()
+    series_ms, series_body = invoke(series)
+    series_capacity = meter.take()
+    return {
+        'days': days,
+        'rows': rows,
+        'entries': {
+            'cold_ms': round(cold_ms, 1),
+            'warm_ms': round(warm_ms, 1),
+            'read_units': cold_capacity['capacity_units'],
+            'calls': cold_capacity['calls'],
+            'json_bytes': len(body),
+            'json_gzip_bytes': len(gzip.compress(body)),
+            'columnar_bytes': len(columnar_body),
+            'columnar_gzip_bytes': len(gzip.compress(columnar_body))
+        },
+        'series': {
+            'cold_ms': round(series_ms, 1),
+            'read_units': series_capacity['capacity_units'],
+            'points': len(json.loads(series_body)['data']['auroraSeries']),
+            'json_bytes': len(series_body)
+        }
+    }
+
+
+def run_span(span_days, query_days, interval, repeat, ingest_count):
+    mock = mock_aws()
+    mock.start()
+    aurora_store._dynamodb = None  # A fresh resource inside this mock
+    meter = TraceCollector()
+    try:
+        aurora_store.create_readings_table()
+        rollups.create_rollups_table()
+        aurora_store.create_meta_table()
+        end = int(time.time()) // interval * interval
+        load = load_dataset(end, span_days, interval)
+        meter.take()
+        queries = [measure_query(meter, days, repeat) for days in query_days if days <= span_days]
+        ingest = measure_ingest(meter, end + interval, ingest_count, interval)
+        return {'span_days': span_days, 'load': load, 'queries': queries, 'ingest': ingest}
+    finally:
+        meter.close()
+        mock.stop()
+        aurora_store._dynamodb = None
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import moto
+    return {'commit': commit, 'python': platform.python_version(), 'moto': moto.__version__,
+            'platform': platform.platform(), 'started_at': int(time.time())}
+
+
+def flatten(value, prefix=''):
+    """Numeric leaves as {'span=7/queries/days=1/entries/cold_ms': 12.3}, for comparisons."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f'{prefix}/{key}' if prefix else key)
+    elif isinstance(value, list):
+        for item in value:
+            label = next((f'{key}={item[key]}' for key in ('span_days', 'days') if isinstance(item, dict) and key in item), '')
+            yield from flatten(item, f'{prefix}/{label}' if prefix else label)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(baseline, results):
+    before = dict(flatten(baseline['spans']))
+    print(f"\n{'metric':<60} {'before':>12} {'after':>12} {'change':>8}")
+    for key, after in flatten(results['spans']):
+        if key in before and before[key] and not key.endswith(('days', 'span_days', 'rows', 'records', 'activities')):
+            print(f"{key:<60} {before[key]:>12} {after:>12} {(after - before[key]) / before[key]:>+8.0%}")
+
+
+def parse_days(text):
+    return [int(part) for part in text.split(',') if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest and query benchmarks against moto')
+    parser.add_argument('--spans', type=parse_days, default=[1, 7, 30], help='dataset lengths in days')
+    parser.add_argument('--query-days', type=parse_days, default=[1, 7, 30], help='windows to query')
+    parser.add_argument('--interval', type=int, default=60, help='seconds between synthetic readings')
+    parser.add_argument('--repeat', type=int, default=3, help='warm invocations per query; the fastest is kept')
+    parser.add_argument('--ingest-activities', type=int, default=1440, help='activities in the synthetic feed')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file from an earlier run to compare against')
+    args = parser.parse_args()
+
+    results = {'environment': environment(), 'parameters': vars(args) | {'compare': None, 'json': None}, 'spans': []}
+    for span_days in args.spans:
+        span = run_span(span_days, args.query_days, args.interval, args.repeat, args.ingest_activities)
+        results['spans'].append(span)
+        load = span['load']
+        print(f"span {span_days}d: loaded {load['records']} readings at {load['records_per_sec']:.0f}/s")
+        for query in span['queries']:
+            entries, series = query['entries'], query['series']
+            print(f"  days={query['days']:<5} rows={query['rows']:<8} entries cold={entries['cold_ms']}ms "
+                  f"warm={entries['warm_ms']}ms RU={entries['read_units']} json={entries['json_bytes']}B "
+                  f"columnar={entries['columnar_bytes']}B | series cold={series['cold_ms']}ms RU={series['read_units']}")
+        for name, ingest in span['ingest'].items():
+            print(f"  ingest {name}: {ingest['activities_per_sec']:.0f} activities/s, {ingest['capacity_units']} units")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.compare:
+        with open(args.compare) as source:
+            compare(json.load(source), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# feed_parse.py
+# Parse throughput and peak memory for a long archive feed: the streaming parser against the
+# previous whole-document ET.fromstring + findall + strptime approach.
+#
+#   python bench/feed_parse.py [--months 3] [--interval 60] [--json parse.json]
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'lambda'), os.path.join(ROOT, 'shared')]
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+
+import aurora_watch_lambda  # noqa: E402
+
+START = 1672531200  # 2023-01-01T00:00:00Z
+STATUSES = ['green', 'yellow', 'amber', 'red']
+
+
+def write_archive(path, months, interval):
+    count = months * 30 * 24 * 3600 // interval
+    with open(path, 'w') as output:
+        output.write('<root><updated><datetime>2023-01-01T00:00:00+00:00</datetime></updated>'
+                     '<activities>')
+        for i in range(count):
+            stamp = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(START + i * interval))
+            output.write(f'<activity status_id="{STATUSES[i % 4]}"><datetime>{stamp}</datetime>'
+                         f'<value>{i % 400}.5</value></activity>\n')
+        output.write('</activities></root>')
+    return count
+
+
+def whole_document(path):
+    """The parser this repo used before streaming."""
+    with open(path) as source:
+        root = ET.fromstring(source.read())
+    for activity in root.findall('.//activity'):
+        dt = datetime.strptime(activity.find('datetime').text, "%Y-%m-%dT%H:%M:%S%z")
+        yield {
+            'epochtime': int(dt.timestamp()),
+            'iso_string': dt.isoformat(),
+            'status_id': activity.get('status_id'),
+            'value': activity.find('value').text
+        }
+
+
+def streaming(path):
+    with open(path, 'rb') as source:
+        yield from aurora_watch_lambda.iter_activities(source)
+
+
+def measure(parser, path):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = sum(1 for _ in parser(path))
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'records': count, 'records_per_sec': count / elapsed, 'peak_mib': peak / 2 ** 20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Feed parser throughput and peak memory')
+    parser.add_argument('--months', type=int, default=3, help='length of the synthetic archive')
+    parser.add_argument('--interval', type=int, default=60, help='seconds between activities')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'archive.xml')
+        write_archive(path, args.months, args.interval)
+        size_mib = os.path.getsize(path) / 2 ** 20
+        results = {name: measure(function, path)
+                   for name, function in [('whole_document', whole_document), ('streaming', streaming)]}
+
+    print(f"archive: {args.months} months, {size_mib:.1f} MiB")
+    print(f"{'parser':<16} {'records':>10} {'records/sec':>14} {'peak MiB':>10}")
+    for name, result in results.items():
+        print(f"{name:<16} {result['records']:>10} {result['records_per_sec']:>14.0f} {result['peak_mib']:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'archive_mib': size_mib, 'parsers': results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# startup_profile.py
+# Cold-start report for the service Lambda: per-module import time and first-invocation latency.
+# Every measurement runs in a fresh interpreter so nothing is already imported.
+#
+#   python bench/startup_profile.py [--top 15] [--json startup.json]
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_DIR = os.path.join(ROOT, 'service')
+SHARED_DIR = os.path.join(ROOT, 'shared')
+
+# Runs against moto with a day of readings. moto imports boto3 first, so boto3's own import
+# cost shows up in the import-time table rather than in first_invocation_ms.
+INVOCATION_SCRIPT = r'''
+import json, os, time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+from moto import mock_aws
+mock = mock_aws()
+mock.start()
+import aurora_store, rollups
+aurora_store.create_readings_table()
+rollups.create_rollups_table()
+aurora_store.create_meta_table()
+now = int(time.time())
+aurora_store.batch_write([aurora_store.with_bucket({'epochtime': now - i * 3600, 'status_id': 'green', 'value': '1'})
+                          for i in range(24)])
+
+def invoke(handler, query):
+    started = time.perf_counter()
+    handler({'body': json.dumps({'query': query})}, None)
+    return (time.perf_counter() - started) * 1000
+
+started = time.perf_counter()
+import lambda_function
+timings = {'import_ms': (time.perf_counter() - started) * 1000}
+timings['first_invocation_ms'] = invoke(lambda_function.lambda_handler, 'query { auroraEntries(days: 1) { epochtime } }')
+timings['warm_invocation_ms'] = invoke(lambda_function.lambda_handler, 'query { auroraEntries(days: 1) { epochtime } }')
+timings['first_series_ms'] = invoke(lambda_function.lambda_handler, 'query { auroraSeries(days: 1) { epochtime max } }')
+print(json.dumps(timings))
+'''
+
+
+def environment():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([SERVICE_DIR, SHARED_DIR, env.get('PYTHONPATH', '')])
+    return env
+
+
+def import_times(module):
+    """Cumulative import time in ms per module, from python -X importtime."""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=SERVICE_DIR, env=environment(), capture_output=True, text=True, check=True)
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line.split(':', 1)[1].split('|'))
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def invocation_times():
+    completed = subprocess.run([sys.executable, '-c', INVOCATION_SCRIPT],
+                               cwd=SERVICE_DIR, env=environment(), capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold-start report for the service Lambda')
+    parser.add_argument('--top', type=int, default=15, help='number of slowest top-level imports to list')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    imports = import_times('lambda_function')
+    top_level = {name: ms for name, ms in imports.items() if '.' not in name}
+    slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:args.top]
+    invocations = invocation_times()
+
+    print(f"{'module':<30} {'cumulative import ms':>22}")
+    for name, ms in slowest:
+        print(f"{name:<30} {ms:>22.1f}")
+    print()
+    for name, ms in invocations.items():
+        print(f"{name:<30} {ms:>22.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'imports': dict(slowest), 'invocation': invocations}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# alerts.py
+# Incremental alert evaluation: only newly ingested activities are checked against the feed's
+# lower thresholds, and the current alert level is persisted between runs so a notification
+# goes out on an escalation (or the all-clear), not on every run that sees an elevated reading.
+# The peak level since the last all-clear is kept too, so the all-clear can reach everyone who
+# heard about the event even after it has eased below their threshold. Each station has its own state.
+import aurora_store
+
+STATUS_ORDER = ['green', 'yellow', 'amber', 'red']  # Least to most severe
+QUIET_LEVEL = 'green'
+
+
+def rank(status_id):
+    return STATUS_ORDER.index(status_id) if status_id in STATUS_ORDER else -1
+
+
+def level_for(activity, thresholds):
+    """The most severe status whose lower threshold the activity's value reaches."""
+    if not thresholds:
+        return activity['status_id']
+    value = float(activity['value'])
+    level = QUIET_LEVEL
+    for threshold in sorted(thresholds, key=lambda threshold: threshold['value']):
+        if value >= threshold['value']:
+            level = threshold['status_id']
+    return level
+
+
+def load_state(station=aurora_store.DEFAULT_STATION):
+    state = aurora_store.get_meta(aurora_store.station_meta('alert', station), consistent_read=True)
+    return {
+        'level': state.get('level', QUIET_LEVEL),
+        'peak': state.get('peak', state.get('level', QUIET_LEVEL)),
+        'since': int(state.get('since', 0)),
+        'last_epochtime': int(state.get('last_epochtime', 0)),
+        'last_notified_at': int(state.get('last_notified_at', 0))
+    }
+
+
+def save_state(state, station=aurora_store.DEFAULT_STATION):
+    aurora_store.update_meta(aurora_store.station_meta('alert', station), **state)
+
+
+def evaluate(activities, thresholds, state):
+    """Walk new activities in time order, returning the updated state and the transitions to notify.
+
+    Activities at or before the last evaluated epochtime were already seen and are ignored.
+    Escalations notify; dropping back to green notifies once as the all-clear; other
+    de-escalations only update the state. Each notification carries the event's peak level.
+    """
+    state = dict(state)
+    state.setdefault('peak', state['level'])
+    notifications = []
+    for activity in sorted(activities, key=lambda activity: activity['epochtime']):
+        if activity['epochtime'] <= state['last_epochtime']:
+            continue
+        state['last_epochtime'] = activity['epochtime']
+        level = level_for(activity, thresholds)
+        if level == state['level']:
+            continue
+        if rank(level) > rank(state['peak']):
+            state['peak'] = level
+        if rank(level) > rank(state['level']) or level == QUIET_LEVEL:
+            notifications.append({'from': state['level'], 'to': level, 'peak': state['peak'], 'activity': activity})
+        if level == QUIET_LEVEL:
+            state['peak'] = QUIET_LEVEL
+        state['level'] = level
+        state['since'] = activity['epochtime']
+    return state, notifications
@@ -1,121 +1,330 @@
+import calendar
+import gzip
+import io
 import json
+import logging
+import time
+import urllib.error
 import urllib.request
 import xml.etree.ElementTree as ET
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
 import boto3
 import os  # Import os to access environment variables
-from decimal import Decimal  # Add this import
+import alerts
+import archive
+import aurora_store
+import notifier
+import rollups
+import tracing
+import updates
 
-# Initialize DynamoDB and SNS clients
-dynamodb = boto3.resource('dynamodb')
+# Initialize SNS client
 sns = boto3.client('sns')
-table_name = 'aurora-warn-uk' 
-table = dynamodb.Table(table_name)
-
-# Get the SNS phone number from environment variables
-SNS_PHONE_NUMBER = os.environ.get('SNS_PHONE_NUMBER')  # Read from environment variable
-
-def parse_lower_thresholds(root):
-    thresholds = []
-    for threshold in root.findall('.//lower_threshold'):
-        thresholds.append({
-            'status_id': threshold.get('status_id'),
-            'value': int(threshold.text)
-        })
-    return thresholds
-
-def parse_datetime(root):
-    updated_str = root.find('.//updated/datetime').text
-    dt = datetime.strptime(updated_str, "%Y-%m-%dT%H:%M:%S%z")
-    return {
-        'epochtime': int(dt.timestamp()),
-        'iso_string': dt.isoformat()
+
+# DEBUG logs every parsed activity; keep it off the per-item path by default
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+FEED_URL = "https://aurorawatch-api.lancs.ac.uk/0.2.5/status/project/{station}/sum-activity.xml"
+API_URL = FEED_URL.format(station=aurora_store.DEFAULT_STATION)
+# Comma-separated AuroraWatch projects to ingest, each into its own partitions
+STATIONS = [station.strip() for station in os.environ.get('STATIONS', aurora_store.DEFAULT_STATION).split(',')
+            if station.strip()]
+FETCH_TIMEOUT_SECONDS = 10
+FETCH_ATTEMPTS = 3
+FETCH_BACKOFF_SECONDS = 1
+
+def fetch_feed(url, feed):
+    """Conditionally fetch the feed, returning (xml bytes, validators); the bytes are None on 304.
+
+    `feed` is the stored 'feed' meta item. Timeouts, connection errors and 5xx responses are
+    retried with exponential backoff; anything else is raised.
+    """
+    headers = {'Accept-Encoding': 'gzip'}
+    if feed.get('etag'):
+        headers['If-None-Match'] = feed['etag']
+    if feed.get('last_modified'):
+        headers['If-Modified-Since'] = feed['last_modified']
+    request = urllib.request.Request(url, headers=headers)
+    for attempt in range(FETCH_ATTEMPTS):
+        try:
+            with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT_SECONDS) as response:
+                data = response.read()
+                if response.headers.get('Content-Encoding') == 'gzip':
+                    data = gzip.decompress(data)
+                validators = {
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified')
+                }
+                return data, {key: value for key, value in validators.items() if value}
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None, {}
+            if e.code < 500 or attempt == FETCH_ATTEMPTS - 1:
+                raise
+            logger.warning("Feed fetch failed with HTTP %s, retrying", e.code)
+        except OSError as e:  # URLError, timeouts, and connections reset or dropped mid-response
+            if attempt == FETCH_ATTEMPTS - 1:
+                raise
+            logger.warning("Feed fetch failed (%s), retrying", e)
+        time.sleep(FETCH_BACKOFF_SECONDS * (2 ** attempt))
+
+def parse_timestamp(text):
+    """(epochtime, iso_string) for a feed timestamp.
+
+    The feed always uses 'YYYY-MM-DDTHH:MM:SS+HH:MM'; slicing those fixed positions is several
+    times faster than strptime, which remains the fallback for anything else.
+    """
+    if len(text) == 25 and text[10] == 'T' and text[19] in '+-' and text[22] == ':':
+        try:
+            seconds = calendar.timegm((int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                                       int(text[11:13]), int(text[14:16]), int(text[17:19])))
+            offset = int(text[20:22]) * 3600 + int(text[23:25]) * 60
+        except ValueError:
+            pass
+        else:
+            return (seconds - offset if text[19] == '+' else seconds + offset), text
+    dt = datetime.strptime(text, "%Y-%m-%dT%H:%M:%S%z")
+    return int(dt.timestamp()), dt.isoformat()
+
+def parse_value(text):
+    # Stored as a number; DynamoDB numbers round-trip through Decimal without float error
+    try:
+        return Decimal(text)
+    except (TypeError, InvalidOperation):
+        return text
+
+def iter_feed(source):
+    """Stream ('updated' | 'lower_threshold' | 'activity', record) pairs from a feed document.
+
+    Each handled element is detached from its parent once read, so memory stays flat however
+    many activities the document holds.
+    """
+    parents = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag == 'activity':
+            epochtime, iso_string = parse_timestamp(elem.findtext('datetime'))
+            record = {
+                'epochtime': epochtime,
+                'iso_string': iso_string,
+                'status_id': elem.get('status_id'),
+                'value': parse_value(elem.findtext('value'))
+            }
+        elif elem.tag == 'lower_threshold':
+            record = {
+                'status_id': elem.get('status_id'),
+                'value': int(elem.text)
+            }
+        elif elem.tag == 'updated':
+            epochtime, iso_string = parse_timestamp(elem.findtext('datetime'))
+            record = {
+                'epochtime': epochtime,
+                'iso_string': iso_string
+            }
+        else:
+            continue
+        if parents:
+            parents[-1].remove(elem)
+        yield elem.tag, record
+
+def iter_activities(source):
+    """Lazily yield only the activity records, e.g. from a long archive file."""
+    return (record for kind, record in iter_feed(source) if kind == 'activity')
+
+def parse_feed(source, known_updated=None):
+    """The feed's updated time, thresholds and activities.
+
+    The feed leads with its updated time; when that equals `known_updated` the feed has not been
+    republished, so parsing stops there and the thresholds and activities come back empty.
+    """
+    feed = {'datetime': None, 'lower_thresholds': [], 'activities': []}
+    for kind, record in iter_feed(source):
+        if kind == 'updated':
+            feed['datetime'] = record
+            if known_updated is not None and record['epochtime'] == known_updated:
+                break
+        elif kind == 'lower_threshold':
+            feed['lower_thresholds'].append(record)
+        else:
+            feed['activities'].append(record)
+    return feed
+
+def load_existing(epochtimes, station=aurora_store.DEFAULT_STATION):
+    """Fetch the station's stored items for the given epochtimes, keyed by epochtime."""
+    keys = [aurora_store.key_for(epochtime, station) for epochtime in sorted(set(epochtimes))]
+    return {int(item['epochtime']): item for item in aurora_store.batch_get(keys)}
+
+def is_unchanged(activity, stored):
+    return stored is not None and all(stored.get(key) == value for key, value in activity.items())
+
+def ingest_activities(activities, station=aurora_store.DEFAULT_STATION):
+    """Write only new or changed activities; the feed repeats the same rolling window every run.
+
+    Returns the written/skipped/retried counts and the activities that were written.
+    """
+    with tracing.span('diff'):
+        latest = {activity['epochtime']: aurora_store.with_bucket(activity, station) for activity in activities}
+        existing = load_existing(latest.keys(), station)
+        changed = [activity for epochtime, activity in sorted(latest.items())
+                   if not is_unchanged(activity, existing.get(epochtime))]
+        # Raw readings expire once archived; the TTL is stamped on write, so it counts from ingestion
+        changed = [archive.with_expiry(activity) for activity in changed]
+    with tracing.span('write'):
+        retried = aurora_store.batch_write(changed)
+    with tracing.span('rollups'):
+        rollups.update_rollups([activity['epochtime'] for activity in changed], station)
+    record_ingest(bool(changed))
+    counts = {
+        'written': len(changed),
+        'skipped': len(activities) - len(changed),
+        'retried': retried
     }
+    return counts, changed
 
-def parse_activities(root):
-    activities = []
-    for activity in root.findall('.//activity'):
-        datetime_str = activity.find('datetime').text
-        dt = datetime.strptime(datetime_str, "%Y-%m-%dT%H:%M:%S%z")
-        activity_record = {
-            'epochtime': int(dt.timestamp()),            
-            'iso_string': dt.isoformat(),
-            'status_id': activity.get('status_id'),
-            'value': activity.find('value').text
-        }
-        activities.append(activity_record)
-        print(activity_record)
-        write_to_dynamodb(activity_record)  # Write each activity to DynamoDB
-    return activities
+def record_ingest(changed):
+    # Readers cache until changed_at moves, and expect fresh data soon after ingested_at
+    now = int(time.time())
+    if changed:
+        aurora_store.update_meta('ingest', ingested_at=now, changed_at=now)
+    else:
+        aurora_store.update_meta('ingest', ingested_at=now)
 
-def write_to_dynamodb(activity):
+def record_status(station, activities=(), thresholds=None, updated=None):
+    """Keep the station's current status item, read by currentStatus and /status, up to date.
+
+    The newest activity, the thresholds and the feed's updated time go in one conditional write;
+    runs that found nothing new only move ingested_at, which readers use for their cache lifetime.
+    """
+    now = int(time.time())
+    if activities:
+        newest = max(activities, key=lambda activity: activity['epochtime'])
+        if aurora_store.update_latest(station, newest, thresholds=thresholds or [], updated=updated, ingested_at=now):
+            return
+    aurora_store.update_meta(aurora_store.latest_meta(station), ingested_at=now)
+
+def publish_updates(written, station=aurora_store.DEFAULT_STATION):
+    # Wake readers waiting on auroraUpdates; they re-read on their own timeout if this is lost
     try:
-        table.put_item(Item=activity)
-    except Exception as e:
-        print(f"Error writing to DynamoDB: {e}")
-
-def analyze_last_six_hours():
-    six_hours_ago = datetime.now(timezone.utc) - timedelta(hours=6)
-    six_hours_epoch = int(six_hours_ago.timestamp())
-
-    # Scan the DynamoDB table for records in the last six hours
-    response = table.scan(
-        FilterExpression="epochtime >= :six_hours_epoch",
-        ExpressionAttributeValues={":six_hours_epoch": Decimal(six_hours_epoch)}
-    )
-    
-    # Check if any records have status_id "green"
-    ar_records = [item for item in response['Items'] if item['status_id'] != 'green']
-    
-    if ar_records:
-        send_email(ar_records)
-
-def send_email(ar_records):
-    # Prepare the message
-    message = "The following measurements have amber or red status in the last six hours:\n\n"
-    for record in ar_records:
-        message += f"Timestamp: {record['iso_string']}, Status ID: {record['status_id']}, Value: {record['value']}\n"
-
-    # Publish the message to the SNS topic
+        with tracing.span('publish'):
+            updates.publish(written, station)
+    except Exception:
+        logger.exception("Failed to publish updates")
+
+def archive_months(station=aurora_store.DEFAULT_STATION):
+    # Compact closed months into the archive well before their raw readings expire; a failure is
+    # retried by the next run, and the grace between closing and expiry covers many runs
     try:
-        response = sns.publish(
-            TopicArn=os.environ['SNS_TOPIC_ARN'],  # Use the environment variable for the topic ARN
-            Message=message,
-            Subject='Aurora Watch Status Notification'  # Optional subject for the email
-        )
-        print(f"Email sent! Message ID: {response['MessageId']}")
-    except Exception as e:
-        print(f"Error sending email: {e}")
+        with tracing.span('archive'):
+            archived = archive.compact_due(station)
+        if archived:
+            logger.info("Archived %s months %s", station, archived)
+    except Exception:
+        logger.exception("Failed to archive %s", station)
+
+def check_alerts(activities, thresholds, station=aurora_store.DEFAULT_STATION):
+    """Evaluate activities not yet seen by the station's alert state against the thresholds and notify on transitions."""
+    state = alerts.load_state(station)
+    new_state, notifications = alerts.evaluate(activities, thresholds, state)
+    notifications = [dict(notification, station=station) for notification in notifications]
+    # Dispatch even without new transitions, so deliveries that failed last run are retried
+    counts = send_notifications(notifications)
+    if counts['sent']:
+        new_state['last_notified_at'] = int(time.time())
+    if new_state != state:
+        alerts.save_state(new_state, station)
+    return {'level': new_state['level'], 'notifications': len(notifications)}
+
+def send_notifications(notifications):
+    """Fan the transitions out to every subscriber whose threshold they reach."""
+    dispatcher = notifier.Dispatcher(notifier.sns_senders(sns))
+    counts = dispatcher.dispatch(notifications, notifier.load_subscribers())
+    logger.info("Notifications: %s", counts)
+    return counts
 
 def lambda_handler(event, context):
-    api_url = "https://aurorawatch-api.lancs.ac.uk/0.2.5/status/project/awn/sum-activity.xml"
-    
+    tracing.start('ingest')
+    responses = {station: run_ingest(station) for station in STATIONS}
+    status_code = max(response['statusCode'] for response in responses.values())
+    # One structured record per invocation with the span timings and consumed capacity
+    tracing.finish(statusCode=status_code)
+    if len(responses) == 1:
+        return next(iter(responses.values()))
+    return {
+        'statusCode': status_code,
+        'body': json.dumps({station: json.loads(response['body']) for station, response in responses.items()})
+    }
+
+def run_ingest(station=aurora_store.DEFAULT_STATION):
+    # A failing station does not stop the others; each keeps its own feed validators and alert state
+    feed_meta = aurora_store.station_meta('feed', station)
     try:
-        with urllib.request.urlopen(api_url) as response:
-            xml_data = response.read().decode()
+        feed = aurora_store.get_meta(feed_meta)
+        with tracing.span('fetch'):
+            xml_data, validators = fetch_feed(FEED_URL.format(station=station), feed)
+        if xml_data is None:
+            # 304: nothing has changed since the last run
+            record_ingest(False)
+            record_status(station)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'skipped': 'not modified'})
+            }
         
         # Parse XML
-        root = ET.fromstring(xml_data)
+        with tracing.span('parse'):
+            feed_data = parse_feed(io.BytesIO(xml_data), feed.get('updated'))
         
         # Extract relevant information
-        datetime_info = parse_datetime(root)
-        lower_thresholds = parse_lower_thresholds(root)
-        activities = parse_activities(root)
+        datetime_info = feed_data['datetime']
+        if feed.get('updated') == datetime_info['epochtime']:
+            # Served again without validators, but the feed has not been republished
+            record_ingest(False)
+            record_status(station)
+            if validators:
+                aurora_store.update_meta(feed_meta, **validators)
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'datetime': datetime_info, 'skipped': 'unchanged'})
+            }
+        lower_thresholds = feed_data['lower_thresholds']
+        activities = feed_data['activities']
+        logger.debug("Activities: %s", activities)
+        ingest, written = ingest_activities(activities, station)
+        logger.info("Ingest %s: %s", station, ingest)
+        record_status(station, activities, lower_thresholds, datetime_info['epochtime'])
+        publish_updates(written, station)
+        
+        # Alert on every activity in the feed: the stored alert state skips those already evaluated,
+        # and readings written by a run that failed before alerting are still caught by the next one
+        with tracing.span('alerts'):
+            alert = check_alerts(activities, lower_thresholds, station)
         
-        # Analyze the last six hours for green status
-        analyze_last_six_hours()
+        # Only remember the feed once it has been fully processed, so a failed run fetches and parses
+        # it again. Its writes are then skipped as unchanged and alerting resumes from the stored alert
+        # state, but the update announcement is not repeated; long-polling readers pick those
+        # readings up on their next poll.
+        aurora_store.update_meta(feed_meta, updated=datetime_info['epochtime'], **validators)
+        archive_months(station)
         
         result = {
             'datetime': datetime_info,
             'lower_thresholds': lower_thresholds,
-            'activities': activities
+            'activities': activities,
+            'ingest': ingest,
+            'alert': alert
         }
         
         return {
             'statusCode': 200,
-            'body': json.dumps(result)
+            'body': json.dumps(result, default=float)
         }
     except Exception as e:
+        logger.exception("Ingest of %s failed", station)
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
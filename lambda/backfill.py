@@ -0,0 +1,360 @@
+# backfill.py
+# Bulk-load archived AuroraWatch feed files into the readings table, reusing the ingest parser.
+# Files are parsed in worker processes (parsing is CPU-bound, so threads would share one core)
+# a few files ahead of the writers, their activities streamed back in chunks through bounded
+# queues and written in batches by a thread pool; a checkpoint file records how far each archive
+# got, so an interrupted run resumes where it left off. Writes are paced by an adaptive rate that halves whenever DynamoDB pushes back. With an
+# archive configured, the closed months each file covers are compacted into it once written.
+#
+#   PYTHONPATH=shared python lambda/backfill.py archive/*.xml [--station awn] [--workers 8] [--checkpoint backfill.json] [--local]
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from botocore.exceptions import ClientError
+import archive
+import aurora_store
+import rollups
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+THROTTLE_ERRORS = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+PARSE_WORKERS = 2  # Processes; 0 parses in the calling thread
+WRITE_WORKERS = 8
+MAX_PENDING_BATCHES = 64  # Parsed batches waiting for a writer; bounds memory on huge archives
+PARSE_CHUNK_SIZE = 1000  # Activities per message from a parse worker
+PARSE_QUEUE_CHUNKS = 4  # Messages a parse worker may get ahead of the writers, per file
+CHECKPOINT_SECONDS = 5
+ROLLUP_SECONDS = 31 * rollups.DAY  # Rollups are recomputed about a month of readings at a time
+
+
+class Throttle:
+    """Additive-increase, multiplicative-decrease pacing of batch requests across threads."""
+
+    def __init__(self, rate=50.0, min_rate=1.0, max_rate=2000.0, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.clock = clock
+        self.sleep = sleep
+        self.next_at = 0.0
+        self.throttled_count = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = self.clock()
+            slot = max(now, self.next_at)
+            self.next_at = slot + 1 / self.rate
+        if slot > now:
+            self.sleep(slot - now)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 1)
+
+    def throttled(self):
+        with self.lock:
+            self.throttled_count += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+
+
+def write_batch(items, throttle, table_name=aurora_store.READINGS_TABLE):
+    """Write up to BATCH_WRITE_SIZE items, slowing down on throughput errors or unprocessed items."""
+    requests = [{'PutRequest': {'Item': item}} for item in items]
+    while requests:
+        throttle.wait()
+        try:
+            response = aurora_store.resource().batch_write_item(RequestItems={table_name: requests})
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLE_ERRORS:
+                raise
+            throttle.throttled()
+            continue
+        requests = response.get('UnprocessedItems', {}).get(table_name, [])
+        if requests:
+            throttle.throttled()
+        else:
+            throttle.succeeded()
+
+
+class Checkpoint:
+    """Per-file progress: the last epochtime below which every activity is known to be written."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.saved_at = 0.0
+        self.files = {}
+        if path and os.path.exists(path):
+            with open(path) as source:
+                self.files = json.load(source)
+
+    def position(self, name):
+        return self.files.get(name, {}).get('epochtime', 0)
+
+    def is_done(self, name):
+        return self.files.get(name, {}).get('done', False)
+
+    def advance(self, name, epochtime=None, done=False):
+        with self.lock:
+            entry = self.files.setdefault(name, {'epochtime': 0, 'done': False})
+            if epochtime is not None:
+                entry['epochtime'] = max(entry['epochtime'], epochtime)
+            entry['done'] = entry['done'] or done
+        if done or time.monotonic() - self.saved_at >= CHECKPOINT_SECONDS:
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w') as output:
+                json.dump(self.files, output, indent=2)
+            os.replace(temporary, self.path)  # Never leave a half-written checkpoint
+            self.saved_at = time.monotonic()
+
+
+class FileProgress:
+    """Tracks out-of-order batch completion so the checkpoint only covers a fully written prefix."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.submitted = []  # Last epochtime of each batch, in file order
+        self.completed = set()
+        self.contiguous = 0
+
+    def submit(self, last_epochtime):
+        with self.lock:
+            self.submitted.append(last_epochtime)
+            return len(self.submitted) - 1
+
+    def complete(self, index):
+        """Mark a batch written; returns the new checkpoint epochtime, or None if it has not moved."""
+        with self.lock:
+            self.completed.add(index)
+            moved = None
+            while self.contiguous in self.completed:
+                moved = self.submitted[self.contiguous]
+                self.completed.discard(self.contiguous)
+                self.contiguous += 1
+            return moved
+
+
+def batches(records, size=aurora_store.BATCH_WRITE_SIZE, station=aurora_store.DEFAULT_STATION):
+    batch = []
+    for record in records:
+        batch.append(archive.with_expiry(aurora_store.with_bucket(record, station)))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def update_rollups(first, last, station=aurora_store.DEFAULT_STATION):
+    """Recompute rollups for every hour from first to last in month-sized slices, so a long archive
+    is never read back all at once."""
+    start = rollups.period_start(first, 'hour')
+    while start <= last:
+        end = min(start + ROLLUP_SECONDS, last + 1)
+        rollups.update_rollups(range(start, end, rollups.HOUR), station)
+        start = end
+
+
+def archive_months(first, last, station=aurora_store.DEFAULT_STATION, now=None):
+    """Archive the closed months between two epochtimes of an archive file."""
+    now = int(time.time()) if now is None else now
+    start = archive.month_start(first)
+    while start <= last and archive.next_month(start) <= now - archive.GRACE_SECONDS:
+        archive.compact_month(start, station)
+        start = archive.next_month(start)
+
+
+def iter_file(path):
+    """Lazily yield every activity in an archive file."""
+    from aurora_watch_lambda import iter_activities  # Creates an SNS client at import, after --local
+    with open(path, 'rb') as source:
+        yield from iter_activities(source)
+
+
+def parse_file(path, chunks, size=PARSE_CHUNK_SIZE):
+    """Put an archive file's activities on a queue in lists of `size`, then None. Runs in a worker process.
+
+    The queue is bounded, so a worker that gets ahead of the writers waits rather than holding
+    the rest of its file in memory.
+    """
+    try:
+        chunk = []
+        for activity in iter_file(path):
+            chunk.append(activity)
+            if len(chunk) == size:
+                chunks.put(chunk)
+                chunk = []
+        if chunk:
+            chunks.put(chunk)
+    finally:
+        chunks.put(None)
+
+
+def iter_chunks(chunks, future):
+    """The activities a worker puts on a queue, re-raising its error once it stops."""
+    while (chunk := chunks.get()) is not None:
+        yield from chunk
+    future.result()
+
+
+def parsed_files(paths, parse_workers=PARSE_WORKERS):
+    """Yield (path, activities) in order, parsing at most parse_workers files ahead of the caller.
+
+    Activities stream from the workers as they are parsed; each must be consumed before the next
+    file is taken.
+    """
+    if not parse_workers:
+        for path in paths:
+            yield path, iter_file(path)
+        return
+    # Spawned rather than forked: the writer threads may hold locks a forked child would inherit
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=parse_workers, mp_context=context) as parsers:
+        # Leaving early shuts the manager down first, so workers blocked on a full queue fail and exit
+        with context.Manager() as manager:
+            pending = deque()
+            for path in paths:
+                chunks = manager.Queue(maxsize=PARSE_QUEUE_CHUNKS)
+                pending.append((path, iter_chunks(chunks, parsers.submit(parse_file, path, chunks))))
+                if len(pending) > parse_workers:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+
+
+class Backfill:
+
+    def __init__(self, checkpoint, throttle=None, write_workers=WRITE_WORKERS, with_rollups=True,
+                 station=aurora_store.DEFAULT_STATION, with_archive=True):
+        self.checkpoint = checkpoint
+        self.with_archive = with_archive
+        self.station = station
+        self.throttle = throttle or Throttle()
+        self.writers = ThreadPoolExecutor(max_workers=write_workers)
+        self.pending = threading.BoundedSemaphore(MAX_PENDING_BATCHES)
+        self.with_rollups = with_rollups
+        self.records = 0
+        self.lock = threading.Lock()
+
+    def load_file(self, path, activities):
+        name = os.path.abspath(path)
+        resume_after = self.checkpoint.position(name)
+        progress = FileProgress()
+        futures = []
+        loaded = 0
+        first = last = None
+
+        def unwritten():
+            nonlocal first, last
+            for activity in activities:
+                epochtime = activity['epochtime']
+                first = epochtime if first is None else min(first, epochtime)
+                last = epochtime if last is None else max(last, epochtime)
+                if epochtime > resume_after:
+                    yield activity
+
+        for batch in batches(unwritten(), station=self.station):
+            loaded += len(batch)
+            self.pending.acquire()
+            index = progress.submit(batch[-1]['epochtime'])
+            futures.append(self.writers.submit(self.write, name, batch, progress, index))
+        for future in futures:
+            future.result()  # Re-raise any write failure before the file is marked done
+        if first is not None and self.with_rollups:
+            # The whole file, not just this run's part: an interrupted run never rolled up what it wrote
+            update_rollups(first, last, self.station)
+        if first is not None and self.with_archive and archive.get_store():
+            # Backfilled history is mostly past the ingester's lookback, so archive it here
+            archive_months(first, last, self.station)
+        self.checkpoint.advance(name, done=True)
+        logger.info("Loaded %s: %d activities", path, loaded)
+        return loaded
+
+    def write(self, name, batch, progress, index):
+        try:
+            write_batch(batch, self.throttle)
+        finally:
+            self.pending.release()
+        with self.lock:
+            self.records += len(batch)
+        epochtime = progress.complete(index)
+        if epochtime is not None:
+            self.checkpoint.advance(name, epochtime)
+
+    def run(self, paths, parse_workers=PARSE_WORKERS):
+        started = time.perf_counter()
+        remaining = [path for path in paths if not self.checkpoint.is_done(os.path.abspath(path))]
+        for path in sorted(set(paths) - set(remaining)):
+            logger.info("Skipping %s: already loaded", path)
+        loaded = 0
+        try:
+            for path, activities in parsed_files(remaining, parse_workers):
+                loaded += self.load_file(path, activities)
+        finally:
+            self.writers.shutdown()
+            self.checkpoint.save()
+        if loaded:
+            # Readers cache by changed_at, so make them pick up the backfilled history
+            aurora_store.update_meta('ingest', changed_at=int(time.time()))
+        elapsed = time.perf_counter() - started
+        return {
+            'records': loaded,
+            'seconds': round(elapsed, 3),
+            'records_per_sec': round(loaded / elapsed, 1) if elapsed else 0.0,
+            'throttled': self.throttle.throttled_count,
+            'final_rate': round(self.throttle.rate, 1)
+        }
+
+
+def create_local_tables():
+    """Start moto and create the tables, for trying a backfill without AWS."""
+    from moto import mock_aws
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    mock = mock_aws()
+    mock.start()
+    aurora_store.create_readings_table()
+    rollups.create_rollups_table()
+    aurora_store.create_meta_table()
+    return mock
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s %(message)s')
+    parser = argparse.ArgumentParser(description='Bulk-load archived AuroraWatch feed files')
+    parser.add_argument('paths', nargs='+', help='archive feed XML files')
+    parser.add_argument('--station', default=aurora_store.DEFAULT_STATION, help='station the archives belong to')
+    parser.add_argument('--checkpoint', default='backfill-checkpoint.json', help='progress file for resuming')
+    parser.add_argument('--workers', type=int, default=WRITE_WORKERS, help='concurrent batch writers')
+    parser.add_argument('--parse-workers', type=int, default=PARSE_WORKERS, help='processes parsing files ahead of the writers (0: parse inline)')
+    parser.add_argument('--rate', type=float, default=50.0, help='initial batch requests per second')
+    parser.add_argument('--no-rollups', action='store_true', help='skip recomputing hourly and daily rollups')
+    parser.add_argument('--no-archive', action='store_true', help='skip archiving closed months (when ARCHIVE_BUCKET or ARCHIVE_DIR is set)')
+    parser.add_argument('--local', action='store_true', help='write to an in-process moto DynamoDB')
+    args = parser.parse_args()
+
+    if args.local:
+        create_local_tables()
+    backfill = Backfill(Checkpoint(args.checkpoint), Throttle(rate=args.rate),
+                        write_workers=args.workers, with_rollups=not args.no_rollups, station=args.station,
+                        with_archive=not args.no_archive)
+    print(json.dumps(backfill.run(args.paths, parse_workers=args.parse_workers), indent=2))
+
+
+if __name__ == "__main__":
+    main()
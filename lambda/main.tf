@@ -12,11 +12,20 @@ resource "aws_lambda_function" "aurora_watch" {
   handler       = "aurora_watch_lambda.lambda_handler"
   runtime          = "python3.12"
   source_code_hash = filebase64("${path.root}/harvest-function.zip")
+  # Three 10 second fetch attempts with 1 + 2 seconds of backoff, then up to 20 seconds of
+  # notification fan-out; the 3 second default cannot fit even one slow fetch
+  timeout          = 60
 
   environment {
     variables = {
       PYTHONPATH = "/var/task"
       SNS_TOPIC_ARN = aws_sns_topic.notifications.arn  # Add this line
+      READINGS_TABLE = aws_dynamodb_table.aurora_readings_table.name
+      ROLLUPS_TABLE = aws_dynamodb_table.aurora_rollups_table.name
+      META_TABLE = aws_dynamodb_table.aurora_meta_table.name
+      STATIONS = "awn"  # Comma-separated AuroraWatch projects, each ingested into its own partitions
+      ARCHIVE_BUCKET = aws_s3_bucket.archive.bucket
+      RAW_RETENTION_DAYS = "400"  # Raw readings expire after this; closed months are archived well before
     }
   }
 }
@@ -54,8 +63,13 @@ resource "aws_iam_policy" "dynamodb_put_item" {
     Statement = [
       {
         Effect = "Allow"
-        Action = ["dynamodb:PutItem", "dynamodb:Scan"]
-        Resource = aws_dynamodb_table.aurora_watch_table.arn
+        Action = ["dynamodb:PutItem", "dynamodb:Scan", "dynamodb:Query", "dynamodb:BatchGetItem", "dynamodb:BatchWriteItem", "dynamodb:GetItem", "dynamodb:UpdateItem"]
+        Resource = [
+          aws_dynamodb_table.aurora_watch_table.arn,
+          aws_dynamodb_table.aurora_readings_table.arn,
+          aws_dynamodb_table.aurora_rollups_table.arn,
+          aws_dynamodb_table.aurora_meta_table.arn
+        ]
       }
     ]
   })
@@ -102,6 +116,134 @@ resource "aws_dynamodb_table" "aurora_watch_table" {
   }
 }
 
+# Readings partitioned by station and UTC day so one station's time window is key-range Queries.
+# Populate from the table above once with: python shared/aurora_store.py
+# Items written before stations existed move under awn with: python shared/aurora_store.py stations
+resource "aws_dynamodb_table" "aurora_readings_table" {
+  name         = "aurora-warn-uk-readings"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "bucket"
+  range_key    = "epochtime"
+
+  attribute {
+    name = "bucket"  # Station and UTC day, awn#YYYY-MM-DD
+    type = "S"
+  }
+
+  attribute {
+    name = "epochtime"
+    type = "N"
+  }
+
+  # Set on write from RAW_RETENTION_DAYS; by then the month is in the archive bucket
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = {
+    Name = "Aurora Watch Readings Table"
+  }
+}
+
+# Closed months of readings as compressed columnar blobs, readings/<station>/YYYY-MM.aua.
+# The service reads archived months from here instead of the readings table.
+resource "aws_s3_bucket" "archive" {
+  bucket = "aurora-warn-uk-archive"
+
+  tags = {
+    Name = "Aurora Watch Readings Archive"
+  }
+}
+
+resource "aws_s3_bucket_public_access_block" "archive" {
+  bucket                  = aws_s3_bucket.archive.id
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+resource "aws_iam_policy" "archive_write_policy" {
+  name        = "AuroraArchiveWritePolicy"
+  description = "Policy to allow the ingest Lambda to read and write archived months"
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["s3:GetObject", "s3:PutObject"]
+        Resource = "${aws_s3_bucket.archive.arn}/*"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "attach_archive_write_policy" {
+  role       = aws_iam_role.lambda_exec.name
+  policy_arn = aws_iam_policy.archive_write_policy.arn
+}
+
+# Hourly (partitioned by month) and daily (partitioned by year) rollups of the readings,
+# recomputed by the ingest Lambda for the periods it writes. Older history is filled in with:
+# python shared/rollups.py rebuild <first YYYY-MM-DD> <last YYYY-MM-DD>
+resource "aws_dynamodb_table" "aurora_rollups_table" {
+  name         = "aurora-warn-uk-rollups"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "bucket"
+  range_key    = "epochtime"
+
+  attribute {
+    name = "bucket"  # Station and period, awn#hour#YYYY-MM or awn#day#YYYY
+    type = "S"
+  }
+
+  attribute {
+    name = "epochtime"  # Start of the hour or day
+    type = "N"
+  }
+
+  tags = {
+    Name = "Aurora Watch Rollups Table"
+  }
+}
+
+# Small named state items, e.g. 'ingest' with the last ingestion and data change times.
+# Each station's newest reading ('latest#<station>', kind 'latest') is indexed by kind, so
+# every station's latest status is one Query.
+resource "aws_dynamodb_table" "aurora_meta_table" {
+  name         = "aurora-warn-uk-meta"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "name"
+
+  attribute {
+    name = "name"
+    type = "S"
+  }
+
+  attribute {
+    name = "kind"
+    type = "S"
+  }
+
+  attribute {
+    name = "station"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name            = "kind-index"
+    hash_key        = "kind"
+    range_key       = "station"
+    projection_type = "ALL"
+  }
+
+  tags = {
+    Name = "Aurora Watch Meta Table"
+  }
+}
+
 
 # SNS email configuration
 
@@ -116,6 +258,15 @@ resource "aws_iam_policy" "sns_publish_policy" {
         Effect = "Allow"
         Action = "sns:Publish"
         Resource = aws_sns_topic.notifications.arn
+      },
+      {
+        # SMS is published straight to phone numbers, which have no ARN to name; excluding every
+        # SNS ARN allows that direct publishing (SNS_PHONE_NUMBER and the sms subscribers on the
+        # meta table) without also allowing publishing to any topic
+        Sid = "PublishSms"
+        Effect = "Allow"
+        Action = "sns:Publish"
+        NotResource = "arn:aws:sns:*:*:*"
       }
     ]
   })
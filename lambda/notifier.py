@@ -0,0 +1,248 @@
+# notifier.py
+# Fan-out of alert notifications to subscribers over several channels: the email SNS topic,
+# SMS through SNS and JSON webhooks. Each subscriber's threshold (explicit, or implied by where
+# they watch from) picks the notifications they get, optionally only for the stations they list; subscribers that get the same ones on the
+# same channel form an audience and share one rendered message. Deliveries run on a bounded
+# pool, each channel under its own rate limit, and a message already sent to an address within
+# the dedup window is not sent again. Deliveries that fail or run out of time are kept on the
+# meta item and retried by the next run, until the dedup window has passed.
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import alerts
+import aurora_store
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_WORKERS = 8
+DISPATCH_SECONDS = 20  # Deliveries not started by then are dropped, leaving the Lambda time to finish
+DEDUP_SECONDS = 6 * 60 * 60
+WEBHOOK_TIMEOUT_SECONDS = 5
+SMS_MAX_LENGTH = 160
+TOKEN_EPSILON = 1e-9
+DEFAULT_LEVEL = 'yellow'
+
+# Sends per second and burst size for each channel; SNS SMS has the tightest account quota
+CHANNEL_RATES = {'email': (10, 10), 'sms': (5, 5), 'webhook': (5, 10)}
+
+# Lowest level worth hearing about from each place, after AuroraWatch UK's guidance on where
+# the aurora may be seen at each alert level
+LOCATION_LEVELS = {
+    'scotland': 'yellow',
+    'northern-ireland': 'amber',
+    'northern-england': 'amber',
+    'wales': 'red',
+    'midlands': 'red',
+    'southern-england': 'red'
+}
+
+
+class RateLimiter:
+    """Token bucket shared by a channel's delivery threads."""
+
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # Refills accumulate float error, so a bucket a hair under one token counts as full
+                if self.tokens >= 1 - TOKEN_EPSILON:
+                    self.tokens = max(0.0, self.tokens - 1)
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+def threshold_for(subscriber):
+    """The stricter of the subscriber's own minimum level and the one their location implies."""
+    levels = [subscriber.get('min_level') or DEFAULT_LEVEL]
+    if subscriber.get('location') in LOCATION_LEVELS:
+        levels.append(LOCATION_LEVELS[subscriber['location']])
+    return max(levels, key=alerts.rank)
+
+
+def wants(subscriber, notification):
+    station = notification.get('station', aurora_store.DEFAULT_STATION)
+    if subscriber.get('stations') and station not in subscriber['stations']:
+        return False
+    threshold = alerts.rank(threshold_for(subscriber))
+    if notification['to'] == alerts.QUIET_LEVEL:
+        # The all-clear goes to everyone the event reached
+        return alerts.rank(notification.get('peak', notification['from'])) >= threshold
+    return alerts.rank(notification['to']) >= threshold
+
+
+def station_label(notification):
+    # The AWN feed was the only one before stations existed; its messages read as they always did
+    station = notification.get('station', aurora_store.DEFAULT_STATION)
+    return '' if station == aurora_store.DEFAULT_STATION else f"[{station}] "
+
+
+def describe(notification):
+    activity = notification['activity']
+    return (f"{station_label(notification)}{notification['from']} -> {notification['to']} at {activity['iso_string']} "
+            f"(value {activity['value']})")
+
+
+def render_email(notifications):
+    last = notifications[-1]
+    subject = ('Aurora Watch: all clear' if last['to'] == alerts.QUIET_LEVEL
+               else f"Aurora Watch: {last['to']} alert")
+    lines = ["The Aurora Watch alert level has changed:", ""]
+    lines.extend(describe(notification) for notification in notifications)
+    return {'subject': subject, 'body': "\n".join(lines) + "\n"}
+
+
+def render_sms(notifications):
+    last = notifications[-1]
+    headline = ('AuroraWatch UK: all clear' if last['to'] == alerts.QUIET_LEVEL
+                else f"AuroraWatch UK: {last['to'].upper()} alert")
+    body = f"{station_label(last)}{headline} at {last['activity']['iso_string']} (value {last['activity']['value']})"
+    return {'body': body[:SMS_MAX_LENGTH]}
+
+
+def render_webhook(notifications):
+    return {'body': json.dumps({'notifications': [
+        {'station': notification.get('station', aurora_store.DEFAULT_STATION),
+         'from': notification['from'], 'to': notification['to'], 'peak': notification.get('peak'),
+         'epochtime': int(notification['activity']['epochtime']),
+         'value': float(notification['activity']['value'])}
+        for notification in notifications
+    ]}, separators=(',', ':'))}
+
+
+RENDERERS = {'email': render_email, 'sms': render_sms, 'webhook': render_webhook}
+
+
+def sns_senders(sns):
+    def send_email(address, message):
+        return sns.publish(TopicArn=address, Subject=message['subject'], Message=message['body'])['MessageId']
+
+    def send_sms(address, message):
+        return sns.publish(PhoneNumber=address, Message=message['body'])['MessageId']
+
+    return {'email': send_email, 'sms': send_sms, 'webhook': send_webhook}
+
+
+def send_webhook(address, message):
+    request = urllib.request.Request(address, data=message['body'].encode(), method='POST',
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT_SECONDS) as response:
+        return response.status
+
+
+def load_subscribers():
+    """Subscribers stored on the 'subscribers' meta item, plus the topic and phone number from the environment."""
+    subscribers = list(aurora_store.get_meta('subscribers').get('subscribers', []))
+    if os.environ.get('SNS_TOPIC_ARN'):
+        subscribers.append({'id': 'topic', 'channel': 'email', 'address': os.environ['SNS_TOPIC_ARN']})
+    if os.environ.get('SNS_PHONE_NUMBER'):
+        subscribers.append({'id': 'phone', 'channel': 'sms', 'address': os.environ['SNS_PHONE_NUMBER']})
+    return subscribers
+
+
+def load_deliveries():
+    """When each recent delivery was sent, and the deliveries still waiting to be retried."""
+    item = aurora_store.get_meta('notified', consistent_read=True)
+    sent = {key: int(sent_at) for key, sent_at in item.get('sent', {}).items()}
+    pending = [dict(delivery, queued_at=int(delivery['queued_at'])) for delivery in item.get('pending', [])]
+    return sent, pending
+
+
+def save_deliveries(sent, pending):
+    aurora_store.update_meta('notified', sent=sent, pending=pending)
+
+
+def delivery_key(channel, address, message):
+    text = json.dumps([channel, address, message], sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:20]
+
+
+class Dispatcher:
+
+    def __init__(self, senders, rates=CHANNEL_RATES, workers=DISPATCH_WORKERS, budget_seconds=DISPATCH_SECONDS,
+                 dedup_seconds=DEDUP_SECONDS, clock=time.monotonic, sleep=time.sleep):
+        self.senders = senders  # channel -> (address, message) -> delivery id
+        self.limiters = {channel: RateLimiter(rate, burst, clock, sleep) for channel, (rate, burst) in rates.items()}
+        self.workers = workers
+        self.budget_seconds = budget_seconds
+        self.dedup_seconds = dedup_seconds
+        self.clock = clock
+
+    def plan(self, notifications, subscribers):
+        """Deliveries as (channel, address, message), one rendering per audience and one delivery per address."""
+        audiences = {}
+        for subscriber in subscribers:
+            channel = subscriber.get('channel')
+            if channel not in RENDERERS or channel not in self.senders:
+                logger.warning("Skipping subscriber %s on unknown channel %s", subscriber.get('id'), channel)
+                continue
+            relevant = tuple(i for i, notification in enumerate(notifications) if wants(subscriber, notification))
+            if relevant:
+                audiences.setdefault((channel, relevant), set()).add(subscriber['address'])
+        deliveries = []
+        for (channel, relevant), addresses in audiences.items():
+            message = RENDERERS[channel]([notifications[i] for i in relevant])
+            deliveries.extend((channel, address, message) for address in sorted(addresses))
+        return deliveries, len(audiences)
+
+    def dispatch(self, notifications, subscribers, now=None):
+        """Retry pending deliveries and send the new ones not already sent within the dedup window.
+
+        Returns counts; failed and expired deliveries stay pending for the next run.
+        """
+        now = int(time.time()) if now is None else now
+        deliveries, audiences = self.plan(notifications, subscribers)
+        sent_at, pending = load_deliveries()
+        if not deliveries and not pending:
+            return {'audiences': 0, 'sent': 0, 'failed': 0, 'expired': 0, 'duplicates': 0}
+        sent_at = {key: at for key, at in sent_at.items() if now - at < self.dedup_seconds}
+        queue = {delivery['key']: delivery for delivery in pending if now - delivery['queued_at'] < self.dedup_seconds}
+        duplicates = 0
+        for channel, address, message in deliveries:
+            key = delivery_key(channel, address, message)
+            if key in sent_at or key in queue:
+                duplicates += 1
+            else:
+                queue[key] = {'key': key, 'channel': channel, 'address': address, 'message': message,
+                              'queued_at': now}
+        deadline = self.clock() + self.budget_seconds
+
+        def deliver(delivery):
+            if self.clock() >= deadline:
+                return delivery, 'expired'
+            self.limiters[delivery['channel']].acquire()
+            try:
+                self.senders[delivery['channel']](delivery['address'], delivery['message'])
+                return delivery, 'sent'
+            except Exception as error:
+                logger.error("Error sending %s notification to %s: %s", delivery['channel'], delivery['address'], error)
+                return delivery, 'failed'
+
+        counts = {'audiences': audiences, 'sent': 0, 'failed': 0, 'expired': 0, 'duplicates': duplicates}
+        retry = []
+        if queue:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(queue))) as pool:
+                for delivery, outcome in pool.map(deliver, queue.values()):
+                    counts[outcome] += 1
+                    if outcome == 'sent':
+                        sent_at[delivery['key']] = now
+                    else:
+                        retry.append(delivery)
+        save_deliveries(sent_at, retry)
+        return counts
@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+from moto import mock_aws
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'shared'))
+
+import alerts
+import aurora_store
+
+THRESHOLDS = [
+    {'status_id': 'green', 'value': 0},
+    {'status_id': 'yellow', 'value': 50},
+    {'status_id': 'amber', 'value': 100},
+    {'status_id': 'red', 'value': 200}
+]
+
+QUIET = {'level': 'green', 'peak': 'green', 'since': 0, 'last_epochtime': 0, 'last_notified_at': 0}
+
+
+def activity(epochtime, value, status_id='green'):
+    return {'epochtime': epochtime, 'iso_string': str(epochtime), 'status_id': status_id, 'value': str(value)}
+
+
+class TestEvaluate(unittest.TestCase):
+
+    def test_level_uses_the_highest_threshold_reached(self):
+        self.assertEqual(alerts.level_for(activity(1, 49.9), THRESHOLDS), 'green')
+        self.assertEqual(alerts.level_for(activity(1, 100), THRESHOLDS), 'amber')
+        self.assertEqual(alerts.level_for(activity(1, 350), THRESHOLDS), 'red')
+
+    def test_level_falls_back_to_the_feed_status_without_thresholds(self):
+        self.assertEqual(alerts.level_for(activity(1, 5, 'yellow'), []), 'yellow')
+
+    def test_escalation_notifies_once(self):
+        state, notifications = alerts.evaluate(
+            [activity(3, 60), activity(1, 10), activity(2, 55)], THRESHOLDS, QUIET)
+        self.assertEqual([(n['from'], n['to']) for n in notifications], [('green', 'yellow')])
+        self.assertEqual(state['level'], 'yellow')
+        self.assertEqual(state['since'], 2)
+        self.assertEqual(state['last_epochtime'], 3)
+
+    def test_staying_elevated_does_not_notify_again(self):
+        state, _ = alerts.evaluate([activity(1, 120)], THRESHOLDS, QUIET)
+        state, notifications = alerts.evaluate([activity(2, 150)], THRESHOLDS, state)
+        self.assertEqual(notifications, [])
+        self.assertEqual(state['level'], 'amber')
+
+    def test_partial_de_escalation_is_silent_and_all_clear_notifies(self):
+        state = dict(QUIET, level='red', peak='red', since=1, last_epochtime=1)
+        state, notifications = alerts.evaluate([activity(2, 120)], THRESHOLDS, state)
+        self.assertEqual(notifications, [])
+        state, notifications = alerts.evaluate([activity(3, 10)], THRESHOLDS, state)
+        self.assertEqual([(n['from'], n['to'], n['peak']) for n in notifications], [('amber', 'green', 'red')])
+        self.assertEqual(state['peak'], 'green')
+
+    def test_already_evaluated_activities_are_ignored(self):
+        state = dict(QUIET, last_epochtime=10)
+        state, notifications = alerts.evaluate([activity(5, 300)], THRESHOLDS, state)
+        self.assertEqual(notifications, [])
+        self.assertEqual(state['level'], 'green')
+
+
+class TestState(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_meta_table()
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_state_defaults_to_quiet_and_round_trips(self):
+        self.assertEqual(alerts.load_state(), QUIET)
+        state = {'level': 'amber', 'peak': 'red', 'since': 100, 'last_epochtime': 200, 'last_notified_at': 300}
+        alerts.save_state(state)
+        self.assertEqual(alerts.load_state(), state)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,36 +1,43 @@
+import gzip
+import http.client
+import io
 import json
+import os
+import urllib.error
+from decimal import Decimal
+import sys
 import unittest
 from unittest.mock import patch
-from moto import mock_dynamodb2
+from moto import mock_aws
 import boto3
-from aurora_watch_lambda import lambda_handler  # Ensure this import is correct
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'shared'))
+
+import aurora_store
+import aurora_watch_lambda
+import rollups
+from aurora_watch_lambda import lambda_handler, ingest_activities  # Ensure this import is correct
 
 class TestAuroraWatchLambda(unittest.TestCase):
 
-    @mock_dynamodb2
     def setUp(self):
         # Set up a mock DynamoDB table
-        self.dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
-        self.table_name = 'aurora-warn-uk'
+        self.mock = mock_aws()
+        self.mock.start()
+        self.dynamodb = boto3.resource('dynamodb')
+        self.table_name = aurora_store.READINGS_TABLE
         self.create_dynamodb_table()
 
+    def tearDown(self):
+        self.mock.stop()
+
     def create_dynamodb_table(self):
-        self.dynamodb.create_table(
-            TableName=self.table_name,
-            KeySchema=[
-                {
-                    'AttributeName': 'status_id',
-                    'KeyType': 'HASH'  # Partition key
-                }
-            ],
-            AttributeDefinitions=[
-                {
-                    'AttributeName': 'status_id',
-                    'AttributeType': 'S'  # String type
-                }
-            ],
-            BillingMode='PAY_PER_REQUEST'
-        )
+        aurora_store.create_readings_table(self.table_name)
+        rollups.create_rollups_table()
+        aurora_store.create_meta_table()
 
     @patch('aurora_watch_lambda.urllib.request.urlopen')
     def test_lambda_handler(self, mock_urlopen):
@@ -47,6 +54,7 @@ class TestAuroraWatchLambda(unittest.TestCase):
             </activity>
         </root>
         """
+        mock_urlopen.return_value.__enter__.return_value.headers = {}
 
         # Call the lambda_handler function
         response = lambda_handler(None, None)
@@ -66,5 +74,317 @@ class TestAuroraWatchLambda(unittest.TestCase):
         self.assertEqual(items[0]['status_id'], '1')
         self.assertEqual(items[0]['value'], 15.5)
 
+        # Waiting readers are told what was written
+        announced = aurora_store.get_meta('updates')
+        self.assertEqual(announced['sequence'], 1)
+        self.assertEqual((announced['first_epochtime'], announced['count']), (1696161600, 1))
+
+
+class TestIngestActivities(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_readings_table()
+        rollups.create_rollups_table()
+        aurora_store.create_meta_table()
+        self.table = boto3.resource('dynamodb').Table(aurora_store.READINGS_TABLE)
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def make_activities(self, count, status_id='green'):
+        return [{
+            'epochtime': 1696161600 + i * 3600,
+            'iso_string': f'activity-{i}',
+            'status_id': status_id,
+            'value': str(i)
+        } for i in range(count)]
+
+    def test_writes_new_activities_in_batches(self):
+        with patch.object(aurora_store.resource(), 'batch_write_item',
+                          wraps=aurora_store.resource().batch_write_item) as batch_write_item:
+            counts, _ = ingest_activities(self.make_activities(30))
+        self.assertEqual(counts, {'written': 30, 'skipped': 0, 'retried': 0})
+        readings_writes = [call for call in batch_write_item.call_args_list
+                           if aurora_store.READINGS_TABLE in call.kwargs['RequestItems']]
+        self.assertEqual(len(readings_writes), 2)
+        self.assertEqual(len(self.table.scan()['Items']), 30)
+
+    def test_skips_unchanged_and_rewrites_changed(self):
+        activities = self.make_activities(5)
+        ingest_activities(activities)
+        activities[2] = dict(activities[2], status_id='amber')
+        counts, _ = ingest_activities(activities)
+        self.assertEqual(counts, {'written': 1, 'skipped': 4, 'retried': 0})
+        self.assertEqual(self.table.get_item(Key=aurora_store.key_for(activities[2]['epochtime']))['Item']['status_id'], 'amber')
+
+    def test_retries_unprocessed_items(self):
+        real_batch_write = aurora_store.resource().batch_write_item
+        calls = []
+
+        def flaky_batch_write(RequestItems):
+            if aurora_store.READINGS_TABLE not in RequestItems:
+                return real_batch_write(RequestItems=RequestItems)
+            calls.append(RequestItems)
+            requests = RequestItems[aurora_store.READINGS_TABLE]
+            if len(calls) == 1:
+                real_batch_write(RequestItems={aurora_store.READINGS_TABLE: requests[:1]})
+                return {'UnprocessedItems': {aurora_store.READINGS_TABLE: requests[1:]}}
+            return real_batch_write(RequestItems=RequestItems)
+
+        with patch.object(aurora_store.resource(), 'batch_write_item', side_effect=flaky_batch_write), \
+                patch('aurora_store.time.sleep'):
+            counts, _ = ingest_activities(self.make_activities(3))
+        self.assertEqual(counts, {'written': 3, 'skipped': 0, 'retried': 2})
+        self.assertEqual(len(self.table.scan()['Items']), 3)
+
+    def test_records_ingest_times(self):
+        ingest_activities(self.make_activities(3))
+        first = aurora_store.get_meta('ingest')
+        self.assertEqual(first['changed_at'], first['ingested_at'])
+        with patch('aurora_watch_lambda.time.time', return_value=int(first['ingested_at']) + 60):
+            ingest_activities(self.make_activities(3))
+        second = aurora_store.get_meta('ingest')
+        self.assertEqual(second['changed_at'], first['changed_at'])
+        self.assertEqual(second['ingested_at'], first['ingested_at'] + 60)
+
+    def test_written_readings_expire_after_the_retention_horizon(self):
+        with patch.object(aurora_watch_lambda.archive, 'RETENTION_DAYS', 400):
+            ingest_activities(self.make_activities(2))
+        item = self.table.get_item(Key=aurora_store.key_for(1696161600))['Item']
+        self.assertGreater(item['expires_at'], 1696161600 + 399 * 86400)
+        # The TTL attribute does not make an unchanged reading look changed
+        self.assertEqual(ingest_activities(self.make_activities(2))[0]['skipped'], 2)
+
+    def test_updates_rollups_for_written_hours(self):
+        ingest_activities(self.make_activities(30))
+        hourly = rollups.read_rollups('hour', 1696161600, 1696161600 + 29 * 3600)
+        self.assertEqual(len(hourly), 30)
+        daily = rollups.read_rollups('day', 1696118400, 1696118400 + 2 * 86400)
+        self.assertEqual([int(rollup['count']) for rollup in daily], [12, 18])
+        self.assertEqual([int(rollup['max']) for rollup in daily], [11, 29])
+    @patch('aurora_watch_lambda.send_notifications', return_value={'sent': 1})
+    def test_alerts_only_on_new_escalations(self, send_notifications):
+        thresholds = [{'status_id': 'green', 'value': 0}, {'status_id': 'amber', 'value': 100}]
+        activities = self.make_activities(2)
+        aurora_watch_lambda.check_alerts(ingest_activities(activities)[1], thresholds)
+        self.assertEqual(send_notifications.call_args[0][0], [])
+
+        activities.append(dict(self.make_activities(3)[2], value='150'))
+        written = ingest_activities(activities)[1]
+        self.assertEqual(aurora_watch_lambda.check_alerts(written, thresholds), {'level': 'amber', 'notifications': 1})
+        self.assertEqual(send_notifications.call_args[0][0][0]['to'], 'amber')
+
+        # The next run repeats the same window: nothing new is written, so nothing new is sent
+        written = ingest_activities(activities)[1]
+        self.assertEqual(aurora_watch_lambda.check_alerts(written, thresholds), {'level': 'amber', 'notifications': 0})
+        self.assertEqual(send_notifications.call_args[0][0], [])
+
+
+FEED = b"""
+<root>
+    <updated><datetime>2023-10-01T12:00:00+00:00</datetime></updated>
+    <lower_threshold status_id="green">0</lower_threshold>
+    <activity status_id="green">
+        <datetime>2023-10-01T12:00:00+00:00</datetime>
+        <value>15.5</value>
+    </activity>
+</root>
+"""
+
+
+class TestConditionalFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_readings_table()
+        rollups.create_rollups_table()
+        aurora_store.create_meta_table()
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def respond(self, mock_urlopen, body=FEED, headers=None):
+        response = mock_urlopen.return_value.__enter__.return_value
+        response.read.return_value = body
+        response.headers = headers or {}
+
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_validators_are_stored_and_sent(self, mock_urlopen):
+        self.respond(mock_urlopen, headers={'ETag': '"v1"', 'Last-Modified': 'Sun, 01 Oct 2023 12:00:00 GMT'})
+        lambda_handler(None, None)
+        self.assertEqual(aurora_store.get_meta('feed')['etag'], '"v1"')
+
+        lambda_handler(None, None)
+        request = mock_urlopen.call_args[0][0]
+        self.assertEqual(request.get_header('If-none-match'), '"v1"')
+        self.assertEqual(request.get_header('If-modified-since'), 'Sun, 01 Oct 2023 12:00:00 GMT')
+        self.assertEqual(mock_urlopen.call_args[1]['timeout'], aurora_watch_lambda.FETCH_TIMEOUT_SECONDS)
+
+    @patch('aurora_watch_lambda.ingest_activities')
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_not_modified_skips_everything(self, mock_urlopen, ingest):
+        mock_urlopen.side_effect = urllib.error.HTTPError(aurora_watch_lambda.API_URL, 304, 'Not Modified', {}, None)
+        response = lambda_handler(None, None)
+        self.assertEqual(json.loads(response['body']), {'skipped': 'not modified'})
+        ingest.assert_not_called()
+        self.assertIn('ingested_at', aurora_store.get_meta('ingest'))
+
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_invocation_emits_one_metrics_record(self, mock_urlopen):
+        self.respond(mock_urlopen)
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            lambda_handler(None, None)
+        record = json.loads(stdout.getvalue().splitlines()[-1])
+        self.assertEqual(record['Service'], 'ingest')
+        for span in ('fetch', 'parse', 'diff', 'write', 'rollups', 'alerts'):
+            self.assertIn(f'{span}Ms', record)
+        self.assertGreater(record['WriteCapacityUnits'], 0)
+
+    @patch('aurora_watch_lambda.send_notifications')
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_alerts_are_evaluated_after_a_failed_run(self, mock_urlopen, send_notifications):
+        self.respond(mock_urlopen, FEED.replace(b'<value>15.5</value>', b'<value>150</value>')
+                     .replace(b'<lower_threshold status_id="green">0</lower_threshold>',
+                              b'<lower_threshold status_id="green">0</lower_threshold>'
+                              b'<lower_threshold status_id="amber">100</lower_threshold>'))
+        send_notifications.side_effect = [RuntimeError('SNS unavailable'), {'sent': 1}]
+        self.assertEqual(lambda_handler(None, None)['statusCode'], 500)
+
+        # The retry writes nothing new, but the amber reading is still alerted on
+        body = json.loads(lambda_handler(None, None)['body'])
+        self.assertEqual(body['ingest']['written'], 0)
+        self.assertEqual(body['alert'], {'level': 'amber', 'notifications': 1})
+
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_current_status_is_kept_on_one_item(self, mock_urlopen):
+        self.respond(mock_urlopen)
+        with patch('aurora_watch_lambda.time.time', return_value=1696165200):
+            lambda_handler(None, None)
+        status = aurora_store.get_meta(aurora_store.latest_meta('awn'))
+        self.assertEqual((status['epochtime'], status['status_id'], status['value']), (1696161600, 'green', Decimal('15.5')))
+        self.assertEqual((status['updated'], status['ingested_at']), (1696161600, 1696165200))
+        self.assertEqual(status['thresholds'], [{'status_id': 'green', 'value': 0}])
+
+        # A run that finds nothing new only records that it looked
+        mock_urlopen.side_effect = urllib.error.HTTPError(aurora_watch_lambda.API_URL, 304, 'Not Modified', {}, None)
+        with patch('aurora_watch_lambda.time.time', return_value=1696186800):
+            lambda_handler(None, None)
+        status = aurora_store.get_meta(aurora_store.latest_meta('awn'))
+        self.assertEqual((status['epochtime'], status['ingested_at']), (1696161600, 1696186800))
+
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_stations_are_ingested_side_by_side(self, mock_urlopen):
+        self.respond(mock_urlopen, headers={'ETag': '"v1"'})
+        with patch.object(aurora_watch_lambda, 'STATIONS', ['awn', 'lerwick']):
+            response = lambda_handler(None, None)
+        self.assertEqual(set(json.loads(response['body'])), {'awn', 'lerwick'})
+        urls = [call[0][0].full_url for call in mock_urlopen.call_args_list]
+        self.assertEqual(urls, [aurora_watch_lambda.API_URL, aurora_watch_lambda.API_URL.replace('/awn/', '/lerwick/')])
+
+        # The same epochtime from both stations is kept twice, each with its own feed state
+        for station in ('awn', 'lerwick'):
+            self.assertEqual(len(aurora_store.query_range(1696161600, 1696161600, station=station)), 1)
+        self.assertEqual(aurora_store.get_meta('feed#lerwick')['etag'], '"v1"')
+        self.assertEqual([item['station'] for item in aurora_store.latest_readings()], ['awn', 'lerwick'])
+
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_unchanged_updated_time_skips_ingest(self, mock_urlopen):
+        self.respond(mock_urlopen)
+        lambda_handler(None, None)
+        with patch('aurora_watch_lambda.ingest_activities') as ingest:
+            response = lambda_handler(None, None)
+        self.assertEqual(json.loads(response['body'])['skipped'], 'unchanged')
+        ingest.assert_not_called()
+
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_unchanged_feed_is_not_parsed_past_its_updated_time(self, mock_urlopen):
+        self.respond(mock_urlopen)
+        lambda_handler(None, None)
+        self.respond(mock_urlopen, FEED.split(b'<lower_threshold')[0] + b'<activity><datetime>not a')
+        response = lambda_handler(None, None)
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body'])['skipped'], 'unchanged')
+
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_gzip_body_is_decompressed(self, mock_urlopen):
+        self.respond(mock_urlopen, gzip.compress(FEED), {'Content-Encoding': 'gzip'})
+        xml_data, _ = aurora_watch_lambda.fetch_feed(aurora_watch_lambda.API_URL, {})
+        self.assertEqual(xml_data, FEED)
+        self.assertEqual(mock_urlopen.call_args[0][0].get_header('Accept-encoding'), 'gzip')
+
+    @patch('aurora_watch_lambda.time.sleep')
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_transient_errors_are_retried(self, mock_urlopen, sleep):
+        response = mock_urlopen.return_value
+        response.__enter__.return_value.read.return_value = FEED
+        response.__enter__.return_value.headers = {}
+        mock_urlopen.side_effect = [
+            urllib.error.URLError('timed out'),
+            urllib.error.HTTPError(aurora_watch_lambda.API_URL, 503, 'Unavailable', {}, io.BytesIO()),
+            response
+        ]
+        xml_data, _ = aurora_watch_lambda.fetch_feed(aurora_watch_lambda.API_URL, {})
+        self.assertEqual(xml_data, FEED)
+        self.assertEqual(sleep.call_count, 2)
+
+    @patch('aurora_watch_lambda.time.sleep')
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_dropped_connections_are_retried(self, mock_urlopen, sleep):
+        response = mock_urlopen.return_value
+        response.__enter__.return_value.read.return_value = FEED
+        response.__enter__.return_value.headers = {}
+        mock_urlopen.side_effect = [http.client.RemoteDisconnected('closed'), ConnectionResetError(), response]
+        xml_data, _ = aurora_watch_lambda.fetch_feed(aurora_watch_lambda.API_URL, {})
+        self.assertEqual(xml_data, FEED)
+        self.assertEqual(sleep.call_count, 2)
+
+    @patch('aurora_watch_lambda.time.sleep')
+    @patch('aurora_watch_lambda.urllib.request.urlopen')
+    def test_client_errors_are_not_retried(self, mock_urlopen, sleep):
+        mock_urlopen.side_effect = urllib.error.HTTPError(aurora_watch_lambda.API_URL, 404, 'Not Found', {}, io.BytesIO())
+        with self.assertRaises(urllib.error.HTTPError):
+            aurora_watch_lambda.fetch_feed(aurora_watch_lambda.API_URL, {})
+        sleep.assert_not_called()
+
+
+class TestParseFeed(unittest.TestCase):
+
+    def test_timestamp_fast_path_matches_strptime(self):
+        from datetime import datetime
+        for text in ['2023-10-01T12:00:00+00:00', '2024-02-29T23:59:59+05:30', '2023-01-01T00:30:00-03:00']:
+            dt = datetime.strptime(text, "%Y-%m-%dT%H:%M:%S%z")
+            self.assertEqual(aurora_watch_lambda.parse_timestamp(text), (int(dt.timestamp()), dt.isoformat()))
+
+    def test_timestamp_falls_back_to_strptime(self):
+        self.assertEqual(aurora_watch_lambda.parse_timestamp('2023-10-01T12:00:00Z'),
+                         (1696161600, '2023-10-01T12:00:00+00:00'))
+
+    def test_values_are_numbers(self):
+        self.assertEqual(aurora_watch_lambda.parse_value('15.5'), Decimal('15.5'))
+        self.assertEqual(aurora_watch_lambda.parse_value('n/a'), 'n/a')
+        self.assertIsNone(aurora_watch_lambda.parse_value(None))
+
+    def test_parse_feed(self):
+        feed = aurora_watch_lambda.parse_feed(io.BytesIO(FEED))
+        self.assertEqual(feed['datetime'], {'epochtime': 1696161600, 'iso_string': '2023-10-01T12:00:00+00:00'})
+        self.assertEqual(feed['lower_thresholds'], [{'status_id': 'green', 'value': 0}])
+        self.assertEqual(feed['activities'], [{'epochtime': 1696161600, 'iso_string': '2023-10-01T12:00:00+00:00',
+                                               'status_id': 'green', 'value': Decimal('15.5')}])
+
+    def test_activities_are_streamed_lazily(self):
+        rows = ''.join(f'<activity status_id="green"><datetime>2023-10-01T{hour:02d}:00:00+00:00</datetime>'
+                       f'<value>{hour}</value></activity>' for hour in range(24))
+        source = io.BytesIO(f'<root><activities>{rows}</activities></root>'.encode())
+        with patch('aurora_watch_lambda.ET.iterparse', wraps=aurora_watch_lambda.ET.iterparse) as iterparse:
+            activities = aurora_watch_lambda.iter_activities(source)
+            iterparse.assert_not_called()
+            records = list(activities)
+        self.assertEqual([record['value'] for record in records], [Decimal(hour) for hour in range(24)])
+        self.assertEqual(records[1]['epochtime'] - records[0]['epochtime'], 3600)
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,189 @@
+import json
+import os
+import queue
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'shared'))
+
+import aurora_store
+import backfill
+import rollups
+
+START = 1696118400  # 2023-10-01T00:00:00Z
+
+
+def archive(hours, start=START):
+    rows = ''.join(
+        f'<activity status_id="green"><datetime>'
+        f'{time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(start + h * 3600))}</datetime>'
+        f'<value>{h}</value></activity>'
+        for h in range(hours))
+    return f'<root><activities>{rows}</activities></root>'
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TestThrottle(unittest.TestCase):
+
+    def test_requests_are_paced_at_the_current_rate(self):
+        clock = FakeClock()
+        throttle = backfill.Throttle(rate=10, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            throttle.wait()
+        self.assertEqual(clock.slept, [0.1, 0.1])
+
+    def test_rate_halves_on_throttling_and_creeps_back_up(self):
+        throttle = backfill.Throttle(rate=40, min_rate=5)
+        throttle.throttled()
+        throttle.throttled()
+        self.assertEqual(throttle.rate, 10)
+        throttle.throttled()
+        throttle.throttled()
+        self.assertEqual(throttle.rate, 5)
+        throttle.succeeded()
+        self.assertEqual(throttle.rate, 6)
+
+
+class TestFileProgress(unittest.TestCase):
+
+    def test_checkpoint_only_covers_a_contiguous_prefix(self):
+        progress = backfill.FileProgress()
+        for epochtime in (10, 20, 30):
+            progress.submit(epochtime)
+        self.assertIsNone(progress.complete(1))
+        self.assertEqual(progress.complete(0), 20)
+        self.assertEqual(progress.complete(2), 30)
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_readings_table()
+        rollups.create_rollups_table()
+        aurora_store.create_meta_table()
+        self.directory = tempfile.TemporaryDirectory()
+        self.checkpoint_path = os.path.join(self.directory.name, 'checkpoint.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+        self.mock.stop()
+
+    def write_archive(self, name, hours, start=START):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as output:
+            output.write(archive(hours, start))
+        return path
+
+    def run_backfill(self, paths, throttle=None, parse_workers=0):
+        return backfill.Backfill(backfill.Checkpoint(self.checkpoint_path), throttle, write_workers=4).run(
+            paths, parse_workers=parse_workers)
+
+    def test_loads_files_with_rollups_and_reports_throughput(self):
+        paths = [self.write_archive('a.xml', 48), self.write_archive('b.xml', 24, START + 2 * 86400)]
+        result = self.run_backfill(paths, parse_workers=2)
+        self.assertEqual(result['records'], 72)
+        self.assertGreater(result['records_per_sec'], 0)
+        self.assertEqual(len(aurora_store.query_range(START, START + 3 * 86400)), 72)
+        self.assertEqual(len(rollups.read_rollups('day', START, START + 3 * 86400)), 3)
+        self.assertIn('changed_at', aurora_store.get_meta('ingest'))
+
+    def test_workers_stream_files_in_chunks(self):
+        chunks = queue.Queue()
+        backfill.parse_file(self.write_archive('a.xml', 5), chunks, size=2)
+        self.assertEqual([len(chunk) for chunk in iter(chunks.get_nowait, None)], [2, 2, 1])
+
+    def test_worker_parse_errors_are_raised(self):
+        path = os.path.join(self.directory.name, 'broken.xml')
+        with open(path, 'w') as output:
+            output.write(archive(3)[:-20])
+        with self.assertRaises(Exception):
+            self.run_backfill([self.write_archive('a.xml', 3), path], parse_workers=2)
+        with open(self.checkpoint_path) as source:
+            self.assertNotIn(os.path.abspath(path), json.load(source))
+
+    def test_completed_files_are_skipped_on_rerun(self):
+        path = self.write_archive('a.xml', 30)
+        self.run_backfill([path])
+        with open(self.checkpoint_path) as source:
+            self.assertTrue(json.load(source)[os.path.abspath(path)]['done'])
+        self.assertEqual(self.run_backfill([path])['records'], 0)
+
+    def test_resumes_after_the_checkpointed_epochtime(self):
+        path = self.write_archive('a.xml', 30)
+        with open(self.checkpoint_path, 'w') as output:
+            json.dump({os.path.abspath(path): {'epochtime': START + 9 * 3600, 'done': False}}, output)
+        self.assertEqual(self.run_backfill([path])['records'], 20)
+        self.assertEqual(aurora_store.query_range(START, START + 86400)[0]['epochtime'], START + 10 * 3600)
+
+    def test_resume_rolls_up_the_whole_file(self):
+        path = self.write_archive('a.xml', 72)
+        with patch.object(backfill, 'update_rollups', side_effect=RuntimeError('interrupted')):
+            with self.assertRaises(RuntimeError):
+                self.run_backfill([path])
+        with open(self.checkpoint_path, 'w') as output:
+            json.dump({os.path.abspath(path): {'epochtime': START + 29 * 3600, 'done': False}}, output)
+
+        self.assertEqual(self.run_backfill([path])['records'], 42)
+        self.assertEqual(len(rollups.read_rollups('hour', START, START + 72 * 3600)), 72)
+        daily = rollups.read_rollups('day', START, START + 3 * 86400)
+        self.assertEqual([int(rollup['count']) for rollup in daily], [24, 24, 24])
+
+    def test_closed_months_are_archived(self):
+        path = self.write_archive('a.xml', 48, START - 86400)  # The last day of September, first of October
+        with patch.object(backfill.archive, '_store', backfill.archive.LocalStore(self.directory.name)):
+            self.run_backfill([path])
+            self.assertEqual(backfill.archive.archived_months(), {'2023-09': 24, '2023-10': 24})
+            self.assertEqual(len(list(backfill.archive.iter_range(START - 86400, START + 86400))), 48)
+
+    def test_throughput_errors_slow_the_writers_down(self):
+        client = aurora_store.resource()
+        real = client.batch_write_item
+        calls = []
+
+        def flaky(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'BatchWriteItem')
+            return real(**kwargs)
+
+        throttle = backfill.Throttle(rate=1000)
+        with patch.object(client, 'batch_write_item', side_effect=flaky):
+            backfill.write_batch([aurora_store.with_bucket({'epochtime': START, 'status_id': 'green', 'value': '1'})],
+                                 throttle)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(throttle.throttled_count, 1)
+        self.assertEqual(throttle.rate, 501)
+
+    def test_other_errors_are_raised(self):
+        client = aurora_store.resource()
+        error = ClientError({'Error': {'Code': 'ValidationException'}}, 'BatchWriteItem')
+        with patch.object(client, 'batch_write_item', side_effect=error):
+            with self.assertRaises(ClientError):
+                backfill.write_batch([{'epochtime': START}], backfill.Throttle())
+
+
+if __name__ == '__main__':
+    unittest.main()
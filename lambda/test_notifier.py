@@ -0,0 +1,169 @@
+import json
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+from moto import mock_aws
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'shared'))
+
+import aurora_store
+import notifier
+
+
+def notification(to, previous='green', peak=None, epochtime=100, value='150'):
+    return {'from': previous, 'to': to, 'peak': peak or to,
+            'activity': {'epochtime': epochtime, 'iso_string': f'T{epochtime}', 'value': value}}
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class Recorder:
+    """Senders that remember what they were asked to deliver."""
+
+    def __init__(self, fail=()):
+        self.lock = threading.Lock()
+        self.sent = []
+        self.fail = set(fail)
+
+    def sender(self, channel):
+        def send(address, message):
+            if address in self.fail:
+                raise RuntimeError('unreachable')
+            with self.lock:
+                self.sent.append((channel, address, message))
+            return 'id'
+        return send
+
+    def senders(self):
+        return {channel: self.sender(channel) for channel in notifier.RENDERERS}
+
+
+class TestPreferences(unittest.TestCase):
+
+    def test_threshold_is_the_stricter_of_level_and_location(self):
+        self.assertEqual(notifier.threshold_for({}), 'yellow')
+        self.assertEqual(notifier.threshold_for({'location': 'wales'}), 'red')
+        self.assertEqual(notifier.threshold_for({'location': 'scotland', 'min_level': 'amber'}), 'amber')
+
+    def test_all_clear_goes_to_everyone_the_event_reached(self):
+        southern = {'location': 'southern-england'}
+        self.assertFalse(notifier.wants(southern, notification('amber')))
+        self.assertTrue(notifier.wants(southern, notification('red')))
+        self.assertTrue(notifier.wants(southern, notification('green', 'amber', peak='red')))
+        self.assertFalse(notifier.wants(southern, notification('green', 'amber', peak='amber')))
+
+    def test_station_filter(self):
+        north = {'stations': ['lerwick']}
+        self.assertFalse(notifier.wants(north, notification('amber')))
+        self.assertTrue(notifier.wants(north, dict(notification('amber'), station='lerwick')))
+        self.assertTrue(notifier.wants({}, dict(notification('amber'), station='lerwick')))
+        self.assertTrue(notifier.render_sms([dict(notification('red'), station='lerwick')])['body'].startswith('[lerwick]'))
+
+    def test_renderings(self):
+        email = notifier.render_email([notification('amber'), notification('red', 'amber', epochtime=200)])
+        self.assertEqual(email['subject'], 'Aurora Watch: red alert')
+        self.assertEqual(email['body'].count('->'), 2)
+        self.assertLessEqual(len(notifier.render_sms([notification('red', value='9' * 300)])['body']), 160)
+        payload = json.loads(notifier.render_webhook([notification('green', 'amber', peak='red')])['body'])
+        self.assertEqual(payload['notifications'][0]['peak'], 'red')
+
+
+class TestDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_meta_table()
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def dispatcher(self, senders, **kwargs):
+        return notifier.Dispatcher(senders, clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_renders_once_per_audience_and_sends_once_per_address(self):
+        subscribers = [{'id': f's{i}', 'channel': 'sms', 'address': f'+44{i:04d}'} for i in range(50)]
+        subscribers += [{'id': 'south', 'channel': 'sms', 'address': '+449999', 'location': 'southern-england'},
+                        {'id': 'topic', 'channel': 'email', 'address': 'arn:topic'},
+                        {'id': 'topic-again', 'channel': 'email', 'address': 'arn:topic'}]
+        rendered = []
+        render = lambda notifications: rendered.append(notifications) or notifier.render_sms(notifications)
+        with patch.dict(notifier.RENDERERS, sms=render):
+            deliveries, audiences = self.dispatcher(Recorder().senders()).plan([notification('amber')], subscribers)
+        self.assertEqual(audiences, 2)  # Southern England does not care about amber
+        self.assertEqual(len(rendered), 1)
+        self.assertEqual(len(deliveries), 51)
+
+    def test_dispatch_sends_concurrently_and_skips_duplicates(self):
+        recorder = Recorder(fail={'https://down.example'})
+        subscribers = [{'id': 'a', 'channel': 'sms', 'address': '+440001'},
+                       {'id': 'b', 'channel': 'webhook', 'address': 'https://hooks.example'},
+                       {'id': 'c', 'channel': 'webhook', 'address': 'https://down.example'}]
+        dispatcher = self.dispatcher(recorder.senders())
+        counts = dispatcher.dispatch([notification('amber')], subscribers, now=1000)
+        self.assertEqual(counts, {'audiences': 2, 'sent': 2, 'failed': 1, 'expired': 0, 'duplicates': 0})
+
+        # A rerun with the same transition inside the window only retries what failed
+        counts = dispatcher.dispatch([notification('amber')], subscribers, now=2000)
+        self.assertEqual((counts['duplicates'], counts['failed']), (3, 1))
+        counts = dispatcher.dispatch([notification('amber')], subscribers, now=1000 + notifier.DEDUP_SECONDS)
+        self.assertEqual(counts['sent'], 2)
+        self.assertEqual(len(recorder.sent), 4)
+
+    def test_failed_deliveries_are_retried_by_the_next_run(self):
+        recorder = Recorder(fail={'+440001'})
+        subscribers = [{'id': 'a', 'channel': 'sms', 'address': '+440001'}]
+        counts = self.dispatcher(recorder.senders()).dispatch([notification('red')], subscribers, now=1000)
+        self.assertEqual(counts['failed'], 1)
+
+        # The next run has no new transitions, but the queued delivery goes out
+        recorder.fail.clear()
+        counts = self.dispatcher(recorder.senders()).dispatch([], subscribers, now=2000)
+        self.assertEqual((counts['sent'], counts['failed']), (1, 0))
+        self.assertEqual([address for _, address, _ in recorder.sent], ['+440001'])
+        self.assertEqual(self.dispatcher(recorder.senders()).dispatch([], subscribers, now=3000)['sent'], 0)
+
+    def test_deliveries_past_the_budget_are_dropped(self):
+        recorder = Recorder()
+        subscribers = [{'id': 'a', 'channel': 'sms', 'address': '+440001'}]
+        counts = self.dispatcher(recorder.senders(), budget_seconds=0).dispatch([notification('red')], subscribers)
+        self.assertEqual(counts['expired'], 1)
+        self.assertEqual(recorder.sent, [])
+        self.assertEqual(len(notifier.load_deliveries()[1]), 1)
+
+    def test_subscribers_come_from_meta_and_environment(self):
+        aurora_store.update_meta('subscribers', subscribers=[{'id': 'x', 'channel': 'webhook', 'address': 'https://x'}])
+        with patch.dict(os.environ, SNS_PHONE_NUMBER='+440000'):
+            channels = [subscriber['channel'] for subscriber in notifier.load_subscribers()]
+        self.assertEqual(channels[0], 'webhook')
+        self.assertIn('sms', channels)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_bursts_then_paces(self):
+        clock = FakeClock()
+        limiter = notifier.RateLimiter(rate=5, burst=2, clock=clock, sleep=clock.sleep)
+        for _ in range(12):
+            limiter.acquire()
+        self.assertAlmostEqual(clock.now, 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+# analytics.py
+# Trend statistics over a time-sorted series of readings: rolling mean, rate of change (rolling
+# least-squares slope), percentile bands per bucket and time spent above a threshold. Everything
+# is vectorised; windowed sums come from cumulative-sum arrays that are computed once per window
+# of data and kept across warm invocations.
+from collections import OrderedDict
+import numpy as np
+
+HOUR = 60 * 60
+PERCENTILES = (10, 50, 90)
+
+
+class ArrayCache:
+    """Small LRU of prepared intermediates, keyed by data version and window."""
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        value = self.entries[key] = build()
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+
+def prepare(epochs, values):
+    """Cumulative sums from which any contiguous window's count, mean and slope follow in O(1)."""
+    t = (epochs - epochs[0]).astype(np.float64) if len(epochs) else np.empty(0)
+    zero = np.zeros(1)
+    return {
+        'epochs': epochs,
+        'values': values,
+        'sum_t': np.concatenate((zero, np.cumsum(t))),
+        'sum_v': np.concatenate((zero, np.cumsum(values))),
+        'sum_tt': np.concatenate((zero, np.cumsum(t * t))),
+        'sum_tv': np.concatenate((zero, np.cumsum(t * values))),
+    }
+
+
+def window_starts(epochs, window_seconds):
+    """Index of the first reading inside (epochtime - window_seconds, epochtime] for each reading."""
+    return np.searchsorted(epochs, epochs - window_seconds, side='right')
+
+
+def windowed(prepared, name, starts):
+    ends = np.arange(1, len(prepared['epochs']) + 1)
+    return prepared[name][ends] - prepared[name][starts]
+
+
+def rolling_mean(prepared, starts):
+    counts = np.arange(1, len(starts) + 1) - starts
+    return windowed(prepared, 'sum_v', starts) / counts
+
+
+def rate_of_change(prepared, starts):
+    """Least-squares slope over each rolling window, in value units per hour; NaN below two readings."""
+    n = (np.arange(1, len(starts) + 1) - starts).astype(np.float64)
+    sum_t, sum_v = windowed(prepared, 'sum_t', starts), windowed(prepared, 'sum_v', starts)
+    sum_tt, sum_tv = windowed(prepared, 'sum_tt', starts), windowed(prepared, 'sum_tv', starts)
+    denominator = n * sum_tt - sum_t * sum_t
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sum_tv - sum_t * sum_v) / denominator
+    return np.where((n > 1) & (denominator > 0), slope * HOUR, np.nan)
+
+
+def bucket_bounds(epochs, bucket_seconds):
+    index = epochs // bucket_seconds
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1))
+    ends = np.concatenate((starts[1:], [len(epochs)]))
+    return index[starts] * bucket_seconds, starts, ends
+
+
+def percentile_bands(epochs, values, bucket_seconds, percentiles=PERCENTILES):
+    """Per-bucket percentiles (linear interpolation), as an array of shape (len(percentiles), buckets)."""
+    bucket_epochs, starts, ends = bucket_bounds(epochs, bucket_seconds)
+    # Sort by value within each bucket with one plain sort: buckets are contiguous in time order,
+    # so offsetting each bucket's values past the previous bucket's keeps every bucket in place
+    ordinal = epochs // bucket_seconds - epochs[0] // bucket_seconds
+    low_value = values.min()
+    span = values.max() - low_value + 1.0
+    ordered = np.sort(ordinal * span + (values - low_value)) - ordinal * span + low_value
+    counts = ends - starts
+    bands = []
+    for percentile in percentiles:
+        position = starts + (counts - 1) * (percentile / 100)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        bands.append(ordered[low] + (ordered[high] - ordered[low]) * (position - low))
+    return bucket_epochs, np.array(bands)
+
+
+def seconds_above(epochs, values, threshold, end, reading_seconds):
+    """Time at or above threshold: a reading holds until the next one, for at most reading_seconds."""
+    if len(epochs) == 0:
+        return 0.0
+    following = np.concatenate((epochs[1:], [end]))
+    held = np.clip(np.minimum(following - epochs, reading_seconds), 0, None)
+    return float(held[values >= threshold].sum())
+
+
+def analyse(prepared, bucket_seconds, window_seconds, threshold, start, end, reading_seconds):
+    """Bucketed trend points plus window-wide threshold totals."""
+    epochs, values = prepared['epochs'], prepared['values']
+    if len(epochs) == 0:
+        empty = np.empty(0)
+        return {'epochtime': empty.astype(np.int64), 'count': empty.astype(np.int64), 'rolling_mean': empty,
+                'rate_of_change': empty, 'bands': np.empty((len(PERCENTILES), 0)), 'seconds_above': 0.0,
+                'fraction_above': 0.0, 'latest_rolling_mean': None, 'latest_rate_of_change': None}
+    window = window_starts(epochs, window_seconds)
+    means = rolling_mean(prepared, window)
+    slopes = rate_of_change(prepared, window)
+    bucket_epochs, bands = percentile_bands(epochs, values, bucket_seconds)
+    _, starts, ends = bucket_bounds(epochs, bucket_seconds)
+    last = ends - 1  # Rolling statistics are sampled at each bucket's last reading
+    above = seconds_above(epochs, values, threshold, end, reading_seconds)
+    return {
+        'epochtime': bucket_epochs,
+        'count': ends - starts,
+        'rolling_mean': means[last],
+        'rate_of_change': slopes[last],
+        'bands': bands,
+        'seconds_above': above,
+        'fraction_above': above / (end - start) if end > start else 0.0,
+        'latest_rolling_mean': float(means[-1]) if len(means) else None,
+        'latest_rate_of_change': float(slopes[-1]) if len(slopes) else None,
+    }
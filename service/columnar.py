@@ -0,0 +1,196 @@
+# columnar.py
+# Compact binary encoding of GraphQL list results, served to clients that send
+# Accept: application/vnd.aurora.columnar. Each top-level list field becomes a section of
+# columns instead of an array of objects with repeated keys: epochtimes as a first value plus
+# deltas, numbers as float32, and strings dictionary-encoded as small integer indices.
+#
+# Layout, little-endian; every array starts on a 4-byte boundary so clients can view it in place:
+#   b'AUR1', uint16 section count, sections
+#   section: str name, uint32 row count, uint16 column count, columns
+#   column:  str name, uint8 kind, data
+#     'd' delta:      float64 first value, int32[rows - 1] differences
+#     'i' integer:    int32[rows]
+#     'f' float:      float32[rows], NaN where missing
+#     's' dictionary: uint16 entry count, str[entries], uint8[rows] indices  ('S': uint16 indices)
+#   str: uint16 byte length, utf-8 bytes
+import math
+import struct
+import sys
+from array import array
+from decimal import Decimal
+
+CONTENT_TYPE = 'application/vnd.aurora.columnar'
+MAGIC = b'AUR1'
+DELTA_COLUMNS = {'epochtime'}
+NUMERIC_COLUMNS = {'value'}  # String in the schema for compatibility, a number on the wire
+INT32_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+
+class UnencodableError(ValueError):
+    """The result has a shape the columnar format does not cover; callers fall back to JSON."""
+
+
+def is_number(value):
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def as_float(value):
+    if value is None or value == '':
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise UnencodableError(f"not a number: {value!r}")
+
+
+def little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+class Writer:
+
+    def __init__(self):
+        self.parts = [MAGIC]
+        self.size = len(MAGIC)
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+
+    def pack(self, fmt, *values):
+        self.write(struct.pack('<' + fmt, *values))
+
+    def string(self, text):
+        data = text.encode()
+        self.pack('H', len(data))
+        self.write(data)
+
+    def array(self, values):
+        self.write(b'\0' * (-self.size % 4))
+        self.write(little_endian(values))
+
+    def bytes(self):
+        return b''.join(self.parts)
+
+
+def column_kind(name, values):
+    if values and all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        if name in DELTA_COLUMNS:
+            return 'd'
+        if INT32_RANGE[0] <= min(values) and max(values) <= INT32_RANGE[1]:
+            return 'i'
+    if all(value is None or is_number(value) for value in values):
+        return 'f'
+    if name in NUMERIC_COLUMNS and all(value is None or isinstance(value, str) for value in values):
+        return 'f'
+    if all(value is None or isinstance(value, str) for value in values):
+        return 's'
+    raise UnencodableError(f"column {name} mixes unsupported types")
+
+
+def write_column(writer, name, values):
+    kind = column_kind(name, values)
+    if kind == 's':
+        entries = list(dict.fromkeys(value or '' for value in values))
+        if len(entries) > 0xFFFF:
+            raise UnencodableError(f"column {name} has too many distinct values")
+        kind = 's' if len(entries) <= 0x100 else 'S'
+    writer.string(name)
+    writer.pack('c', kind.encode())
+    if kind == 'd':
+        deltas = [current - previous for previous, current in zip(values, values[1:])]
+        if deltas and not (INT32_RANGE[0] <= min(deltas) and max(deltas) <= INT32_RANGE[1]):
+            raise UnencodableError(f"column {name} has gaps too wide for int32 deltas")
+        writer.write(b'\0' * (-writer.size % 4))
+        writer.pack('d', values[0] if values else 0)
+        writer.array(array('i', deltas))
+    elif kind == 'i':
+        writer.array(array('i', values))
+    elif kind == 'f':
+        writer.array(array('f', [as_float(value) for value in values]))
+    else:
+        index = {entry: i for i, entry in enumerate(entries)}
+        writer.pack('H', len(entries))
+        for entry in entries:
+            writer.string(entry)
+        writer.array(array('B' if kind == 's' else 'H', [index[value or ''] for value in values]))
+
+
+def encode(data):
+    """Encode a GraphQL result's data, whose top-level fields must all be lists of flat objects."""
+    if not data:
+        raise UnencodableError("no data")
+    writer = Writer()
+    writer.pack('H', len(data))
+    for name, rows in data.items():
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise UnencodableError(f"field {name} is not a list of objects")
+        columns = list(rows[0]) if rows else []
+        writer.string(name)
+        writer.pack('IH', len(rows), len(columns))
+        for column in columns:
+            values = [row.get(column) for row in rows]
+            if any(isinstance(value, (dict, list)) for value in values):
+                raise UnencodableError(f"field {name}.{column} is nested")
+            write_column(writer, column, values)
+    return writer.bytes()
+
+
+class Reader:
+
+    def __init__(self, body):
+        self.body = body
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from('<' + fmt, self.body, self.offset)
+        self.offset += struct.calcsize('<' + fmt)
+        return values if len(values) > 1 else values[0]
+
+    def string(self):
+        length = self.unpack('H')
+        self.offset += length
+        return self.body[self.offset - length:self.offset].decode()
+
+    def array(self, typecode, count):
+        self.offset += -self.offset % 4
+        values = array(typecode)
+        values.frombytes(self.body[self.offset:self.offset + count * values.itemsize])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        self.offset += count * values.itemsize
+        return values.tolist()
+
+
+def decode(body):
+    """Inverse of encode, as {field: {column: [values]}}; used by tests and Python clients."""
+    if body[:4] != MAGIC:
+        raise ValueError("not a columnar body")
+    reader = Reader(body)
+    reader.offset = len(MAGIC)
+    sections = {}
+    for _ in range(reader.unpack('H')):
+        name = reader.string()
+        rows, column_count = reader.unpack('IH')
+        columns = {}
+        for _ in range(column_count):
+            column = reader.string()
+            kind = reader.unpack('c').decode()
+            if kind == 'd':
+                reader.offset += -reader.offset % 4
+                first = reader.unpack('d')
+                values = [int(first)] if rows else []
+                for delta in reader.array('i', max(rows - 1, 0)):
+                    values.append(values[-1] + delta)
+            elif kind == 'i':
+                values = reader.array('i', rows)
+            elif kind == 'f':
+                values = [None if math.isnan(value) else value for value in reader.array('f', rows)]
+            else:
+                entries = [reader.string() for _ in range(reader.unpack('H'))]
+                values = [entries[i] for i in reader.array('B' if kind == 's' else 'H', rows)]
+            columns[column] = values
+        sections[name] = columns
+    return sections
@@ -0,0 +1,56 @@
+# document_cache.py
+# Parsed and validated GraphQL documents keyed by the SHA-256 of the query text, kept across
+# warm invocations. The same keys serve as persisted-query IDs: a client may send only the
+# hash of a query the container has already seen (Apollo automatic persisted queries).
+import hashlib
+from collections import OrderedDict
+from graphql import GraphQLError, parse, validate
+
+PERSISTED_QUERY_NOT_FOUND = 'PersistedQueryNotFound'
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class DocumentCache:
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.documents = OrderedDict()  # sha256 -> validated DocumentNode, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, schema, query=None, sha256_hash=None):
+        """Return (document, errors) for a query text, a persisted hash, or both.
+
+        Only documents that validate against the schema are cached, so a hit skips both
+        parsing and validation.
+        """
+        if query is None:
+            if sha256_hash in self.documents:
+                self.hits += 1
+                self.documents.move_to_end(sha256_hash)
+                return self.documents[sha256_hash], None
+            return None, [GraphQLError(PERSISTED_QUERY_NOT_FOUND)]
+
+        key = query_hash(query)
+        if sha256_hash is not None and sha256_hash != key:
+            return None, [GraphQLError('provided sha does not match query')]
+        if key in self.documents:
+            self.hits += 1
+            self.documents.move_to_end(key)
+            return self.documents[key], None
+
+        self.misses += 1
+        try:
+            document = parse(query)
+        except GraphQLError as error:
+            return None, [error]
+        errors = validate(schema, document)
+        if errors:
+            return None, errors
+        self.documents[key] = document
+        while len(self.documents) > self.max_entries:
+            self.documents.popitem(last=False)
+        return document, None
@@ -1,109 +1,580 @@
 # lambda_function.py
+import base64
+import gzip
+import hashlib
 import json
+import logging
+import os
 import time
-from datetime import datetime, timedelta
-import boto3
-from graphene import ObjectType, String, Schema, Int, List, Field, Float
+from contextlib import closing
+from functools import partial
+from itertools import islice
+from graphene import ObjectType, String, Schema, Int, List, Field, Float, relay
+from graphql import ExecutionResult, GraphQLError, execute
+import archive
+import aurora_store
+import columnar
+import rollups
+import tracing
+import updates
+from document_cache import DocumentCache
+from range_loader import RangeLoader, declared_windows, root_fields
+from window_cache import WindowCache
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('aurora-warn-uk')
+# DEBUG logs whole events and queries; the default keeps per-request logging off the hot path
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'WARNING'))
+
+def load_ingest_version():
+    meta = aurora_store.get_meta('ingest')
+    return meta.get('changed_at'), meta.get('ingested_at')
+
+# Per station, surviving warm invocations; emptied whenever the ingest Lambda writes new readings.
+# Months compacted into the archive are read from their blobs, so long windows stay cheap after
+# the raw readings expire.
+readings_caches = {}
+
+def readings_cache_for(station):
+    if station not in readings_caches:
+        readings_caches[station] = WindowCache(partial(archive.iter_range, station=station), load_ingest_version)
+    return readings_caches[station]
+
+readings_cache = readings_cache_for(aurora_store.DEFAULT_STATION)
+
+def readings_cache_stats():
+    totals = {}
+    for cache in list(readings_caches.values()):
+        for name, count in cache.stats().items():
+            totals[name] = totals.get(name, 0) + count
+    return totals
+
+# Parsed and validated documents, also the registry for persisted-query hashes
+documents = DocumentCache()
+
+# Prepared analytics arrays; built lazily so NumPy stays out of the cold start
+analytics_cache = None
+
+def get_analytics_cache():
+    global analytics_cache
+    if analytics_cache is None:
+        import analytics
+        analytics_cache = analytics.ArrayCache()
+    return analytics_cache
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
+    'Access-Control-Expose-Headers': '*',
+    'Access-Control-Max-Age': '3600',
+    'Access-Control-Allow-Credentials': 'true'
+}
+
+INGEST_INTERVAL_SECONDS = 6 * 60 * 60  # Schedule of the ingest Lambda
+WINDOW_STEP_SECONDS = 60 * 60  # Cacheable GET windows end on the next whole hour
+MIN_MAX_AGE_SECONDS = 60
+STATUS_PATH = '/status'  # Plain JSON current status for widgets and the home page
+
+COMPRESS_MIN_BYTES = 1024  # Smaller bodies are not worth the CPU or the base64 overhead
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+DEFAULT_MAX_POINTS = 500
+DEFAULT_TREND_WINDOW_SECONDS = 3 * 60 * 60
+DEFAULT_THRESHOLD = 50.0  # AuroraWatch's lower threshold for yellow
+
+DEFAULT_WAIT_SECONDS = 20
+MAX_WAIT_SECONDS = 25  # Inside API Gateway's 29 second integration timeout
+MAX_UPDATES_SECONDS = 24 * 60 * 60  # Older cursors get the last day; clients refetch the window instead
 
 class AuroraEntry(ObjectType):
     epochtime = Int()
     status_id = String()
     value = String()
 
+class SeriesBucket(ObjectType):
+    epochtime = Int()
+    min = Float()
+    max = Float()
+    mean = Float()
+    count = Int()
+    status_id = String()
+
+class AnalyticsPoint(ObjectType):
+    epochtime = Int()
+    count = Int()
+    rolling_mean = Float()
+    rate_of_change = Float(description="Least-squares slope over the trend window, per hour")
+    p10 = Float()
+    median = Float()
+    p90 = Float()
+
+class Analytics(ObjectType):
+    points = List(AnalyticsPoint)
+    bucket_seconds = Int()
+    window_seconds = Int()
+    threshold = Float()
+    seconds_above_threshold = Float()
+    fraction_above_threshold = Float()
+    latest_rolling_mean = Float()
+    latest_rate_of_change = Float()
+
+class StationReading(ObjectType):
+    station = String()
+    epochtime = Int()
+    status_id = String()
+    value = String()
+
+class Threshold(ObjectType):
+    status_id = String()
+    value = Float()
+
+class CurrentStatus(ObjectType):
+    station = String()
+    epochtime = Int(description="Time of the newest reading")
+    status_id = String()
+    value = String()
+    thresholds = List(Threshold, description="The feed's lower threshold for each status")
+    updated = Int(description="When the feed was last published")
+    ingested_at = Int(description="When the feed was last checked")
+
+class AuroraUpdates(ObjectType):
+    entries = List(AuroraEntry, description="Readings newer than `since`, in time order")
+    cursor = Int(description="Epochtime to pass as `since` next time")
+    sequence = Int(description="Latest ingest notification seen, if any")
+
+class AuroraEntryConnection(relay.Connection):
+    class Meta:
+        node = AuroraEntry
+
+def finite(value):
+    # GraphQL Float has no NaN; undefined statistics are null
+    if value is None:
+        return None
+    value = float(value)
+    return None if value != value else value
+
+def to_entry(item):
+    return AuroraEntry(
+        epochtime=item['epochtime'],
+        status_id=item.get('status_id', ''),
+        value=item.get('value', '')
+    )
+
+def encode_cursor(epochtime):
+    return base64.b64encode(f"epochtime:{int(epochtime)}".encode()).decode()
+
+def decode_cursor(cursor):
+    return int(base64.b64decode(cursor).decode().split(':', 1)[1])
+
+def request_time(info):
+    # Cacheable requests pin 'now' so the same query returns the same data until the window moves
+    return info.context.get('now') or int(time.time())
+
+def readings_loader(info, station=aurora_store.DEFAULT_STATION):
+    # One loader per station per request, so every window field on a station shares a single fetch
+    loaders = info.context.setdefault('readings', {})
+    if station not in loaders:
+        loaders[station] = RangeLoader(readings_cache_for(station).get)
+    return loaders[station]
+
+STATION_ARGUMENT = dict(station=String(default_value=aurora_store.DEFAULT_STATION))
+
 class Query(ObjectType):
     hello = String(name=String(default_value="stranger"))
-    aurora_entries = List(AuroraEntry, days=Int(required=True))
+    aurora_entries = List(AuroraEntry, days=Int(required=True), since=Int(), **STATION_ARGUMENT)
+    aurora_entries_connection = Field(
+        AuroraEntryConnection,
+        days=Int(required=True),
+        first=Int(default_value=DEFAULT_PAGE_SIZE),
+        after=String(),
+        **STATION_ARGUMENT
+    )
+    aurora_series = List(
+        SeriesBucket,
+        days=Int(required=True),
+        bucket_seconds=Int(),
+        max_points=Int(default_value=DEFAULT_MAX_POINTS),
+        **STATION_ARGUMENT
+    )
+    aurora_analytics = Field(
+        Analytics,
+        days=Int(required=True),
+        threshold=Float(default_value=DEFAULT_THRESHOLD),
+        window_seconds=Int(default_value=DEFAULT_TREND_WINDOW_SECONDS),
+        max_points=Int(default_value=DEFAULT_MAX_POINTS),
+        **STATION_ARGUMENT
+    )
+    aurora_updates = Field(
+        AuroraUpdates,
+        since=Int(required=True),
+        wait_seconds=Int(default_value=DEFAULT_WAIT_SECONDS),
+        description="Long poll: readings after `since`, waiting up to waitSeconds for the next ingest",
+        **STATION_ARGUMENT
+    )
+    latest_readings = List(StationReading, description="The newest reading of every station, from one index query")
+    current_status = Field(CurrentStatus, description="The station's current status, from one point read",
+                           **STATION_ARGUMENT)
 
     def resolve_hello(self, info, name):
         return f"Hello, {name}!"
 
-    def resolve_aurora_entries(self, info, days):
+    def resolve_aurora_entries(self, info, days, station, since=None):
         # Calculate the timestamp for 'days' ago
-        current_time = int(time.time())
+        current_time = request_time(info)
+        start_time = current_time - (days * 24 * 60 * 60)
+        if since is not None:
+            # Only the delta after the client's newest reading
+            start_time = max(start_time, since + 1)
+        logger.debug("querying for: %s", start_time)
+        return [to_entry(item) for item in readings_loader(info, station).load(start_time, current_time)]
+
+    def resolve_aurora_entries_connection(self, info, days, first, station, after=None):
+        # Keyset pagination: the cursor is the last epochtime the client has seen
+        current_time = request_time(info)
+        start_time = current_time - (days * 24 * 60 * 60)
+        if after:
+            start_time = max(start_time, decode_cursor(after) + 1)
+        first = max(0, min(first, MAX_PAGE_SIZE))
+
+        # Read one item past the page to learn whether another page follows
+        with closing(archive.iter_range(start_time, current_time, station=station)) as reader:
+            items = list(islice(reader, first + 1))
+        page = items[:first]
+        edges = [AuroraEntryConnection.Edge(node=to_entry(item), cursor=encode_cursor(item['epochtime']))
+                 for item in page]
+        return AuroraEntryConnection(
+            edges=edges,
+            page_info=relay.PageInfo(
+                has_next_page=len(items) > first,
+                has_previous_page=after is not None,
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None
+            )
+        )
+
+    def resolve_aurora_series(self, info, days, max_points, station, bucket_seconds=None):
+        import series  # NumPy is only loaded by requests that aggregate
+        # Aggregate server side so wide windows ship a few hundred points, not every reading
+        current_time = request_time(info)
+        start_time = current_time - (days * 24 * 60 * 60)
+        bucket_seconds = series.choose_bucket_seconds(current_time - start_time, bucket_seconds, max_points)
+        resolution = rollups.resolution_for(bucket_seconds)
+        if resolution:
+            # Whole rollup periods per bucket, so no rollup straddles two buckets
+            period = rollups.RESOLUTIONS[resolution]
+            bucket_seconds = -(-bucket_seconds // period) * period
+        partials = read_partials(start_time, current_time, bucket_seconds, readings_loader(info, station).load, station)
+        buckets = series.aggregate_partials(partials, bucket_seconds)
+        return [
+            SeriesBucket(epochtime=int(epochtime), min=float(low), max=float(high), mean=float(mean),
+                         count=int(count), status_id=status_id)
+            for epochtime, low, high, mean, count, status_id in zip(
+                buckets['epochtime'], buckets['min'], buckets['max'], buckets['mean'],
+                buckets['count'], buckets['status_id'])
+        ]
+
+    def resolve_aurora_analytics(self, info, days, threshold, window_seconds, max_points, station):
+        import analytics
+        import series
+        current_time = request_time(info)
         start_time = current_time - (days * 24 * 60 * 60)
-        print("querying for:")
-        print(start_time)
-        # Query DynamoDB
-        response = table.scan(
-            FilterExpression='epochtime >= :start_time',
-            ExpressionAttributeValues={':start_time': start_time}
+        bucket_seconds = series.choose_bucket_seconds(current_time - start_time, None, max_points)
+        readings = readings_loader(info, station).load(start_time, current_time)
+        # Intermediates survive warm invocations until the data or the (minute-aligned) window changes
+        cache = readings_cache_for(station)
+        key = (station, cache.version, *cache.normalise(start_time, current_time))
+        prepared = get_analytics_cache().get(key, lambda: analytics.prepare(*series.to_arrays(readings)[:2]))
+        result = analytics.analyse(prepared, bucket_seconds, max(1, window_seconds), threshold,
+                                   start_time, current_time, rollups.READING_SECONDS)
+        return Analytics(
+            points=[
+                AnalyticsPoint(epochtime=int(epochtime), count=int(count), rolling_mean=finite(mean),
+                               rate_of_change=finite(slope), p10=finite(p10), median=finite(median), p90=finite(p90))
+                for epochtime, count, mean, slope, p10, median, p90 in zip(
+                    result['epochtime'], result['count'], result['rolling_mean'], result['rate_of_change'],
+                    *result['bands'])
+            ],
+            bucket_seconds=bucket_seconds,
+            window_seconds=window_seconds,
+            threshold=threshold,
+            seconds_above_threshold=result['seconds_above'],
+            fraction_above_threshold=result['fraction_above'],
+            latest_rolling_mean=result['latest_rolling_mean'],
+            latest_rate_of_change=finite(result['latest_rate_of_change'])
+        )
+
+    def resolve_aurora_updates(self, info, since, wait_seconds, station):
+        # Never cached: the answer depends on when the request arrives, not on a window
+        info.context['no_store'] = True
+        broker = updates.get_broker()
+        # Note the sequence before reading, so an ingest between the two is not missed
+        message = broker.latest()
+        seen = message['sequence'] if message else 0
+        items = read_since(since, station)
+        wait_seconds = max(0, min(wait_seconds, MAX_WAIT_SECONDS))
+        if not items and wait_seconds:
+            with tracing.span('wait'):
+                message = broker.wait(seen, wait_seconds)
+            # Any station's ingest wakes the wait; only this station's readings are returned
+            if message and message['sequence'] > seen:
+                items = read_since(since, station)
+        return AuroraUpdates(
+            entries=[to_entry(item) for item in items],
+            cursor=int(items[-1]['epochtime']) if items else since,
+            sequence=message['sequence'] if message else None
         )
 
-        # Process and return the results
-        print("Response:")
-        print(response)
-        entries = []
-        for item in response['Items']:
-            print(item)
-            entries.append(AuroraEntry(
-                epochtime=item['epochtime'],
-                status_id=item.get('status_id', ''),
-                value=item.get('value', '')
-            ))
+    def resolve_latest_readings(self, info):
+        return [StationReading(station=item['station'], epochtime=item['epochtime'],
+                               status_id=item.get('status_id', ''), value=item.get('value', ''))
+                for item in aurora_store.latest_readings()]
+
+    def resolve_current_status(self, info, station):
+        status = read_status(station)
+        return CurrentStatus(**status) if status else None
+
+def read_status(station=aurora_store.DEFAULT_STATION):
+    """The station's status item as plain values, or None before its first ingest."""
+    item = aurora_store.get_meta(aurora_store.latest_meta(station))
+    if 'epochtime' not in item:
+        return None
+    return {
+        'station': station,
+        'epochtime': int(item['epochtime']),
+        'status_id': item.get('status_id', ''),
+        'value': str(item.get('value', '')),
+        'thresholds': [{'status_id': threshold['status_id'], 'value': float(threshold['value'])}
+                       for threshold in item.get('thresholds', [])],
+        'updated': int(item['updated']) if item.get('updated') is not None else None,
+        'ingested_at': int(item['ingested_at']) if item.get('ingested_at') is not None else None
+    }
+
+def read_since(since, station=aurora_store.DEFAULT_STATION):
+    """A station's readings after `since`, read consistently so a just-announced write is visible."""
+    now = int(time.time())
+    start = max(since + 1, now - MAX_UPDATES_SECONDS)
+    return aurora_store.query_range(start, now + WINDOW_STEP_SECONDS, consistent_read=True, station=station)
+
+def read_partials(start_time, end_time, bucket_seconds, load=readings_cache.get, station=aurora_store.DEFAULT_STATION):
+    """Rollups for complete periods when the buckets are wide enough, raw readings for the rest."""
+    import series
+    resolution = rollups.resolution_for(bucket_seconds)
+    if resolution is None:
+        return series.reading_partials(*series.to_arrays(load(start_time, end_time)))
+    edge = rollups.period_start(end_time, resolution)
+    stored = rollups.read_rollups(resolution, rollups.period_start(start_time, resolution), edge - 1, station)
+    recent = load(edge, end_time)
+    return series.concat(series.rollup_partials(stored),
+                         series.reading_partials(*series.to_arrays(recent)))
 
-        return entries
+# The schema is built on first use rather than at import
+schema = None
 
-# Create the schema
-schema = Schema(query=Query)
+def get_schema():
+    global schema
+    if schema is None:
+        schema = Schema(query=Query)
+    return schema
+
+def get_header(event, name):
+    headers = event.get('headers') or {}
+    return next((value for key, value in headers.items() if key.lower() == name.lower()), None)
+
+def cache_max_age(now, window_end, ingested_at=None):
+    """Seconds until either the window moves or the next scheduled ingestion could change the data."""
+    if ingested_at is None:
+        ingested_at = aurora_store.get_meta('ingest').get('ingested_at')
+    if ingested_at is None:
+        return MIN_MAX_AGE_SECONDS
+    next_ingest = int(ingested_at) + INGEST_INTERVAL_SECONDS
+    return max(MIN_MAX_AGE_SECONDS, min(next_ingest, window_end) - now)
+
+def etag_matches(if_none_match, etag):
+    return if_none_match is not None and (
+        if_none_match.strip() == '*' or
+        etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')])
+
+def accepts(header, token):
+    """Whether an Accept or Accept-Encoding header lists the token without q=0."""
+    for part in (header or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip() == token and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            return True
+    return False
+
+def compress(body, accept_encoding):
+    """Return (body, Content-Encoding) using brotli when the client and the package allow, else gzip."""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    if accepts(accept_encoding, 'br'):
+        try:
+            import brotli  # Optional: only used when bundled with the function
+            return brotli.compress(body), 'br'
+        except ImportError:
+            pass
+    if accepts(accept_encoding, 'gzip'):
+        return gzip.compress(body, mtime=0), 'gzip'  # mtime=0 keeps the bytes, and so the ETag, stable
+    return body, None
+
+def encode_body(event, payload):
+    """Serialise the payload as columnar when the client asks and the shape allows, else JSON."""
+    if accepts(get_header(event, 'Accept'), columnar.CONTENT_TYPE):
+        try:
+            return columnar.encode(payload['data']), columnar.CONTENT_TYPE
+        except columnar.UnencodableError as error:
+            logger.debug("Falling back to JSON: %s", error)
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode(), 'application/json'
+
+def to_response(status_code, headers, body, content_type):
+    headers = {'Content-Type': content_type, **headers}
+    if content_type == 'application/json' and 'Content-Encoding' not in headers:
+        return {'statusCode': status_code, 'headers': headers, 'body': body.decode()}
+    # API Gateway passes binary bodies through base64
+    return {'statusCode': status_code, 'headers': headers,
+            'body': base64.b64encode(body).decode(), 'isBase64Encoded': True}
+
+def execute_query(query, variables, context_value, extensions):
+    """Execute a query given as text and/or a persisted-query hash, reusing cached documents."""
+    persisted_hash = (extensions.get('persistedQuery') or {}).get('sha256Hash')
+    if not query and not persisted_hash:
+        return ExecutionResult(data=None, errors=[GraphQLError('Must provide query string.')])
+    graphql_schema = get_schema().graphql_schema
+    with tracing.span('parse'):
+        document, errors = documents.get(graphql_schema, query or None, persisted_hash)
+    if errors:
+        return ExecutionResult(data=None, errors=errors)
+    if 'now' in context_value:
+        # Declare every window up front so the first field to resolve on a station fetches them all at once
+        now = context_value['now']
+        windows = declared_windows(document, variables, now)
+        windows += declared_windows(document, variables, now, station=aurora_store.DEFAULT_STATION)
+        loaders = {aurora_store.DEFAULT_STATION: RangeLoader(readings_cache.get, windows)}
+        for station in stations_in(document):
+            loaders.setdefault(station, RangeLoader(readings_cache_for(station).get,
+                                                    declared_windows(document, variables, now, station=station)))
+        context_value['readings'] = loaders
+    with tracing.span('execute'):
+        return execute(graphql_schema, document, variable_values=variables, context_value=context_value)
+
+def stations_in(document):
+    """Stations named literally on root fields; those given as variables get their loader lazily."""
+    return {argument.value.value for field in root_fields(document) for argument in field.arguments
+            if argument.name.value == 'station' and hasattr(argument.value, 'value')}
 
 def lambda_handler(event, context):
+    tracing.start('graphql')
+    response = handle_request(event)
+    # One structured record per invocation with the span timings and consumed capacity
+    tracing.finish(statusCode=response['statusCode'])
+    return response
+
+def is_status_request(event):
+    path = event.get('resource') or event.get('rawPath') or event.get('path') or ''
+    method = event.get('httpMethod') or event.get('requestContext', {}).get('http', {}).get('method')
+    return path.rstrip('/').endswith(STATUS_PATH) and method in ('GET', 'HEAD')
+
+def status_response(event):
+    """GET /status?station=awn: the current status as a small JSON document, cacheable until the next ingest."""
+    station = (event.get('queryStringParameters') or {}).get('station') or aurora_store.DEFAULT_STATION
+    status = read_status(station)
+    headers = {'Content-Type': 'application/json', **CORS_HEADERS}
+    if status is None:
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': f'No status for {station}'})}
+    # ingested_at moves every run, so it sets the cache lifetime but stays out of the body and its ETag
+    ingested_at = status.pop('ingested_at')
+    # Named as in the GraphQL currentStatus field
+    document = {
+        'station': status['station'], 'epochtime': status['epochtime'], 'statusId': status['status_id'],
+        'value': status['value'], 'updated': status['updated'],
+        'thresholds': [{'statusId': threshold['status_id'], 'value': threshold['value']} for threshold in status['thresholds']]
+    }
+    body = json.dumps(document, sort_keys=True, separators=(',', ':'))
+    etag = '"' + hashlib.sha256(body.encode()).hexdigest() + '"'
+    now = int(time.time())
+    headers.update({
+        'ETag': etag,
+        'Cache-Control': f"public, max-age={cache_max_age(now, now + INGEST_INTERVAL_SECONDS, ingested_at)}"
+    })
+    if etag_matches(get_header(event, 'If-None-Match'), etag):
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+    return {'statusCode': 200, 'headers': headers, 'body': body}
+
+def handle_request(event):
     # Debug logging
-    print("Event received:", json.dumps(event, indent=2))
-    print("Headers:", event.get('headers', {}))
-    print("Authorization header:", event.get('headers', {}).get('Authorization', 'No Auth header'))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Event received: %s", json.dumps(event, indent=2))
+        logger.debug("Authorization header present: %s", get_header(event, 'Authorization') is not None)
+
+    if is_status_request(event):
+        return status_response(event)
     
     # Parse the GraphQL query from the event
-    print("Event:")
-    print(event)
-    if 'body' in event:
+    cacheable = False
+    if event.get('body'):
         # For API Gateway or Lambda Function URL with POST method
-        body = json.loads(event['body'])
+        raw = base64.b64decode(event['body']) if event.get('isBase64Encoded') else event['body']
+        body = json.loads(raw)
         query = body.get('query', '')
         variables = body.get('variables', {})
-    elif 'queryStringParameters' in event:
-        # For API Gateway or Lambda Function URL with GET method
+        extensions = body.get('extensions') or {}
+    elif event.get('queryStringParameters'):
+        # For API Gateway or Lambda Function URL with GET method; responses may be cached at the edge
         query = event['queryStringParameters'].get('query', '')
         variables = json.loads(event['queryStringParameters'].get('variables', '{}'))
+        extensions = json.loads(event['queryStringParameters'].get('extensions', '{}'))
+        cacheable = True
     else:
         return {
             'statusCode': 400,
             'body': json.dumps({'error': 'No GraphQL query found in the request'})
         }
-    print("Executing GraphQL query:", query)
+    logger.debug("Executing GraphQL query: %s", query)
     # Execute the query
-    result = schema.execute(query, variable_values=variables)
+    now = int(time.time())
+    # One 'now' for the whole request, so every field measures its window from the same instant
+    context_value = {'now': now}
+    if cacheable:
+        context_value['now'] = -(-now // WINDOW_STEP_SECONDS) * WINDOW_STEP_SECONDS
+    cache_before = readings_cache_stats()
+    result = execute_query(query, variables, context_value, extensions)
+    cache_stats = {name: count - cache_before.get(name, 0) for name, count in readings_cache_stats().items()}
     
     # Check for errors
     if result.errors:
         return {
             'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-                'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
-                'Access-Control-Expose-Headers': '*',
-                'Access-Control-Max-Age': '3600',
-                'Access-Control-Allow-Credentials': 'true'
-            },
+            'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
             'body': json.dumps({'errors': [str(error) for error in result.errors]})
         }
     
-    # Return the result with CORS headers
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-            'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
-            'Access-Control-Expose-Headers': '*',
-            'Access-Control-Max-Age': '3600',
-            'Access-Control-Allow-Credentials': 'true'
-        },
-        'body': json.dumps({'data': result.data})
-    }
+    if context_value.get('no_store'):
+        cacheable = False
+    payload = {'data': result.data}
+    if not cacheable:
+        payload['extensions'] = {'cache': cache_stats}
+        trace = tracing.current()
+        if extensions.get('tracing') and trace:
+            # Opt-in timings; cacheable responses leave them out so their bodies stay byte-stable
+            payload['extensions']['tracing'] = trace.summary()
+    # Byte-stable body so the strong ETag identifies the data in this representation
+    with tracing.span('serialise'):
+        body, content_type = encode_body(event, payload)
+        body, content_encoding = compress(body, get_header(event, 'Accept-Encoding'))
+    headers = {'Vary': 'Accept, Accept-Encoding', **CORS_HEADERS}
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    if context_value.get('no_store'):
+        headers['Cache-Control'] = 'no-store'
+    if not cacheable:
+        # Return the result with CORS headers
+        return to_response(200, headers, body, content_type)
+
+    etag = '"' + hashlib.sha256(body).hexdigest() + '"'
+    headers.update({
+        'ETag': etag,
+        'Cache-Control': f"public, max-age={cache_max_age(now, context_value['now'])}"
+    })
+    if etag_matches(get_header(event, 'If-None-Match'), etag):
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+    return to_response(200, headers, body, content_type)
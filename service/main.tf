@@ -42,10 +42,11 @@ resource "aws_lambda_function" "service_lambda" {
   handler          = "lambda_function.lambda_handler"
   source_code_hash = filebase64sha256("${path.root}/service-function.zip")
   runtime          = "python3.12"
+  timeout          = 30  # auroraUpdates long-polls for up to 25 seconds
 
   environment {
     variables = {
-      # Add any environment variables your Lambda might need
+      ARCHIVE_BUCKET = "aurora-warn-uk-archive"  # Created by the lambda module
     }
   }
 }
@@ -61,6 +62,23 @@ resource "aws_iam_role_policy_attachment" "lambda_dynamodb_read" {
   role       = aws_iam_role.lambda_role.name
 }
 
+# Archived months of readings, for long windows
+resource "aws_iam_role_policy" "archive_read" {
+  name = "AuroraArchiveReadPolicy"
+  role = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["s3:GetObject", "s3:ListBucket"]  # ListBucket turns a missing blob into 404, not 403
+        Resource = ["arn:aws:s3:::aurora-warn-uk-archive", "arn:aws:s3:::aurora-warn-uk-archive/*"]
+      }
+    ]
+  })
+}
+
 # Add these outputs at the end of the file
 output "lambda_invoke_arn" {
   value = aws_lambda_function.service_lambda.invoke_arn
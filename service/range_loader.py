@@ -0,0 +1,77 @@
+# range_loader.py
+# Per-request batching of time-range reads, in the spirit of DataLoader: the windows every
+# raw-reading field in an operation will ask for are declared before execution, the first
+# field to resolve fetches their union once, and every field is answered by bisecting that
+# one time-ordered list.
+from bisect import bisect_left, bisect_right
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode, OperationDefinitionNode, value_from_ast_untyped
+
+SECONDS_PER_DAY = 24 * 60 * 60
+WINDOW_FIELDS = {'auroraEntries', 'auroraAnalytics'}  # Root fields reading raw readings `days` back from now
+
+
+def root_fields(document, operation_name=None):
+    """Root field nodes of the operation to run, with fragments expanded."""
+    fragments = {definition.name.value: definition for definition in document.definitions
+                 if definition.kind == 'fragment_definition'}
+    operations = [definition for definition in document.definitions if isinstance(definition, OperationDefinitionNode)]
+    operation = next((candidate for candidate in operations
+                      if operation_name is None or (candidate.name and candidate.name.value == operation_name)), None)
+    if operation is None:
+        return []
+    fields, pending, seen = [], list(operation.selection_set.selections), set()
+    while pending:
+        selection = pending.pop(0)
+        if isinstance(selection, FieldNode):
+            fields.append(selection)
+        elif isinstance(selection, InlineFragmentNode):
+            pending.extend(selection.selection_set.selections)
+        elif isinstance(selection, FragmentSpreadNode) and selection.name.value not in seen:
+            seen.add(selection.name.value)
+            if selection.name.value in fragments:
+                pending.extend(fragments[selection.name.value].selection_set.selections)
+    return fields
+
+
+def argument(field, name, variables):
+    return next((value_from_ast_untyped(node.value, variables or {})
+                 for node in field.arguments if node.name.value == name), None)
+
+
+def declared_windows(document, variables, now, operation_name=None, station=None):
+    """(start, end) of every window field on the station whose `days` is known before execution.
+
+    Fields without a `station` argument match station=None, the schema's default station.
+    """
+    windows = []
+    for field in root_fields(document, operation_name):
+        if field.name.value not in WINDOW_FIELDS or argument(field, 'station', variables) != station:
+            continue
+        days = argument(field, 'days', variables)
+        if isinstance(days, int):
+            windows.append((now - days * SECONDS_PER_DAY, now))
+    return windows
+
+
+class RangeLoader:
+
+    def __init__(self, fetch, windows=()):
+        self.fetch = fetch  # (start, end) -> time-ordered items
+        self.windows = list(windows)
+        self.start = None
+        self.end = None
+        self.epochs = []
+        self.items = []
+        self.fetches = 0
+
+    def load(self, start, end):
+        """Items with start <= epochtime <= end, from one fetch covering every declared window."""
+        if self.start is None or not (self.start <= start and end <= self.end):
+            # Widen to every declared window, and to what was already loaded, so one read serves all
+            bounds = self.windows + [(start, end)] + ([(self.start, self.end)] if self.start is not None else [])
+            self.start = min(low for low, _ in bounds)
+            self.end = max(high for _, high in bounds)
+            self.items = self.fetch(self.start, self.end)
+            self.epochs = [int(item['epochtime']) for item in self.items]
+            self.fetches += 1
+        return self.items[bisect_left(self.epochs, start):bisect_right(self.epochs, end)]
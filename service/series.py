@@ -0,0 +1,97 @@
+# series.py
+# Downsampling of raw readings into fixed-width time buckets for the chart.
+import math
+import numpy as np
+
+# Least to most severe; unknown statuses rank below green
+STATUS_ORDER = ['green', 'yellow', 'amber', 'red']
+STATUS_RANK = {status: rank for rank, status in enumerate(STATUS_ORDER)}
+
+
+def to_arrays(items):
+    """Split readings into epoch, value and status arrays, skipping rows without a value."""
+    rows = [(item['epochtime'], item['value'], item.get('status_id', '')) for item in items
+            if item.get('value') not in (None, '')]
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), np.empty(0, dtype=object)
+    epochs, values, statuses = zip(*rows)
+    return (np.array(epochs, dtype=np.int64),
+            np.array(values, dtype=np.float64),
+            np.array(statuses, dtype=object))
+
+
+def choose_bucket_seconds(window_seconds, bucket_seconds=None, max_points=None):
+    """Widen the bucket so a window of this length produces at most max_points buckets."""
+    bucket_seconds = max(1, int(bucket_seconds or 1))
+    if max_points:
+        bucket_seconds = max(bucket_seconds, math.ceil(window_seconds / max_points))
+    return bucket_seconds
+
+
+def worst_status(statuses):
+    return max(statuses, key=lambda status: STATUS_RANK.get(status, -1), default='')
+
+
+def reading_partials(epochs, values, statuses):
+    """Treat each raw reading as a partial aggregate of one."""
+    return {'epochtime': epochs, 'count': np.ones(len(epochs), dtype=np.int64),
+            'min': values, 'max': values, 'sum': values, 'status_id': statuses}
+
+
+def rollup_partials(rollups):
+    """Partial aggregates from stored hourly or daily rollups."""
+    rollups = list(rollups)
+    return {
+        'epochtime': np.array([rollup['epochtime'] for rollup in rollups], dtype=np.int64),
+        'count': np.array([rollup['count'] for rollup in rollups], dtype=np.int64),
+        'min': np.array([rollup['min'] for rollup in rollups], dtype=np.float64),
+        'max': np.array([rollup['max'] for rollup in rollups], dtype=np.float64),
+        'sum': np.array([rollup['sum'] for rollup in rollups], dtype=np.float64),
+        'status_id': np.array([worst_status(rollup['status_seconds']) for rollup in rollups], dtype=object),
+    }
+
+
+def concat(*partials):
+    return {field: np.concatenate([partial[field] for partial in partials]) for field in partials[0]}
+
+
+def aggregate(epochs, values, statuses, bucket_seconds):
+    """Aggregate raw readings into buckets aligned to multiples of bucket_seconds since the epoch."""
+    return aggregate_partials(reading_partials(epochs, values, statuses), bucket_seconds)
+
+
+def aggregate_partials(partials, bucket_seconds):
+    """Merge partial aggregates into buckets aligned to multiples of bucket_seconds since the epoch.
+
+    Returns a dict of equal-length arrays: epochtime (bucket start), min, max, mean, count and
+    status_id (the most severe status seen in the bucket). Empty buckets are omitted.
+    """
+    epochs = partials['epochtime']
+    if len(epochs) == 0:
+        empty = np.empty(0)
+        return {'epochtime': empty.astype(np.int64), 'min': empty, 'max': empty, 'mean': empty,
+                'count': empty.astype(np.int64), 'status_id': empty.astype(object)}
+
+    order = np.argsort(epochs, kind='stable')
+    epochs = epochs[order]
+    counts, mins, maxs, sums = (partials[field][order] for field in ('count', 'min', 'max', 'sum'))
+    statuses = partials['status_id'][order]
+
+    index = epochs // bucket_seconds
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(index)) + 1))
+    bucket_counts = np.add.reduceat(counts, starts)
+
+    # Encode each status as (rank + 1) * n + code so the max per bucket decodes to the worst status
+    names, codes = np.unique(statuses.astype(str), return_inverse=True)
+    ranks = np.array([STATUS_RANK.get(name, -1) + 1 for name in names], dtype=np.int64)
+    keys = ranks[codes] * len(names) + codes
+    worst = np.maximum.reduceat(keys, starts) % len(names)
+
+    return {
+        'epochtime': index[starts] * bucket_seconds,
+        'min': np.minimum.reduceat(mins, starts),
+        'max': np.maximum.reduceat(maxs, starts),
+        'mean': np.add.reduceat(sums, starts) / bucket_counts,
+        'count': bucket_counts,
+        'status_id': names[worst],
+    }
@@ -0,0 +1,72 @@
+import unittest
+import numpy as np
+
+import analytics
+
+HOUR = 3600
+
+
+def brute_force_mean(epochs, values, window_seconds):
+    return np.array([values[(epochs > epoch - window_seconds) & (epochs <= epoch)].mean() for epoch in epochs])
+
+
+class TestAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.epochs = np.sort(rng.choice(np.arange(0, 30 * 24 * HOUR, 60), 2000, replace=False)).astype(np.int64)
+        self.values = rng.uniform(0, 300, len(self.epochs))
+        self.prepared = analytics.prepare(self.epochs, self.values)
+
+    def test_rolling_mean_matches_brute_force(self):
+        starts = analytics.window_starts(self.epochs, 6 * HOUR)
+        np.testing.assert_allclose(analytics.rolling_mean(self.prepared, starts),
+                                   brute_force_mean(self.epochs, self.values, 6 * HOUR))
+
+    def test_rate_of_change_of_a_line_is_its_slope(self):
+        epochs = np.arange(0, 48 * HOUR, 600, dtype=np.int64)
+        values = 10 + 2.5 * epochs / HOUR
+        prepared = analytics.prepare(epochs, values)
+        slopes = analytics.rate_of_change(prepared, analytics.window_starts(epochs, 3 * HOUR))
+        self.assertTrue(np.isnan(slopes[0]))  # One reading has no slope
+        np.testing.assert_allclose(slopes[1:], 2.5)
+
+    def test_percentile_bands_match_numpy(self):
+        bucket_epochs, bands = analytics.percentile_bands(self.epochs, self.values, 24 * HOUR)
+        index = self.epochs // (24 * HOUR)
+        expected = np.array([np.percentile(self.values[index == day], analytics.PERCENTILES)
+                             for day in np.unique(index)]).T
+        np.testing.assert_allclose(bands, expected)
+        np.testing.assert_array_equal(bucket_epochs, np.unique(index) * 24 * HOUR)
+
+    def test_seconds_above_caps_each_reading(self):
+        epochs = np.array([0, 600, 7200, 20000], dtype=np.int64)
+        values = np.array([60.0, 10.0, 80.0, 90.0])
+        # 600 s for the first, an hour for the third (capped), and the last until the window ends
+        self.assertEqual(analytics.seconds_above(epochs, values, 50, 21000, HOUR), 600 + HOUR + 1000)
+
+    def test_analyse_samples_rolling_statistics_per_bucket(self):
+        result = analytics.analyse(self.prepared, 24 * HOUR, 6 * HOUR, 150.0, 0, 30 * 24 * HOUR, HOUR)
+        self.assertEqual(result['count'].sum(), len(self.epochs))
+        last = np.cumsum(result['count']) - 1
+        np.testing.assert_allclose(result['rolling_mean'],
+                                   brute_force_mean(self.epochs, self.values, 6 * HOUR)[last])
+        self.assertTrue(0 < result['fraction_above'] < 1)
+
+    def test_empty_series(self):
+        result = analytics.analyse(analytics.prepare(np.empty(0, dtype=np.int64), np.empty(0)),
+                                   HOUR, HOUR, 50.0, 0, HOUR, HOUR)
+        self.assertEqual(len(result['epochtime']), 0)
+        self.assertIsNone(result['latest_rolling_mean'])
+
+    def test_array_cache_builds_once_per_key(self):
+        cache = analytics.ArrayCache(max_entries=1)
+        builds = []
+        for key in ['a', 'a', 'b', 'a']:
+            cache.get(key, lambda: builds.append(key))
+        self.assertEqual(builds, ['a', 'b', 'a'])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
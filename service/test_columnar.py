@@ -0,0 +1,53 @@
+import math
+import struct
+import unittest
+from decimal import Decimal
+
+import columnar
+
+
+class TestColumnar(unittest.TestCase):
+
+    def test_round_trip(self):
+        data = {'auroraEntries': [
+            {'epochtime': 1696118400 + i * 3600, 'statusId': ['green', 'amber'][i % 2],
+             'value': str(i + 0.5), 'count': i}
+            for i in range(10)
+        ]}
+        decoded = columnar.decode(columnar.encode(data))['auroraEntries']
+        self.assertEqual(decoded['epochtime'], [row['epochtime'] for row in data['auroraEntries']])
+        self.assertEqual(decoded['statusId'], [row['statusId'] for row in data['auroraEntries']])
+        self.assertEqual(decoded['value'], [i + 0.5 for i in range(10)])
+        self.assertEqual(decoded['count'], list(range(10)))
+
+    def test_missing_values_become_nan_and_decode_as_none(self):
+        data = {'s': [{'epochtime': 1, 'max': Decimal('2.5')}, {'epochtime': 5, 'max': None}]}
+        self.assertEqual(columnar.decode(columnar.encode(data))['s']['max'], [2.5, None])
+
+    def test_arrays_are_four_byte_aligned(self):
+        body = columnar.encode({'x': [{'statusId': 'red', 'value': '1'}]})
+        # float32 1.0, which clients view in place as a Float32Array
+        self.assertEqual(body.index(struct.pack('<f', 1.0)) % 4, 0)
+
+    def test_wide_dictionaries_use_uint16_indices(self):
+        rows = [{'statusId': f'status-{i}'} for i in range(300)]
+        decoded = columnar.decode(columnar.encode({'s': rows}))['s']['statusId']
+        self.assertEqual(decoded, [row['statusId'] for row in rows])
+
+    def test_columnar_is_smaller_than_json(self):
+        import json
+        rows = [{'epochtime': 1696118400 + i * 3600, 'statusId': 'green', 'value': f'{i % 97}.5'} for i in range(2000)]
+        self.assertLess(len(columnar.encode({'e': rows})) * 3, len(json.dumps({'data': {'e': rows}})))
+
+    def test_unsupported_shapes_are_rejected(self):
+        for data in [None, {'hello': 'world'}, {'e': [{'edges': [{'cursor': 'x'}]}]}, {'e': [{'flag': True}]}]:
+            with self.assertRaises(columnar.UnencodableError):
+                columnar.encode(data)
+
+    def test_nan_values_survive_as_missing(self):
+        body = columnar.encode({'s': [{'mean': math.nan}]})
+        self.assertEqual(columnar.decode(body)['s']['mean'], [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
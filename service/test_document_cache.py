@@ -0,0 +1,49 @@
+import unittest
+from graphene import ObjectType, Schema, String
+from document_cache import DocumentCache, PERSISTED_QUERY_NOT_FOUND, query_hash
+
+
+class Query(ObjectType):
+    hello = String()
+
+
+SCHEMA = Schema(query=Query).graphql_schema
+
+
+class TestDocumentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = DocumentCache(max_entries=2)
+
+    def test_repeated_query_is_parsed_once(self):
+        first, errors = self.cache.get(SCHEMA, '{ hello }')
+        self.assertIsNone(errors)
+        second, _ = self.cache.get(SCHEMA, '{ hello }')
+        self.assertIs(first, second)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_invalid_query_is_not_cached(self):
+        _, errors = self.cache.get(SCHEMA, '{ goodbye }')
+        self.assertTrue(errors)
+        _, syntax_errors = self.cache.get(SCHEMA, '{ hello')
+        self.assertTrue(syntax_errors)
+        self.assertEqual(len(self.cache.documents), 0)
+
+    def test_persisted_hash_lookup(self):
+        _, errors = self.cache.get(SCHEMA, sha256_hash=query_hash('{ hello }'))
+        self.assertEqual(errors[0].message, PERSISTED_QUERY_NOT_FOUND)
+        document, _ = self.cache.get(SCHEMA, '{ hello }', query_hash('{ hello }'))
+        self.assertIs(self.cache.get(SCHEMA, sha256_hash=query_hash('{ hello }'))[0], document)
+
+    def test_mismatched_hash_rejected(self):
+        _, errors = self.cache.get(SCHEMA, '{ hello }', query_hash('{ other }'))
+        self.assertTrue(errors)
+
+    def test_least_recently_used_evicted(self):
+        for query in ('{ hello }', 'query A { hello }', '{ hello }', 'query B { hello }'):
+            self.cache.get(SCHEMA, query)
+        self.assertEqual(list(self.cache.documents), [query_hash('{ hello }'), query_hash('query B { hello }')])
+
+
+if __name__ == '__main__':
+    unittest.main()
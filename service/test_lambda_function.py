@@ -1,5 +1,28 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock
+from moto import mock_aws
+from graphql import ExecutionResult
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'shared'))
+
+import archive
+import aurora_store
+import columnar
+import lambda_function
+import rollups
+import updates
 from lambda_function import lambda_handler
 
 class TestLambdaFunction(unittest.TestCase):
@@ -7,7 +30,7 @@ class TestLambdaFunction(unittest.TestCase):
     @patch('lambda_function.execute_query')
     def test_lambda_handler(self, mock_execute_query):
         # Mock the execute_query function
-        mock_execute_query.return_value = {"data": {"test": "result"}}
+        mock_execute_query.return_value = ExecutionResult(data={"test": "result"})
 
         # Create a sample event and context
         event = {
@@ -21,17 +44,18 @@ class TestLambdaFunction(unittest.TestCase):
 
         # Assert the response
         self.assertEqual(response['statusCode'], 200)
-        self.assertEqual(response['body'], '{"data": {"test": "result"}}')
+        self.assertEqual(json.loads(response['body'])['data'], {"test": "result"})
+        self.assertEqual(mock_execute_query.call_args[0][0], "query { test }")
 
     def test_lambda_handler_get_request(self):
-        # Test GET request
+        # A GET without a query string has nothing to execute; there is no playground page
         event = {"httpMethod": "GET"}
         context = MagicMock()
 
         response = lambda_handler(event, context)
 
-        self.assertEqual(response['statusCode'], 200)
-        self.assertIn("GraphQL Playground", response['body'])
+        self.assertEqual(response['statusCode'], 400)
+        self.assertIn("No GraphQL query found", response['body'])
 
     def test_lambda_handler_invalid_method(self):
         # Test invalid HTTP method
@@ -43,5 +67,266 @@ class TestLambdaFunction(unittest.TestCase):
         self.assertEqual(response['statusCode'], 400)
         self.assertEqual(response['body'], '{"error": "No GraphQL query found in the request"}')
 
+
+class TestAuroraEntries(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_readings_table()
+        rollups.create_rollups_table()
+        aurora_store.create_meta_table()
+        lambda_function.readings_cache.clear()
+        lambda_function.readings_cache.checked_at = None
+        self.now = int(time.time())
+        readings = [
+            aurora_store.with_bucket({'epochtime': self.now - hours * 3600 - 60, 'status_id': 'green', 'value': str(hours)})
+            for hours in range(0, 72, 6)
+        ]
+        aurora_store.batch_write(readings)
+        rollups.update_rollups([reading['epochtime'] for reading in readings])
+
+    def tearDown(self):
+        self.mock.stop()
+        updates._broker = None
+
+    def execute(self, query):
+        response = lambda_handler({'body': json.dumps({'query': query})}, MagicMock())
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])['data']
+
+    def test_aurora_entries_reads_window(self):
+        data = self.execute('query { auroraEntries(days: 1) { epochtime statusId value } }')
+        self.assertEqual(sorted(entry['value'] for entry in data['auroraEntries']), ['0', '12', '18', '6'])
+
+    def test_since_returns_only_the_delta(self):
+        since = self.now - 6 * 3600 - 60
+        data = self.execute(f'query {{ auroraEntries(days: 1, since: {since}) {{ value }} }}')
+        self.assertEqual([entry['value'] for entry in data['auroraEntries']], ['0'])
+
+    def test_updates_return_newer_readings_without_waiting(self):
+        updates._broker = updates.MemoryBroker()
+        since = self.now - 12 * 3600 - 60
+        response = lambda_handler({'body': json.dumps(
+            {'query': f'query {{ auroraUpdates(since: {since}, waitSeconds: 5) {{ entries {{ value }} cursor sequence }} }}'})},
+            MagicMock())
+        data = json.loads(response['body'])['data']['auroraUpdates']
+        self.assertEqual([entry['value'] for entry in data['entries']], ['6', '0'])
+        self.assertEqual(data['cursor'], self.now - 60)
+        self.assertIsNone(data['sequence'])
+        self.assertEqual(response['headers']['Cache-Control'], 'no-store')
+
+    def test_updates_wait_for_the_next_ingest(self):
+        broker = updates._broker = updates.MemoryBroker()
+        reading = {'epochtime': self.now, 'status_id': 'amber', 'value': 'new'}
+
+        def ingest():
+            aurora_store.batch_write([aurora_store.with_bucket(reading)])
+            broker.publish(updates.message_for([reading]))
+
+        timer = threading.Timer(0.1, ingest)
+        timer.start()
+        data = self.execute(f'query {{ auroraUpdates(since: {self.now - 60}, waitSeconds: 10) '
+                            f'{{ entries {{ epochtime value }} cursor sequence }} }}')
+        timer.join()
+        self.assertEqual(data['auroraUpdates'], {'entries': [{'epochtime': self.now, 'value': 'new'}],
+                                                 'cursor': self.now, 'sequence': 1})
+
+    def test_updates_time_out_empty(self):
+        updates._broker = updates.MemoryBroker()
+        data = self.execute(f'query {{ auroraUpdates(since: {self.now - 60}, waitSeconds: 0) {{ entries {{ value }} cursor }} }}')
+        self.assertEqual(data['auroraUpdates'], {'entries': [], 'cursor': self.now - 60})
+
+    def test_stations_are_read_separately(self):
+        reading = {'epochtime': self.now - 60, 'status_id': 'red', 'value': 'north'}
+        aurora_store.batch_write([aurora_store.with_bucket(reading, 'lerwick')])
+        aurora_store.update_latest('lerwick', reading)
+        data = self.execute('''query {
+            awn: auroraEntries(days: 1) { value }
+            lerwick: auroraEntries(days: 1, station: "lerwick") { value }
+            latestReadings { station statusId value }
+        }''')
+        self.assertEqual(len(data['awn']), 4)
+        self.assertEqual(data['lerwick'], [{'value': 'north'}])
+        self.assertEqual(data['latestReadings'], [{'station': 'lerwick', 'statusId': 'red', 'value': 'north'}])
+
+    def test_long_windows_read_archived_months(self):
+        old = archive.month_start(self.now) - 40 * 24 * 3600
+        reading = aurora_store.with_bucket({'epochtime': old, 'status_id': 'amber', 'value': '120.5'})
+        aurora_store.batch_write([reading])
+        with tempfile.TemporaryDirectory() as root, patch.object(archive, '_store', archive.LocalStore(root)):
+            archive.compact_month(archive.month_start(old))
+            aurora_store.batch_delete([aurora_store.key_for(old)])  # Expired from the table
+            data = self.execute('query { auroraEntries(days: 90) { epochtime value } }')
+        self.assertEqual(data['auroraEntries'][0], {'epochtime': old, 'value': '120.5'})
+        self.assertEqual(len(data['auroraEntries']), 13)
+
+    def test_current_status_is_one_point_read(self):
+        self.assertIsNone(self.execute('query { currentStatus { statusId } }')['currentStatus'])
+        aurora_store.update_latest('awn', {'epochtime': self.now - 60, 'status_id': 'amber', 'value': '120.5'},
+                                   thresholds=[{'status_id': 'amber', 'value': 100}], updated=self.now - 30,
+                                   ingested_at=self.now)
+        with patch.object(aurora_store.resource().meta.client, 'query') as query:
+            data = self.execute('query { currentStatus { station epochtime statusId value updated thresholds { statusId value } } }')
+        query.assert_not_called()
+        self.assertEqual(data['currentStatus'], {
+            'station': 'awn', 'epochtime': self.now - 60, 'statusId': 'amber', 'value': '120.5',
+            'updated': self.now - 30, 'thresholds': [{'statusId': 'amber', 'value': 100.0}]})
+
+    def test_status_rest_response_is_cacheable(self):
+        event = {'resource': '/status', 'httpMethod': 'GET', 'queryStringParameters': None, 'headers': {}}
+        self.assertEqual(lambda_handler(event, MagicMock())['statusCode'], 404)
+        aurora_store.update_latest('awn', {'epochtime': self.now - 60, 'status_id': 'green', 'value': '12'},
+                                   thresholds=[], updated=self.now - 30, ingested_at=self.now - 3600)
+        response = lambda_handler(event, MagicMock())
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body'])['statusId'], 'green')
+        max_age = lambda_function.INGEST_INTERVAL_SECONDS - 3600
+        self.assertIn(response['headers']['Cache-Control'], [f'public, max-age={max_age}', f'public, max-age={max_age - 1}'])
+
+        # Another run that found nothing new keeps the ETag
+        aurora_store.update_meta(aurora_store.latest_meta('awn'), ingested_at=self.now)
+        revalidate = dict(event, headers={'If-None-Match': response['headers']['ETag']})
+        self.assertEqual(lambda_handler(revalidate, MagicMock())['statusCode'], 304)
+
+    def test_repeated_window_served_from_cache(self):
+        query = 'query { auroraEntries(days: 1) { epochtime } }'
+        first = lambda_handler({'body': json.dumps({'query': query})}, MagicMock())
+        second = lambda_handler({'body': json.dumps({'query': query})}, MagicMock())
+        self.assertEqual(json.loads(first['body'])['extensions']['cache']['misses'], 1)
+        self.assertEqual(json.loads(second['body'])['extensions']['cache'], {'hits': 1, 'misses': 0, 'partialHits': 0})
+        self.assertEqual(json.loads(first['body'])['data'], json.loads(second['body'])['data'])
+
+    def test_multiple_windows_share_one_read(self):
+        query = '''query {
+            day: auroraEntries(days: 1) { epochtime }
+            twoDays: auroraEntries(days: 2) { epochtime }
+            week: auroraEntries(days: 7) { value }
+        }'''
+        lambda_function.readings_cache.clear()
+        response = lambda_handler({'body': json.dumps({'query': query})}, MagicMock())
+        body = json.loads(response['body'])
+        self.assertEqual([len(body['data'][field]) for field in ('day', 'twoDays', 'week')], [4, 8, 12])
+        self.assertEqual(body['extensions']['cache'], {'hits': 0, 'misses': 1, 'partialHits': 0})
+
+    def test_persisted_query_registered_then_sent_by_hash(self):
+        query = 'query { auroraEntries(days: 1) { value } }'
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': hashlib.sha256(query.encode()).hexdigest()}}
+        unknown = lambda_handler({'body': json.dumps({'extensions': extensions})}, MagicMock())
+        self.assertEqual(json.loads(unknown['body'])['errors'], ['PersistedQueryNotFound'])
+        registered = lambda_handler({'body': json.dumps({'query': query, 'extensions': extensions})}, MagicMock())
+        by_hash = lambda_handler({'body': json.dumps({'extensions': extensions})}, MagicMock())
+        self.assertEqual(by_hash['statusCode'], 200)
+        self.assertEqual(json.loads(by_hash['body'])['data'], json.loads(registered['body'])['data'])
+
+    def test_get_returns_etag_and_not_modified(self):
+        aurora_store.update_meta('ingest', ingested_at=self.now - 600, changed_at=self.now - 600)
+        event = {'httpMethod': 'GET', 'body': None,
+                 'queryStringParameters': {'query': 'query { auroraEntries(days: 1) { epochtime value } }'}}
+        response = lambda_handler(event, MagicMock())
+        self.assertEqual(response['statusCode'], 200)
+        etag = response['headers']['ETag']
+        max_age = int(response['headers']['Cache-Control'].split('max-age=')[1])
+        self.assertTrue(60 <= max_age <= 3600)
+        self.assertNotIn('extensions', json.loads(response['body']))
+
+        event['headers'] = {'if-none-match': etag}
+        not_modified = lambda_handler(event, MagicMock())
+        self.assertEqual(not_modified['statusCode'], 304)
+        self.assertEqual(not_modified['headers']['ETag'], etag)
+        self.assertEqual(not_modified['body'], '')
+
+    def test_tracing_extension_reports_spans_and_capacity(self):
+        body = json.dumps({'query': 'query { auroraEntries(days: 1) { epochtime } }', 'extensions': {'tracing': True}})
+        response = lambda_handler({'body': body}, MagicMock())
+        trace = json.loads(response['body'])['extensions']['tracing']
+        self.assertIn('execute', trace['spans'])
+        self.assertIn('dynamodbQuery', trace['spans'])
+        self.assertGreater(trace['capacity']['read'], 0)
+        untraced = lambda_handler({'body': json.dumps({'query': 'query { hello }'})}, MagicMock())
+        self.assertNotIn('tracing', json.loads(untraced['body'])['extensions'])
+
+    def test_columnar_response_when_accepted(self):
+        query = 'query { auroraEntries(days: 1) { epochtime statusId value } }'
+        response = lambda_handler({'body': json.dumps({'query': query}),
+                                   'headers': {'Accept': f'{columnar.CONTENT_TYPE}, application/json'}}, MagicMock())
+        self.assertEqual(response['headers']['Content-Type'], columnar.CONTENT_TYPE)
+        self.assertTrue(response['isBase64Encoded'])
+        entries = columnar.decode(base64.b64decode(response['body']))['auroraEntries']
+        self.assertEqual(sorted(entries['value']), [0, 6, 12, 18])
+        self.assertEqual(entries['epochtime'], sorted(entries['epochtime']))
+        self.assertEqual(set(entries['statusId']), {'green'})
+
+    def test_columnar_falls_back_to_json_for_nested_results(self):
+        query = 'query { auroraEntriesConnection(days: 1) { edges { cursor } } }'
+        response = lambda_handler({'body': json.dumps({'query': query}),
+                                   'headers': {'Accept': columnar.CONTENT_TYPE}}, MagicMock())
+        self.assertEqual(response['headers']['Content-Type'], 'application/json')
+        self.assertIn('auroraEntriesConnection', json.loads(response['body'])['data'])
+
+    def test_large_bodies_are_gzipped_when_accepted(self):
+        query = 'query { auroraEntries(days: 3) { epochtime statusId value } }'
+        event = {'body': base64.b64encode(json.dumps({'query': query}).encode()).decode(), 'isBase64Encoded': True,
+                 'headers': {'Accept-Encoding': 'gzip, deflate'}}
+        with patch.object(lambda_function, 'COMPRESS_MIN_BYTES', 100):
+            response = lambda_handler(event, MagicMock())
+        self.assertEqual(response['headers']['Content-Encoding'], 'gzip')
+        body = json.loads(gzip.decompress(base64.b64decode(response['body'])))
+        self.assertEqual(len(body['data']['auroraEntries']), 12)
+        self.assertIn('Accept-Encoding', response['headers']['Vary'])
+
+    def test_aurora_analytics_reports_trend_and_time_above_threshold(self):
+        query = '''query { auroraAnalytics(days: 3, threshold: 30, windowSeconds: 86400) {
+            secondsAboveThreshold latestRateOfChange latestRollingMean
+            points { epochtime count median p90 rateOfChange }
+        } }'''
+        lambda_function.analytics_cache = None
+        with patch('lambda_function.time.time', return_value=self.now):
+            first = self.execute(query)['auroraAnalytics']
+            second = self.execute(query)['auroraAnalytics']
+        # Values count the hours back from now, so they fall by one an hour
+        self.assertAlmostEqual(first['latestRateOfChange'], -1.0)
+        self.assertAlmostEqual(first['latestRollingMean'], 9.0)
+        self.assertEqual(first['secondsAboveThreshold'], 7 * 3600)
+        self.assertEqual(sum(point['count'] for point in first['points']), 12)
+        self.assertEqual(second, first)
+        self.assertEqual(lambda_function.analytics_cache.hits, 1)
+
+    def test_aurora_series_aggregates_buckets(self):
+        data = self.execute('query { auroraSeries(days: 3, bucketSeconds: 86400) { epochtime min max mean count statusId } }')
+        buckets = data['auroraSeries']
+        self.assertEqual(sum(bucket['count'] for bucket in buckets), 12)
+        self.assertTrue(all(bucket['epochtime'] % 86400 == 0 for bucket in buckets))
+        self.assertEqual(max(bucket['max'] for bucket in buckets), 66)
+        self.assertEqual({bucket['statusId'] for bucket in buckets}, {'green'})
+
+    def test_history_without_rollups_is_charted_once_rebuilt(self):
+        query = 'query { auroraSeries(days: 3, bucketSeconds: 86400) { count } }'
+        stored = rollups.read_rollups('hour', self.now - 4 * 86400, self.now)
+        stored += rollups.read_rollups('day', self.now - 4 * 86400, self.now)
+        aurora_store.batch_delete([{'bucket': rollup['bucket'], 'epochtime': rollup['epochtime']}
+                                   for rollup in stored], rollups.ROLLUPS_TABLE)
+        self.assertLess(sum(bucket['count'] for bucket in self.execute(query)['auroraSeries']), 12)
+        rollups.rebuild_rollups(self.now - 4 * 86400, self.now)
+        lambda_function.readings_cache.clear()
+        self.assertEqual(sum(bucket['count'] for bucket in self.execute(query)['auroraSeries']), 12)
+
+    def test_aurora_entries_connection_pages_in_time_order(self):
+        query = '''query($after: String) {
+            auroraEntriesConnection(days: 3, first: 5, after: $after) {
+                edges { cursor node { value } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }'''
+        values, after = [], None
+        while True:
+            response = lambda_handler({'body': json.dumps({'query': query, 'variables': {'after': after}})}, MagicMock())
+            connection = json.loads(response['body'])['data']['auroraEntriesConnection']
+            values.extend(edge['node']['value'] for edge in connection['edges'])
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            after = connection['pageInfo']['endCursor']
+        self.assertEqual(values, [str(hours) for hours in range(66, -1, -6)])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from graphql import parse
+
+from range_loader import RangeLoader, declared_windows
+
+NOW = 1_000_000
+DAY = 24 * 60 * 60
+
+
+class TestDeclaredWindows(unittest.TestCase):
+
+    def test_aliases_fragments_and_variables(self):
+        document = parse('''
+            query Dashboard($week: Int!) {
+                day: auroraEntries(days: 1) { epochtime }
+                ...Wider
+                hello
+            }
+            fragment Wider on Query {
+                week: auroraEntries(days: $week) { epochtime }
+                ... on Query { month: auroraEntries(days: 30) { value } }
+            }
+        ''')
+        self.assertEqual(sorted(declared_windows(document, {'week': 7}, NOW)),
+                         [(NOW - 30 * DAY, NOW), (NOW - 7 * DAY, NOW), (NOW - DAY, NOW)])
+
+    def test_unknown_variables_are_left_to_resolve_lazily(self):
+        document = parse('query ($days: Int!) { auroraEntries(days: $days) { epochtime } }')
+        self.assertEqual(declared_windows(document, {}, NOW), [])
+
+    def test_only_the_named_operation_is_scanned(self):
+        document = parse('query A { auroraEntries(days: 1) { epochtime } } '
+                         'query B { auroraEntries(days: 9) { epochtime } }')
+        self.assertEqual(declared_windows(document, {}, NOW, 'B'), [(NOW - 9 * DAY, NOW)])
+
+    def test_windows_are_declared_per_station(self):
+        document = parse('{ a: auroraEntries(days: 1) { value } b: auroraEntries(days: 2, station: "lerwick") { value } }')
+        self.assertEqual(declared_windows(document, {}, NOW), [(NOW - DAY, NOW)])
+        self.assertEqual(declared_windows(document, {}, NOW, station='lerwick'), [(NOW - 2 * DAY, NOW)])
+
+
+class TestRangeLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.items = [{'epochtime': epochtime} for epochtime in range(0, 100, 10)]
+
+    def fetch(self, start, end):
+        self.calls.append((start, end))
+        return [item for item in self.items if start <= item['epochtime'] <= end]
+
+    def test_declared_windows_share_one_fetch(self):
+        loader = RangeLoader(self.fetch, [(50, 90), (0, 90), (70, 90)])
+        self.assertEqual([item['epochtime'] for item in loader.load(70, 90)], [70, 80, 90])
+        self.assertEqual(len(loader.load(0, 90)), 10)
+        self.assertEqual([item['epochtime'] for item in loader.load(50, 90)], [50, 60, 70, 80, 90])
+        self.assertEqual(self.calls, [(0, 90)])
+
+    def test_undeclared_window_widens_once(self):
+        loader = RangeLoader(self.fetch, [(50, 90)])
+        loader.load(60, 90)
+        self.assertEqual(len(loader.load(20, 40)), 3)
+        self.assertEqual(len(loader.load(30, 80)), 6)
+        self.assertEqual(self.calls, [(50, 90), (20, 90)])
+
+
+if __name__ == '__main__':
+    unittest.main()
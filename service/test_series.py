@@ -0,0 +1,42 @@
+import unittest
+import numpy as np
+import series
+
+
+class TestSeries(unittest.TestCase):
+
+    def test_choose_bucket_seconds(self):
+        self.assertEqual(series.choose_bucket_seconds(86400, None, 500), 173)
+        self.assertEqual(series.choose_bucket_seconds(86400, 3600, 500), 3600)
+        self.assertEqual(series.choose_bucket_seconds(600, None, None), 1)
+
+    def test_aggregate(self):
+        items = [
+            {'epochtime': 3600 + 60, 'value': '5', 'status_id': 'amber'},
+            {'epochtime': 10, 'value': '1', 'status_id': 'green'},
+            {'epochtime': 20, 'value': '3', 'status_id': 'yellow'},
+            {'epochtime': 3600 + 120, 'value': '7', 'status_id': 'green'},
+            {'epochtime': 7200 * 3, 'value': '', 'status_id': 'red'},
+        ]
+        buckets = series.aggregate(*series.to_arrays(items), 3600)
+        np.testing.assert_array_equal(buckets['epochtime'], [0, 3600])
+        np.testing.assert_array_equal(buckets['min'], [1, 5])
+        np.testing.assert_array_equal(buckets['max'], [3, 7])
+        np.testing.assert_array_equal(buckets['mean'], [2, 6])
+        np.testing.assert_array_equal(buckets['count'], [2, 2])
+        self.assertEqual(list(buckets['status_id']), ['yellow', 'amber'])
+
+    def test_aggregate_unknown_status_ranks_below_green(self):
+        items = [{'epochtime': 0, 'value': '1', 'status_id': 'unknown'},
+                 {'epochtime': 1, 'value': '1', 'status_id': 'green'},
+                 {'epochtime': 100, 'value': '1', 'status_id': 'unknown'}]
+        buckets = series.aggregate(*series.to_arrays(items), 60)
+        self.assertEqual(list(buckets['status_id']), ['green', 'unknown'])
+
+    def test_aggregate_empty(self):
+        buckets = series.aggregate(*series.to_arrays([]), 60)
+        self.assertEqual(len(buckets['epochtime']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
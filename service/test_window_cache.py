@@ -0,0 +1,70 @@
+import unittest
+from window_cache import WindowCache
+
+
+class FakeClock:
+
+    def __init__(self, now=1000000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestWindowCache(unittest.TestCase):
+
+    def setUp(self):
+        self.readings = [{'epochtime': epochtime} for epochtime in range(0, 100000, 600)]
+        self.loads = []
+        self.version = (1, None)
+        self.clock = FakeClock()
+        self.cache = WindowCache(self.load, lambda: self.version, max_entries=2, clock=self.clock)
+
+    def load(self, start, end):
+        self.loads.append((start, end))
+        return [item for item in self.readings if start <= item['epochtime'] <= end]
+
+    def epochs(self, items):
+        return [item['epochtime'] for item in items]
+
+    def test_contained_window_is_a_hit(self):
+        self.cache.get(0, 50000)
+        items = self.cache.get(1000, 2400)
+        self.assertEqual(self.epochs(items), [1200, 1800, 2400])
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'partialHits': 0})
+        self.assertEqual(len(self.loads), 1)
+
+    def test_overlapping_window_reads_only_the_gap(self):
+        self.cache.get(0, 6000)
+        items = self.cache.get(3000, 9000)
+        self.assertEqual(self.epochs(items), list(range(3000, 9001, 600)))
+        self.assertEqual(self.loads[-1], (6001, 9000))
+        self.assertEqual(self.cache.stats()['partialHits'], 1)
+        self.assertEqual(self.epochs(self.cache.get(0, 9000)), list(range(0, 9001, 600)))
+        self.assertEqual(len(self.loads), 2)
+
+    def test_version_change_clears(self):
+        self.cache.get(0, 6000)
+        self.version = (2, None)
+        self.cache.get(0, 6000)
+        self.assertEqual(len(self.loads), 1)  # Version is only rechecked after check_seconds
+        self.clock.now += 61
+        self.cache.get(0, 6000)
+        self.assertEqual(len(self.loads), 2)
+
+    def test_windows_past_last_ingestion_share_an_entry(self):
+        self.version = (1, 50000)
+        self.cache.get(0, self.clock.now)
+        self.cache.get(0, self.clock.now + 3600)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_least_recently_used_entry_evicted(self):
+        self.cache.get(0, 1000)
+        self.cache.get(10000, 11000)
+        self.cache.get(0, 1000)
+        self.cache.get(20000, 21000)
+        self.assertEqual(list(self.cache.entries), [(0, 1020), (19980, 21000)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# window_cache.py
+# In-process cache of time-ordered readings, kept across warm invocations of the service Lambda.
+# Readings only change when the ingest Lambda runs, so entries stay valid until the ingest
+# meta item's changed_at moves.
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+WINDOW_ALIGN_SECONDS = 60
+FUTURE_SLACK_SECONDS = 60 * 60  # Readings stamped after the last ingestion, allowing for skew
+
+
+class WindowCache:
+
+    def __init__(self, loader, version_loader, max_entries=8, max_items=250000,
+                 check_seconds=60, max_age_seconds=6 * 60 * 60, clock=time.time):
+        self.loader = loader  # (start, end) -> time-ordered items
+        self.version_loader = version_loader  # () -> (changed_at, ingested_at)
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self.check_seconds = check_seconds
+        self.max_age_seconds = max_age_seconds
+        self.clock = clock
+        self.entries = OrderedDict()  # (start, end) -> (epochs, items), least recently used first
+        self.version = None
+        self.horizon = None
+        self.checked_at = None
+        self.loaded_at = None
+        self.hits = 0
+        self.misses = 0
+        self.partial_hits = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'partialHits': self.partial_hits}
+
+    def clear(self):
+        self.entries.clear()
+        self.loaded_at = None
+
+    def refresh(self):
+        """Drop everything once the data has changed; checks the version at most every check_seconds."""
+        now = self.clock()
+        if self.loaded_at is not None and now - self.loaded_at > self.max_age_seconds:
+            self.clear()
+        if self.checked_at is not None and now - self.checked_at < self.check_seconds:
+            return
+        self.checked_at = now
+        version, ingested_at = self.version_loader()
+        if version != self.version:
+            self.clear()
+            self.version = version
+        self.horizon = None if ingested_at is None else int(ingested_at) + FUTURE_SLACK_SECONDS
+
+    def normalise(self, start, end):
+        start = int(start) // WINDOW_ALIGN_SECONDS * WINDOW_ALIGN_SECONDS
+        end = -(-int(end) // WINDOW_ALIGN_SECONDS) * WINDOW_ALIGN_SECONDS
+        if self.horizon is not None:
+            # Nothing newer than the horizon exists, so windows ending after it share one entry
+            end = max(start, min(end, self.horizon))
+        return start, end
+
+    def get(self, start, end):
+        """Readings with start <= epochtime <= end, in time order."""
+        self.refresh()
+        key_start, key_end = self.normalise(start, end)
+
+        for (cached_start, cached_end), (epochs, items) in self.entries.items():
+            if cached_start <= key_start and key_end <= cached_end:
+                self.hits += 1
+                self.entries.move_to_end((cached_start, cached_end))
+                return items[bisect_left(epochs, start):bisect_right(epochs, end)]
+
+        key, epochs, items = self.extend(key_start, key_end)
+        if self.loaded_at is None:
+            self.loaded_at = self.clock()
+        if len(items) <= self.max_items:
+            self.entries[key] = (epochs, items)
+            self.evict()
+        return items[bisect_left(epochs, start):bisect_right(epochs, end)]
+
+    def extend(self, start, end):
+        """Load a window, reusing the overlapping cached entry and reading only the gaps."""
+        overlapping = next((key for key in self.entries if key[0] <= end and start <= key[1]), None)
+        if overlapping is not None:
+            self.partial_hits += 1
+            cached_start, cached_end = overlapping
+            _, items = self.entries.pop(overlapping)
+            before = list(self.loader(start, cached_start - 1)) if start < cached_start else []
+            after = list(self.loader(cached_end + 1, end)) if end > cached_end else []
+            merged = before + items + after
+            key = (min(start, cached_start), max(end, cached_end))
+            return key, [int(item['epochtime']) for item in merged], merged
+        self.misses += 1
+        items = list(self.loader(start, end))
+        return (start, end), [int(item['epochtime']) for item in items], items
+
+    def evict(self):
+        while len(self.entries) > self.max_entries or \
+                sum(len(items) for _, items in self.entries.values()) > self.max_items:
+            self.entries.popitem(last=False)
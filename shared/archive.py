@@ -0,0 +1,311 @@
+# archive.py
+# The cold tier of the readings. Raw readings carry a TTL ('expires_at') so DynamoDB deletes them
+# once they pass the retention horizon; before that, every closed month of a station's readings
+# is compacted into one blob in an object store. Readers go through iter_range, which serves
+# archived months from their blobs and everything else from the table, so a long window costs a
+# GET per month instead of a Query per day, whether or not the raw rows still exist.
+#
+# Blob layout, after b'AUA1' the rest is zlib-compressed, little-endian:
+#   uint32 header length, header JSON {station, month, rows, exponent, statuses, texts}
+#   int64[rows] epochtime deltas (the first from zero)
+#   int64[rows] value deltas, values scaled by 10 ** exponent to integers
+#   uint8[rows] decimal places of each value as written, so '15.5' does not come back as '15.50'
+#   uint8[rows] indices into statuses
+# Values that are not finite numbers are kept verbatim in texts, by row index.
+#
+#   python shared/archive.py 2015-01 [2023-12] [--station awn] [--prune]
+import json
+import os
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from itertools import accumulate
+import aurora_store
+import tracing
+
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET')  # S3 bucket for the blobs
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR')  # Local directory instead, for tests and local runs
+ARCHIVE_PREFIX = 'readings'
+MAGIC = b'AUA1'
+
+# Raw readings expire this long after they are written; 0 keeps them forever
+RETENTION_DAYS = int(os.environ.get('RAW_RETENTION_DAYS', '0'))
+MIN_RETENTION_DAYS = 45  # A month plus the grace period, so no month expires before it is archived
+LOOKBACK_DAYS = 366  # Months the ingester archives when raw readings are kept forever
+GRACE_SECONDS = 3 * 24 * 60 * 60  # The feed may still revise a month's last readings
+MONTHS_PER_RUN = 2
+
+_store = None
+
+
+class LocalStore:
+    """Blobs as files under a directory; the stand-in for S3."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.root, key), 'rb') as source:
+                return source.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as output:
+            output.write(data)
+        os.replace(path + '.tmp', path)
+
+
+class S3Store:
+
+    def __init__(self, bucket, client=None):
+        self.bucket = bucket
+        self.client = client
+
+    def s3(self):
+        if self.client is None:
+            import boto3
+            self.client = boto3.client('s3')
+        return self.client
+
+    def get(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.s3().get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def put(self, key, data):
+        self.s3().put_object(Bucket=self.bucket, Key=key, Body=data, ContentType='application/octet-stream')
+
+
+def get_store():
+    """The configured store, or None when archiving is off."""
+    global _store
+    if _store is None:
+        if ARCHIVE_DIR:
+            _store = LocalStore(ARCHIVE_DIR)
+        elif ARCHIVE_BUCKET:
+            _store = S3Store(ARCHIVE_BUCKET)
+    return _store
+
+
+def month_start(epochtime):
+    moment = datetime.fromtimestamp(int(epochtime), timezone.utc)
+    return int(datetime(moment.year, moment.month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def next_month(start):
+    moment = datetime.fromtimestamp(start, timezone.utc)
+    year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def month_label(start):
+    return datetime.fromtimestamp(start, timezone.utc).strftime('%Y-%m')
+
+
+def parse_month(label):
+    return int(datetime.strptime(label, '%Y-%m').replace(tzinfo=timezone.utc).timestamp())
+
+
+def blob_key(station, start):
+    return f"{ARCHIVE_PREFIX}/{station}/{month_label(start)}.aua"
+
+
+def with_expiry(item, now=None):
+    """The item with its TTL attribute, when raw readings are set to expire."""
+    if not RETENTION_DAYS:
+        return item
+    now = int(time.time()) if now is None else now
+    return dict(item, expires_at=now + max(RETENTION_DAYS, MIN_RETENTION_DAYS) * 24 * 60 * 60)
+
+
+def little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_little_endian(typecode, data):
+    values = array(typecode, data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def decimal_places(value):
+    exponent = value.as_tuple().exponent
+    return -exponent if isinstance(exponent, int) and exponent < 0 else 0
+
+
+def encode(items, station, start):
+    """A month of time-ordered readings as a compressed blob."""
+    numbers, texts = [], {}
+    for index, item in enumerate(items):
+        try:
+            number = Decimal(str(item.get('value', '')))
+        except InvalidOperation:
+            number = None
+        if number is None or not number.is_finite():
+            number = Decimal(0)
+            texts[str(index)] = item.get('value', '')
+        numbers.append(number)
+    places = [decimal_places(number) for number in numbers]
+    exponent = max(places, default=0)
+    scaled = [int(number.scaleb(exponent)) for number in numbers]
+    statuses = sorted({item.get('status_id', '') for item in items})
+    header = json.dumps({
+        'station': station, 'month': month_label(start), 'rows': len(items), 'exponent': exponent,
+        'statuses': statuses, 'texts': texts
+    }, separators=(',', ':')).encode()
+    epochs = [int(item['epochtime']) for item in items]
+    payload = b''.join([
+        len(header).to_bytes(4, 'little'), header,
+        little_endian(array('q', [b - a for a, b in zip([0] + epochs, epochs)])),
+        little_endian(array('q', [b - a for a, b in zip([0] + scaled, scaled)])),
+        bytes(places),
+        bytes(statuses.index(item.get('status_id', '')) for item in items)
+    ])
+    return MAGIC + zlib.compress(payload, 9)
+
+
+def decode(data):
+    """The readings in a blob, shaped like the table's items."""
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not an archive blob")
+    payload = zlib.decompress(data[len(MAGIC):])
+    length = int.from_bytes(payload[:4], 'little')
+    header = json.loads(payload[4:4 + length])
+    rows, offset = header['rows'], 4 + length
+    epochs = accumulate(from_little_endian('q', payload[offset:offset + 8 * rows]))
+    offset += 8 * rows
+    scaled = accumulate(from_little_endian('q', payload[offset:offset + 8 * rows]))
+    offset += 8 * rows
+    places = payload[offset:offset + rows]
+    statuses = payload[offset + rows:offset + 2 * rows]
+    station, exponent, texts = header['station'], header['exponent'], header['texts']
+    items = []
+    for index, (epochtime, number, place, status) in enumerate(zip(epochs, scaled, places, statuses)):
+        items.append({
+            'epochtime': epochtime,
+            'iso_string': datetime.fromtimestamp(epochtime, timezone.utc).isoformat(),
+            'status_id': header['statuses'][status],
+            'value': texts[str(index)] if str(index) in texts else Decimal(number // 10 ** (exponent - place)).scaleb(-place),
+            'station': station,
+            'bucket': aurora_store.bucket_for(epochtime, station)
+        })
+    return items
+
+
+def archived_months(station=aurora_store.DEFAULT_STATION):
+    """Rows per archived month ('YYYY-MM'), from the station's archive meta item."""
+    item = aurora_store.get_meta(aurora_store.station_meta('archive', station))
+    return {label: int(rows) for label, rows in item.get('months', {}).items()}
+
+
+def compact_month(start, station=aurora_store.DEFAULT_STATION, store=None):
+    """Write one month of a station's readings to the archive and record it; returns the row count.
+
+    Rows already in the month's blob are kept, so re-archiving a month whose raw readings have
+    expired or been pruned does not lose them; where both have a row, the table's wins."""
+    store = store or get_store()
+    items = {item['epochtime']: item for item in read_month(start, station, store) or []}
+    items.update((int(item['epochtime']), item) for item in
+                 aurora_store.query_range(start, next_month(start) - 1, consistent_read=True, station=station))
+    items = [items[epochtime] for epochtime in sorted(items)]
+    store.put(blob_key(station, start), encode(items, station, start))
+    months = archived_months(station)
+    months[month_label(start)] = len(items)
+    aurora_store.update_meta(aurora_store.station_meta('archive', station), months=months)
+    return len(items)
+
+
+def due_months(station=aurora_store.DEFAULT_STATION, now=None):
+    """Closed months still within reach of the raw readings that are not archived yet, oldest first."""
+    now = int(time.time()) if now is None else now
+    archived = archived_months(station)
+    days = max(RETENTION_DAYS, MIN_RETENTION_DAYS) if RETENTION_DAYS else LOOKBACK_DAYS
+    month = month_start(now - days * 24 * 60 * 60)
+    due = []
+    while next_month(month) <= now - GRACE_SECONDS:
+        if month_label(month) not in archived:
+            due.append(month)
+        month = next_month(month)
+    return due
+
+
+def compact_due(station=aurora_store.DEFAULT_STATION, now=None, limit=MONTHS_PER_RUN):
+    """Archive up to `limit` due months; returns the labels archived. A no-op without a store."""
+    if get_store() is None:
+        return []
+    months = due_months(station, now)[:limit]
+    for start in months:
+        compact_month(start, station)
+    return [month_label(start) for start in months]
+
+
+def read_month(start, station=aurora_store.DEFAULT_STATION, store=None):
+    """An archived month's readings, or None if its blob is missing."""
+    with tracing.span('archive'):
+        data = (store or get_store()).get(blob_key(station, start))
+    return None if data is None else decode(data)
+
+
+def iter_range(start, end=None, station=aurora_store.DEFAULT_STATION):
+    """aurora_store.iter_range for one station, reading archived months from their blobs."""
+    if end is None:
+        end = int(time.time())
+    store = get_store()
+    archived = archived_months(station) if store else {}
+    if not archived:
+        yield from aurora_store.iter_range(start, end, station=station)
+        return
+    pending = start  # Start of the stretch still to read from the table
+    month = month_start(start)
+    while month <= end:
+        following = next_month(month)
+        items = read_month(month, station, store) if month_label(month) in archived else None
+        if items is not None:
+            if pending < month:
+                yield from aurora_store.iter_range(pending, month - 1, station=station)
+            yield from (item for item in items if start <= item['epochtime'] <= end)
+            pending = following
+        month = following
+    if pending <= end:
+        yield from aurora_store.iter_range(pending, end, station=station)
+
+
+def prune_month(start, station=aurora_store.DEFAULT_STATION):
+    """Delete an archived month's raw readings, e.g. those written before they carried a TTL."""
+    items = aurora_store.query_range(start, next_month(start) - 1, station=station)
+    aurora_store.batch_delete([{'bucket': item['bucket'], 'epochtime': item['epochtime']} for item in items])
+    return len(items)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Archive closed months of readings, e.g. history from before the TTL')
+    parser.add_argument('first', type=parse_month, help='first month, YYYY-MM')
+    parser.add_argument('last', type=parse_month, nargs='?', help='last month, YYYY-MM (default: the last closed one)')
+    parser.add_argument('--station', default=aurora_store.DEFAULT_STATION)
+    parser.add_argument('--prune', action='store_true', help='delete the raw readings of months past the retention horizon')
+    args = parser.parse_args()
+    if get_store() is None:
+        sys.exit("Set ARCHIVE_BUCKET or ARCHIVE_DIR")
+    last = args.last if args.last is not None else month_start(month_start(time.time()) - 1)
+    horizon = time.time() - max(RETENTION_DAYS, MIN_RETENTION_DAYS) * 24 * 60 * 60
+    month = args.first
+    while month <= last:
+        print(f"{month_label(month)}: archived {compact_month(month, args.station)} readings")
+        if args.prune and RETENTION_DAYS and next_month(month) <= horizon:
+            print(f"{month_label(month)}: pruned {prune_month(month, args.station)} readings")
+        month = next_month(month)
@@ -0,0 +1,418 @@
+# aurora_store.py
+# Data access for the aurora readings table, shared by the ingest and service Lambdas.
+# Readings are partitioned by station and UTC day ('bucket', e.g. 'awn#2023-10-01') with
+# 'epochtime' as the sort key, so one station's time window becomes one key-range Query per
+# day instead of a full-table Scan, and stations never collide on epochtime. The newest reading
+# of every station is also kept on a meta item, with the feed's thresholds and updated time so
+# the current status is one GetItem, and indexed so all stations come back in one Query.
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import tracing
+
+READINGS_TABLE = os.environ.get('READINGS_TABLE', 'aurora-warn-uk-readings')
+META_TABLE = os.environ.get('META_TABLE', 'aurora-warn-uk-meta')  # Small named state items
+LEGACY_TABLE = 'aurora-warn-uk'  # Original table keyed on epochtime only
+META_KIND_INDEX = 'kind-index'  # Meta items by kind, then station
+
+DEFAULT_STATION = 'awn'  # The AuroraWatch UK network, the only feed before stations existed
+
+BUCKET_SECONDS = 24 * 60 * 60
+QUERY_WORKERS = 8  # Day buckets fetched ahead of the reader
+SCAN_SEGMENTS = 4
+
+# DynamoDB batch limits and retry policy for unprocessed items
+BATCH_GET_SIZE = 100
+BATCH_WRITE_SIZE = 25
+MAX_BATCH_ATTEMPTS = 6
+BATCH_BACKOFF_SECONDS = 0.05
+
+_dynamodb = None
+
+
+def resource():
+    """The DynamoDB resource, created on first use so importing this module stays cheap at cold start."""
+    global _dynamodb
+    if _dynamodb is None:
+        import boto3
+        _dynamodb = boto3.resource('dynamodb')
+        tracing.instrument(_dynamodb.meta.client)
+    return _dynamodb
+
+
+def bucket_for(epochtime, station=DEFAULT_STATION):
+    day = datetime.fromtimestamp(int(epochtime), timezone.utc).strftime('%Y-%m-%d')
+    return f"{station}#{day}"
+
+
+def buckets_for_range(start, end, station=DEFAULT_STATION):
+    first = int(start) // BUCKET_SECONDS
+    last = int(end) // BUCKET_SECONDS
+    return [bucket_for(day * BUCKET_SECONDS, station) for day in range(first, last + 1)]
+
+
+def key_for(epochtime, station=DEFAULT_STATION):
+    return {'bucket': bucket_for(epochtime, station), 'epochtime': int(epochtime)}
+
+
+def with_bucket(item, station=None):
+    """The item keyed for its station: the given one, the item's own, or the default."""
+    station = station or item.get('station') or DEFAULT_STATION
+    return dict(item, station=station, bucket=bucket_for(item['epochtime'], station))
+
+
+def iter_bucket(bucket, start, end, table_name=READINGS_TABLE, consistent_read=False):
+    """Yield one day bucket between start and end (inclusive), fetching a page at a time."""
+    from boto3.dynamodb.conditions import Key
+    client = resource().meta.client  # Clients are thread safe, resources are not
+    kwargs = {
+        'TableName': table_name,
+        'KeyConditionExpression': Key('bucket').eq(bucket) & Key('epochtime').between(int(start), int(end)),
+        'ConsistentRead': consistent_read,
+    }
+    while True:
+        response = client.query(**kwargs)
+        yield from response['Items']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def query_bucket(bucket, start, end, table_name=READINGS_TABLE, consistent_read=False):
+    return list(iter_bucket(bucket, start, end, table_name, consistent_read))
+
+
+def iter_range(start, end=None, table_name=READINGS_TABLE, workers=QUERY_WORKERS, buckets=None,
+               consistent_read=False, station=DEFAULT_STATION):
+    """Yield one station's readings with start <= epochtime <= end in time order.
+
+    Up to `workers` day buckets are queried ahead on a thread pool, so memory stays bounded
+    by a few days of readings however long the window is. Closing the generator early
+    cancels the buckets not yet started. Tables partitioned differently pass their own
+    time-ordered `buckets`.
+    """
+    if end is None:
+        end = int(time.time())
+    if buckets is None:
+        buckets = buckets_for_range(start, end, station)
+    buckets = iter(buckets)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for bucket in buckets:
+            pending.append(pool.submit(query_bucket, bucket, start, end, table_name, consistent_read))
+            if len(pending) >= workers:
+                break
+        while pending:
+            items = pending.popleft().result()
+            bucket = next(buckets, None)
+            if bucket is not None:
+                pending.append(pool.submit(query_bucket, bucket, start, end, table_name, consistent_read))
+            yield from items
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def query_range(start, end=None, table_name=READINGS_TABLE, consistent_read=False, station=DEFAULT_STATION):
+    """Read a station's readings with start <= epochtime <= end as parallel per-day Queries, in time order."""
+    return list(iter_range(start, end, table_name, consistent_read=consistent_read, station=station))
+
+
+def iter_scan(table_name=READINGS_TABLE, total_segments=SCAN_SEGMENTS):
+    """Yield every item in a table, scanning `total_segments` segments in parallel, in no particular order."""
+    client = resource().meta.client
+    pages = queue.Queue(maxsize=total_segments * 2)
+    stop = threading.Event()
+    done = object()
+
+    def put(page):
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan_segment(segment):
+        kwargs = {'TableName': table_name, 'Segment': segment, 'TotalSegments': total_segments}
+        try:
+            while not stop.is_set():
+                response = client.scan(**kwargs)
+                put(response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    return
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as pool:
+        futures = [pool.submit(scan_segment, segment) for segment in range(total_segments)]
+        try:
+            remaining = total_segments
+            while remaining:
+                page = pages.get()
+                if page is done:
+                    remaining -= 1
+                else:
+                    yield from page
+        finally:
+            stop.set()  # Let the segments finish if the reader stops early
+        for future in futures:
+            future.result()  # Surface scan errors
+
+
+def query_last(hours=0, days=0, now=None, table_name=READINGS_TABLE, station=DEFAULT_STATION):
+    if now is None:
+        now = int(time.time())
+    return query_range(now - int((days * 24 + hours) * 60 * 60), now, table_name, station=station)
+
+
+def backoff(attempt):
+    if attempt >= MAX_BATCH_ATTEMPTS:
+        raise RuntimeError(f"DynamoDB batch request still unprocessed after {attempt} attempts")
+    time.sleep(BATCH_BACKOFF_SECONDS * (2 ** attempt))
+
+
+def batch_get(keys, table_name=READINGS_TABLE):
+    """Fetch the items for the given keys in groups of BATCH_GET_SIZE, retrying unprocessed keys."""
+    found = []
+    for start in range(0, len(keys), BATCH_GET_SIZE):
+        request = {table_name: {'Keys': keys[start:start + BATCH_GET_SIZE]}}
+        attempt = 0
+        while request:
+            response = resource().batch_get_item(RequestItems=request)
+            found.extend(response['Responses'].get(table_name, []))
+            request = response.get('UnprocessedKeys')
+            if request:
+                attempt += 1
+                backoff(attempt)
+    return found
+
+
+def batch_write(items, table_name=READINGS_TABLE):
+    """Write items in groups of BATCH_WRITE_SIZE, retrying unprocessed ones. Returns the retry count."""
+    retried = 0
+    for start in range(0, len(items), BATCH_WRITE_SIZE):
+        requests = [{'PutRequest': {'Item': item}} for item in items[start:start + BATCH_WRITE_SIZE]]
+        attempt = 0
+        while requests:
+            response = resource().batch_write_item(RequestItems={table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(table_name, [])
+            if requests:
+                retried += len(requests)
+                attempt += 1
+                backoff(attempt)
+    return retried
+
+
+def get_meta(name, consistent_read=False):
+    response = resource().Table(META_TABLE).get_item(Key={'name': name}, ConsistentRead=consistent_read)
+    return response.get('Item', {})
+
+
+def update_meta(name, **attributes):
+    """Set the given attributes on a meta item, leaving any others untouched."""
+    names = {f'#a{i}': attribute for i, attribute in enumerate(attributes)}
+    values = {f':v{i}': value for i, value in enumerate(attributes.values())}
+    resource().Table(META_TABLE).update_item(
+        Key={'name': name},
+        UpdateExpression='SET ' + ', '.join(f'#a{i} = :v{i}' for i in range(len(attributes))),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
+
+
+def increment_meta(name, counter, **attributes):
+    """Atomically add one to a counter on a meta item, setting the given attributes; returns the new item."""
+    names = {'#c': counter, **{f'#a{i}': attribute for i, attribute in enumerate(attributes)}}
+    values = {':one': 1, **{f':v{i}': value for i, value in enumerate(attributes.values())}}
+    expression = 'ADD #c :one'
+    if attributes:
+        expression += ' SET ' + ', '.join(f'#a{i} = :v{i}' for i in range(len(attributes)))
+    response = resource().Table(META_TABLE).update_item(
+        Key={'name': name},
+        UpdateExpression=expression,
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW'
+    )
+    return response['Attributes']
+
+
+def batch_delete(keys, table_name=READINGS_TABLE):
+    """Delete items by key in groups of BATCH_WRITE_SIZE, retrying unprocessed ones."""
+    for start in range(0, len(keys), BATCH_WRITE_SIZE):
+        requests = [{'DeleteRequest': {'Key': key}} for key in keys[start:start + BATCH_WRITE_SIZE]]
+        attempt = 0
+        while requests:
+            response = resource().batch_write_item(RequestItems={table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(table_name, [])
+            if requests:
+                attempt += 1
+                backoff(attempt)
+
+
+def station_meta(name, station=DEFAULT_STATION):
+    """Meta item name for per-station state; the default station keeps the names it had before stations."""
+    return name if station == DEFAULT_STATION else f"{name}#{station}"
+
+
+def latest_meta(station=DEFAULT_STATION):
+    return f"latest#{station}"
+
+
+def update_latest(station, reading, **attributes):
+    """Keep the station's newest reading on its 'latest' meta item; older readings leave it alone.
+
+    `attributes` that belong with the reading (the feed's thresholds, its updated time) are set in
+    the same write, so readers never see a reading paired with another run's thresholds.
+    Returns whether the item was updated.
+    """
+    from botocore.exceptions import ClientError
+    fields = {'kind': 'latest', 'station': station, 'epochtime': int(reading['epochtime']),
+              'status_id': reading.get('status_id', ''), 'value': reading.get('value', ''), **attributes}
+    try:
+        resource().Table(META_TABLE).update_item(
+            Key={'name': latest_meta(station)},
+            UpdateExpression='SET ' + ', '.join(f'#a{i} = :v{i}' for i in range(len(fields))),
+            ConditionExpression='attribute_not_exists(epochtime) OR epochtime <= :v2',
+            ExpressionAttributeNames={f'#a{i}': name for i, name in enumerate(fields)},  # 'value' is reserved
+            ExpressionAttributeValues={f':v{i}': value for i, value in enumerate(fields.values())}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+
+def latest_readings():
+    """The newest reading of every station, from one Query on the meta table's kind index."""
+    from boto3.dynamodb.conditions import Key
+    table = resource().Table(META_TABLE)
+    kwargs = {'IndexName': META_KIND_INDEX, 'KeyConditionExpression': Key('kind').eq('latest')}
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def migrate_to_stations(table_name=READINGS_TABLE, station=DEFAULT_STATION):
+    """One-off move of items keyed before stations existed under the station's partitions. Safe to re-run.
+
+    Works for the readings and rollups tables alike: the old partition key gains the station prefix.
+    """
+    moved = []
+    for item in iter_scan(table_name):
+        if 'station' in item:
+            continue
+        moved.append(item)
+        if len(moved) == BATCH_WRITE_SIZE * 4:
+            move_to_station(moved, table_name, station)
+            moved = []
+    move_to_station(moved, table_name, station)
+
+
+def move_to_station(items, table_name, station):
+    """Copy items under the station's partitions, then delete the originals.
+
+    Each copy is a conditional put: an item the ingester has already written under the station
+    is newer than the unprefixed one and is kept.
+    """
+    from botocore.exceptions import ClientError
+    client = resource().meta.client
+
+    def put(item):
+        try:
+            client.put_item(TableName=table_name, Item=dict(item, station=station, bucket=f"{station}#{item['bucket']}"),
+                            ConditionExpression='attribute_not_exists(#bucket)',
+                            ExpressionAttributeNames={'#bucket': 'bucket'})  # 'bucket' is reserved
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    with ThreadPoolExecutor(max_workers=QUERY_WORKERS) as pool:
+        list(pool.map(put, items))
+    batch_delete([{'bucket': item['bucket'], 'epochtime': item['epochtime']} for item in items], table_name)
+
+
+def epoch_span(table_name=READINGS_TABLE):
+    """The first and last epochtime in a table, or None if it is empty. A full Scan, for one-off jobs."""
+    epochtimes = [int(item['epochtime']) for item in iter_scan(table_name)]
+    return (min(epochtimes), max(epochtimes)) if epochtimes else None
+
+
+def migrate_legacy_table(source=LEGACY_TABLE, target=READINGS_TABLE):
+    """One-off copy of the epochtime-keyed table into the bucketed layout. Safe to re-run."""
+    copied = 0
+    batch = []
+    for item in iter_scan(source):
+        batch.append(with_bucket(item))
+        if len(batch) == BATCH_WRITE_SIZE:
+            batch_write(batch, target)
+            copied += len(batch)
+            batch = []
+    batch_write(batch, target)
+    return copied + len(batch)
+
+
+def create_readings_table(table_name=READINGS_TABLE):
+    """Create the readings table on a local stand-in (moto, DynamoDB Local); terraform owns the real one."""
+    return resource().create_table(
+        TableName=table_name,
+        KeySchema=[
+            {'AttributeName': 'bucket', 'KeyType': 'HASH'},
+            {'AttributeName': 'epochtime', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'bucket', 'AttributeType': 'S'},
+            {'AttributeName': 'epochtime', 'AttributeType': 'N'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def create_meta_table():
+    """Create the meta table on a local stand-in; terraform owns the real one."""
+    return resource().create_table(
+        TableName=META_TABLE,
+        KeySchema=[{'AttributeName': 'name', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'name', 'AttributeType': 'S'},
+            {'AttributeName': 'kind', 'AttributeType': 'S'},
+            {'AttributeName': 'station', 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexes=[{
+            'IndexName': META_KIND_INDEX,
+            'KeySchema': [
+                {'AttributeName': 'kind', 'KeyType': 'HASH'},
+                {'AttributeName': 'station', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'ALL'}
+        }],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+if __name__ == "__main__":
+    import sys
+    import rollups
+    if sys.argv[1:] == ['stations']:
+        # Readings and rollups written before stations existed belong to the AWN feed
+        for table in (READINGS_TABLE, rollups.ROLLUPS_TABLE):
+            migrate_to_stations(table)
+            print(f"Moved {table} under station {DEFAULT_STATION}")
+    else:
+        print(f"Migrated {migrate_legacy_table()} items from {LEGACY_TABLE} to {READINGS_TABLE}")
+    # Charts read complete periods from the rollups only, so history needs them too
+    span = epoch_span(READINGS_TABLE if sys.argv[1:] == ['stations'] else LEGACY_TABLE)
+    if span:
+        counts = rollups.rebuild_rollups(*span)
+        print(f"Rebuilt {counts['hour']} hourly and {counts['day']} daily rollups for {DEFAULT_STATION}")
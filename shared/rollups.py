@@ -0,0 +1,173 @@
+# rollups.py
+# Hourly and daily summaries of the readings, kept up to date by the ingest Lambda so wide
+# chart windows read a few pre-aggregated rows instead of every reading. Like the readings,
+# rollups are partitioned per station. History written without them (migrations, a lost table)
+# is filled in with:
+#
+#   python shared/rollups.py rebuild 2015-01-01 2023-12-31 [--station awn]
+import os
+from datetime import datetime, timezone
+from decimal import Decimal
+import archive
+import aurora_store
+
+ROLLUPS_TABLE = os.environ.get('ROLLUPS_TABLE', 'aurora-warn-uk-rollups')
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+RESOLUTIONS = {'hour': HOUR, 'day': DAY}
+# Hourly rollups are partitioned by month and daily ones by year, so a year is a handful of Queries
+PARTITION_FORMATS = {'hour': '%Y-%m', 'day': '%Y'}
+READING_SECONDS = HOUR  # The AuroraWatch feed reports one activity value per hour
+REBUILD_SECONDS = 31 * DAY  # Readings are read back about a month at a time when rebuilding
+
+
+def period_start(epochtime, resolution):
+    period = RESOLUTIONS[resolution]
+    return int(epochtime) // period * period
+
+
+def partition_for(resolution, epochtime, station=aurora_store.DEFAULT_STATION):
+    period = datetime.fromtimestamp(int(epochtime), timezone.utc).strftime(PARTITION_FORMATS[resolution])
+    return f"{station}#{resolution}#{period}"
+
+
+def partitions_for_range(resolution, start, end, station=aurora_store.DEFAULT_STATION):
+    partitions = []
+    for day in range(int(start) // DAY, int(end) // DAY + 1):
+        partition = partition_for(resolution, day * DAY, station)
+        if not partitions or partitions[-1] != partition:
+            partitions.append(partition)
+    return partitions
+
+
+def resolution_for(bucket_seconds):
+    """The coarsest rollup that fits inside a chart bucket, or None if raw readings are needed."""
+    for resolution in ('day', 'hour'):
+        if bucket_seconds >= RESOLUTIONS[resolution]:
+            return resolution
+    return None
+
+
+def new_rollup(resolution, start, value, station):
+    return {
+        'bucket': partition_for(resolution, start, station),
+        'station': station,
+        'epochtime': start,
+        'resolution': resolution,
+        'count': 0,
+        'min': value,
+        'max': value,
+        'sum': Decimal(0),
+        'status_seconds': {}
+    }
+
+
+def summarise(readings, resolution):
+    """Roll time-ordered readings up into one item per period.
+
+    Each reading counts as lasting until the next one, capped at READING_SECONDS and at the
+    end of its period, when totalling the time spent in each status.
+    """
+    period = RESOLUTIONS[resolution]
+    readings = [reading for reading in readings if reading.get('value') not in (None, '')]
+    rollups = {}
+    for i, reading in enumerate(readings):
+        epochtime = int(reading['epochtime'])
+        start = epochtime // period * period
+        value = Decimal(str(reading['value']))
+        next_epochtime = int(readings[i + 1]['epochtime']) if i + 1 < len(readings) else epochtime + READING_SECONDS
+        seconds = min(next_epochtime - epochtime, READING_SECONDS, start + period - epochtime)
+
+        station = reading.get('station', aurora_store.DEFAULT_STATION)
+        rollup = rollups.setdefault(start, new_rollup(resolution, start, value, station))
+        rollup['count'] += 1
+        rollup['min'] = min(rollup['min'], value)
+        rollup['max'] = max(rollup['max'], value)
+        rollup['sum'] += value
+        status_seconds = rollup['status_seconds']
+        status_id = reading.get('status_id', '')
+        status_seconds[status_id] = status_seconds.get(status_id, 0) + seconds
+    return [rollups[start] for start in sorted(rollups)]
+
+
+def combine(rollups, resolution):
+    """Merge finer rollups (e.g. hourly) into rollups of a coarser resolution."""
+    combined = {}
+    for rollup in sorted(rollups, key=lambda rollup: int(rollup['epochtime'])):
+        start = period_start(rollup['epochtime'], resolution)
+        station = rollup.get('station', aurora_store.DEFAULT_STATION)
+        target = combined.setdefault(start, new_rollup(resolution, start, rollup['min'], station))
+        target['count'] += rollup['count']
+        target['min'] = min(target['min'], rollup['min'])
+        target['max'] = max(target['max'], rollup['max'])
+        target['sum'] += rollup['sum']
+        for status_id, seconds in rollup['status_seconds'].items():
+            target['status_seconds'][status_id] = target['status_seconds'].get(status_id, 0) + seconds
+    return [combined[start] for start in sorted(combined)]
+
+
+def read_rollups(resolution, start, end, station=aurora_store.DEFAULT_STATION):
+    """A station's rollups of one resolution whose period starts between start and end, in time order."""
+    buckets = partitions_for_range(resolution, start, end, station)
+    return list(aurora_store.iter_range(start, end, ROLLUPS_TABLE, buckets=buckets))
+
+
+def update_rollups(epochtimes, station=aurora_store.DEFAULT_STATION):
+    """Recompute a station's hourly and daily rollups covering newly written readings."""
+    if not epochtimes:
+        return {'hour': 0, 'day': 0}
+    hours = sorted({period_start(epochtime, 'hour') for epochtime in epochtimes})
+    # Consistent reads: the readings were written moments ago
+    readings = aurora_store.query_range(hours[0], hours[-1] + HOUR - 1, consistent_read=True, station=station)
+    hourly = summarise(readings, 'hour')
+    aurora_store.batch_write(hourly, ROLLUPS_TABLE)
+
+    daily = []
+    for day in sorted({period_start(epochtime, 'day') for epochtime in epochtimes}):
+        day_hours = {int(rollup['epochtime']): rollup for rollup in read_rollups('hour', day, day + DAY - 1, station)}
+        day_hours.update((rollup['epochtime'], rollup) for rollup in hourly
+                         if period_start(rollup['epochtime'], 'day') == day)
+        daily.extend(combine(day_hours.values(), 'day'))
+    aurora_store.batch_write(daily, ROLLUPS_TABLE)
+    return {'hour': len(hourly), 'day': len(daily)}
+
+
+def rebuild_rollups(start, end, station=aurora_store.DEFAULT_STATION):
+    """Recompute a station's rollups for the whole days between start and end from its readings.
+
+    Works through day-aligned slices of about a month, reading archived months from their blobs,
+    so a long history is never held at once. Returns the number of rollups written.
+    """
+    counts = {'hour': 0, 'day': 0}
+    slice_start, end = period_start(start, 'day'), period_start(end, 'day') + DAY
+    while slice_start < end:
+        slice_end = min(slice_start + REBUILD_SECONDS, end)
+        hourly = summarise(list(archive.iter_range(slice_start, slice_end - 1, station)), 'hour')
+        daily = combine(hourly, 'day')
+        aurora_store.batch_write(hourly + daily, ROLLUPS_TABLE)
+        counts['hour'] += len(hourly)
+        counts['day'] += len(daily)
+        slice_start = slice_end
+    return counts
+
+
+def create_rollups_table():
+    """Create the rollups table on a local stand-in; terraform owns the real one."""
+    return aurora_store.create_readings_table(ROLLUPS_TABLE)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    def parse_day(label):
+        return int(datetime.strptime(label, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
+
+    parser = argparse.ArgumentParser(description='Rebuild rollups from the readings, e.g. after a migration')
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('first', type=parse_day, help='first day, YYYY-MM-DD')
+    parser.add_argument('last', type=parse_day, help='last day, YYYY-MM-DD')
+    parser.add_argument('--station', default=aurora_store.DEFAULT_STATION)
+    args = parser.parse_args()
+    counts = rebuild_rollups(args.first, args.last, args.station)
+    print(f"Wrote {counts['hour']} hourly and {counts['day']} daily rollups for {args.station}")
@@ -0,0 +1,147 @@
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest.mock import patch
+from moto import mock_aws
+import boto3
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+import archive
+import aurora_store
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+SEPTEMBER = 1693526400  # 2023-09-01T00:00:00Z
+OCTOBER = 1696118400  # 2023-10-01T00:00:00Z
+NOVEMBER = 1698796800  # 2023-11-01T00:00:00Z
+
+
+def readings(start, end, station='awn'):
+    return [aurora_store.with_bucket({'epochtime': epochtime, 'iso_string': 'x', 'status_id': 'green',
+                                      'value': Decimal(f'{epochtime % 997}.{epochtime % 7}')}, station)
+            for epochtime in range(start, end, HOUR)]
+
+
+class TestBlobs(unittest.TestCase):
+
+    def test_round_trip_keeps_values_as_written(self):
+        items = [{'epochtime': OCTOBER, 'status_id': 'green', 'value': Decimal('15.5')},
+                 {'epochtime': OCTOBER + HOUR, 'status_id': 'red', 'value': Decimal('212')},
+                 {'epochtime': OCTOBER + 2 * HOUR, 'status_id': 'amber', 'value': Decimal('-0.25')},
+                 {'epochtime': OCTOBER + 3 * HOUR, 'status_id': 'green', 'value': 'n/a'}]
+        decoded = archive.decode(archive.encode(items, 'lerwick', OCTOBER))
+        self.assertEqual([str(item['value']) for item in decoded], ['15.5', '212', '-0.25', 'n/a'])
+        self.assertEqual([item['status_id'] for item in decoded], ['green', 'red', 'amber', 'green'])
+        self.assertEqual(decoded[1]['bucket'], 'lerwick#2023-10-01')
+        self.assertEqual(decoded[0]['iso_string'], '2023-10-01T00:00:00+00:00')
+
+    def test_a_month_compresses_well(self):
+        items = readings(OCTOBER, NOVEMBER)
+        blob = archive.encode(items, 'awn', OCTOBER)
+        self.assertLess(len(blob), len(items) * 6)
+        self.assertEqual(len(archive.decode(blob)), len(items))
+
+    def test_months(self):
+        self.assertEqual(archive.month_start(OCTOBER + 40 * DAY), NOVEMBER)
+        self.assertEqual(archive.next_month(SEPTEMBER), OCTOBER)
+        self.assertEqual(archive.next_month(archive.parse_month('2023-12')), archive.parse_month('2024-01'))
+        self.assertEqual(archive.blob_key('awn', OCTOBER), 'readings/awn/2023-10.aua')
+
+    def test_expiry_only_when_retention_is_set(self):
+        self.assertNotIn('expires_at', archive.with_expiry({'epochtime': 1}))
+        with patch.object(archive, 'RETENTION_DAYS', 10):
+            self.assertEqual(archive.with_expiry({'epochtime': 1}, now=100)['expires_at'],
+                             100 + archive.MIN_RETENTION_DAYS * DAY)
+
+
+class TestStores(unittest.TestCase):
+
+    def test_local_store(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = archive.LocalStore(root)
+            self.assertIsNone(store.get('readings/awn/2023-10.aua'))
+            store.put('readings/awn/2023-10.aua', b'blob')
+            self.assertEqual(store.get('readings/awn/2023-10.aua'), b'blob')
+
+    @mock_aws
+    def test_s3_store(self):
+        boto3.client('s3').create_bucket(Bucket='archive',
+                                         CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'})
+        store = archive.S3Store('archive')
+        self.assertIsNone(store.get('readings/awn/2023-10.aua'))
+        store.put('readings/awn/2023-10.aua', b'blob')
+        self.assertEqual(store.get('readings/awn/2023-10.aua'), b'blob')
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_readings_table()
+        aurora_store.create_meta_table()
+        self.directory = tempfile.TemporaryDirectory()
+        archive._store = archive.LocalStore(self.directory.name)
+        self.items = readings(SEPTEMBER, NOVEMBER + 5 * DAY)
+        aurora_store.batch_write(self.items)
+
+    def tearDown(self):
+        archive._store = None
+        self.directory.cleanup()
+        self.mock.stop()
+
+    def test_only_closed_months_past_the_grace_are_due(self):
+        now = NOVEMBER + archive.GRACE_SECONDS - 1
+        with patch.object(archive, 'RETENTION_DAYS', 60):
+            self.assertEqual([archive.month_label(month) for month in archive.due_months(now=now)], ['2023-09'])
+            self.assertEqual(archive.compact_due(now=now + 1), ['2023-09', '2023-10'])
+            self.assertEqual(archive.compact_due(now=now + 1), [])
+        self.assertEqual(archive.archived_months(), {'2023-09': 30 * 24, '2023-10': 31 * 24})
+
+    def test_reads_span_the_archive_and_the_table(self):
+        archive.compact_month(OCTOBER)
+        # Once the raw October readings have expired, the archive still serves them
+        aurora_store.batch_delete([aurora_store.key_for(item['epochtime']) for item in self.items
+                                   if OCTOBER <= item['epochtime'] < NOVEMBER])
+        start, end = OCTOBER - 2 * DAY, NOVEMBER + 2 * DAY
+        items = list(archive.iter_range(start, end))
+        expected = [item for item in self.items if start <= item['epochtime'] <= end]
+        self.assertEqual([int(item['epochtime']) for item in items], [item['epochtime'] for item in expected])
+        self.assertEqual([item['value'] for item in items], [item['value'] for item in expected])
+
+    def test_rearchiving_keeps_rows_that_are_gone_from_the_table(self):
+        archive.compact_month(OCTOBER)
+        archive.prune_month(OCTOBER)
+        late = readings(NOVEMBER - HOUR // 2, NOVEMBER)
+        aurora_store.batch_write(late)
+        self.assertEqual(archive.compact_month(OCTOBER), 31 * 24 + 1)
+        self.assertEqual(archive.archived_months(), {'2023-10': 31 * 24 + 1})
+        items = list(archive.iter_range(OCTOBER, NOVEMBER - 1))
+        self.assertEqual([int(item['epochtime']) for item in items],
+                         sorted([item['epochtime'] for item in self.items
+                                 if OCTOBER <= item['epochtime'] < NOVEMBER] + [NOVEMBER - HOUR // 2]))
+
+    def test_due_months_reach_back_past_a_short_retention(self):
+        now = NOVEMBER + archive.GRACE_SECONDS
+        with patch.object(archive, 'RETENTION_DAYS', 10):
+            self.assertEqual([archive.month_label(month) for month in archive.due_months(now=now)],
+                             ['2023-09', '2023-10'])
+
+    def test_missing_blobs_fall_back_to_the_table(self):
+        archive.compact_month(OCTOBER)
+        os.remove(os.path.join(self.directory.name, archive.blob_key('awn', OCTOBER)))
+        self.assertEqual(len(list(archive.iter_range(OCTOBER, NOVEMBER - 1))), 31 * 24)
+
+    def test_stations_are_archived_apart(self):
+        aurora_store.batch_write(readings(OCTOBER, NOVEMBER, 'lerwick')[:3])
+        archive.compact_month(OCTOBER, 'lerwick')
+        self.assertEqual(archive.archived_months(), {})
+        self.assertEqual(len(list(archive.iter_range(OCTOBER, NOVEMBER - 1, 'lerwick'))), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import unittest
+from moto import mock_aws
+import boto3
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+import aurora_store
+
+DAY = 24 * 60 * 60
+START = 1696118400  # 2023-10-01T00:00:00Z
+
+
+class TestBuckets(unittest.TestCase):
+
+    def test_bucket_for(self):
+        self.assertEqual(aurora_store.bucket_for(START), 'awn#2023-10-01')
+        self.assertEqual(aurora_store.bucket_for(START + DAY - 1), 'awn#2023-10-01')
+        self.assertEqual(aurora_store.bucket_for(START + DAY), 'awn#2023-10-02')
+        self.assertEqual(aurora_store.bucket_for(START, 'lerwick'), 'lerwick#2023-10-01')
+
+    def test_buckets_for_range(self):
+        self.assertEqual(aurora_store.buckets_for_range(START + 60, START + 120), ['awn#2023-10-01'])
+        self.assertEqual(aurora_store.buckets_for_range(START - 1, START + DAY),
+                         ['awn#2023-09-30', 'awn#2023-10-01', 'awn#2023-10-02'])
+
+
+class TestReadingsTable(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_readings_table()
+        self.items = [aurora_store.with_bucket({'epochtime': START + i * 3600, 'status_id': 'green', 'value': str(i)})
+                      for i in range(72)]
+        aurora_store.batch_write(self.items)
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_query_range_spans_buckets_in_order(self):
+        items = aurora_store.query_range(START + 20 * 3600, START + 50 * 3600)
+        self.assertEqual([int(item['epochtime']) for item in items],
+                         [START + i * 3600 for i in range(20, 51)])
+
+    def test_query_last(self):
+        items = aurora_store.query_last(hours=6, now=START + 71 * 3600)
+        self.assertEqual(len(items), 7)
+
+    def test_iter_range_stops_early(self):
+        reader = aurora_store.iter_range(START, START + 71 * 3600, workers=2)
+        first = [int(next(reader)['epochtime']) for _ in range(3)]
+        reader.close()
+        self.assertEqual(first, [START, START + 3600, START + 7200])
+
+    def test_iter_scan_reads_every_segment(self):
+        items = list(aurora_store.iter_scan(total_segments=3))
+        self.assertEqual(sorted(int(item['epochtime']) for item in items), [START + i * 3600 for i in range(72)])
+
+    def test_batch_get(self):
+        keys = [aurora_store.key_for(START), aurora_store.key_for(START + 3600), aurora_store.key_for(START + 1)]
+        found = aurora_store.batch_get(keys)
+        self.assertEqual(sorted(int(item['epochtime']) for item in found), [START, START + 3600])
+
+    def test_migrate_legacy_table(self):
+        dynamodb = boto3.resource('dynamodb')
+        legacy = dynamodb.create_table(
+            TableName=aurora_store.LEGACY_TABLE,
+            KeySchema=[{'AttributeName': 'epochtime', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'epochtime', 'AttributeType': 'N'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        legacy.put_item(Item={'epochtime': START + 100 * 3600, 'status_id': 'amber', 'value': '99'})
+        self.assertEqual(aurora_store.migrate_legacy_table(), 1)
+        items = aurora_store.query_range(START + 100 * 3600, START + 100 * 3600)
+        self.assertEqual(items[0]['bucket'], 'awn#2023-10-05')
+        self.assertEqual(items[0]['station'], 'awn')
+        self.assertEqual(items[0]['status_id'], 'amber')
+
+
+    def test_stations_do_not_collide(self):
+        aurora_store.batch_write([aurora_store.with_bucket({'epochtime': START, 'status_id': 'red', 'value': '300'},
+                                                           'lerwick')])
+        self.assertEqual(aurora_store.query_range(START, START)[0]['value'], '0')
+        self.assertEqual(aurora_store.query_range(START, START, station='lerwick')[0]['value'], '300')
+
+    def test_migrate_to_stations(self):
+        old = [{'bucket': '2023-10-10', 'epochtime': START + 9 * DAY + i, 'status_id': 'green', 'value': str(i)}
+               for i in range(60)]
+        aurora_store.batch_write(old)
+        aurora_store.migrate_to_stations()
+        aurora_store.migrate_to_stations()  # Re-running moves nothing twice
+        self.assertEqual(len(aurora_store.query_range(START + 9 * DAY, START + 10 * DAY - 1)), 60)
+        self.assertEqual(len(list(aurora_store.iter_scan())), 72 + 60)
+
+    def test_migrate_to_stations_keeps_newer_station_items(self):
+        epochtime = START + 9 * DAY
+        aurora_store.batch_write([{'bucket': '2023-10-10', 'epochtime': epochtime, 'status_id': 'green', 'value': '1'},
+                                  aurora_store.with_bucket({'epochtime': epochtime, 'status_id': 'red', 'value': '250'})])
+        aurora_store.migrate_to_stations()
+        self.assertEqual(aurora_store.query_range(epochtime, epochtime)[0]['value'], '250')
+        self.assertEqual([item for item in aurora_store.iter_scan() if 'station' not in item], [])
+
+
+class TestLatest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_meta_table()
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_latest_readings_across_stations(self):
+        aurora_store.update_latest('awn', {'epochtime': START + 60, 'status_id': 'amber', 'value': '120'})
+        aurora_store.update_latest('awn', {'epochtime': START, 'status_id': 'green', 'value': '10'})  # Older: ignored
+        aurora_store.update_latest('lerwick', {'epochtime': START, 'status_id': 'red', 'value': '250'})
+        aurora_store.update_meta('ingest', ingested_at=START)  # Other meta items stay out of the index
+        latest = aurora_store.latest_readings()
+        self.assertEqual([(item['station'], item['status_id']) for item in latest], [('awn', 'amber'), ('lerwick', 'red')])
+
+    def test_status_is_written_with_its_reading(self):
+        thresholds = [{'status_id': 'green', 'value': 0}, {'status_id': 'amber', 'value': 100}]
+        self.assertTrue(aurora_store.update_latest('awn', {'epochtime': START, 'status_id': 'amber', 'value': '120'},
+                                                   thresholds=thresholds, updated=START + 30))
+        self.assertFalse(aurora_store.update_latest('awn', {'epochtime': START - 60}, thresholds=[], updated=START))
+        status = aurora_store.get_meta(aurora_store.latest_meta('awn'))
+        self.assertEqual((status['epochtime'], status['updated'], status['thresholds']), (START, START + 30, thresholds))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import unittest
+from decimal import Decimal
+from moto import mock_aws
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+import aurora_store
+import rollups
+
+START = 1696118400  # 2023-10-01T00:00:00Z
+
+
+def reading(offset, value, status_id='green'):
+    return {'epochtime': START + offset, 'value': str(value), 'status_id': status_id}
+
+
+class TestSummarise(unittest.TestCase):
+
+    def test_partitions_for_range(self):
+        self.assertEqual(rollups.partitions_for_range('hour', START - 1, START + 40 * 86400),
+                         ['awn#hour#2023-09', 'awn#hour#2023-10', 'awn#hour#2023-11'])
+        self.assertEqual(rollups.partitions_for_range('day', START, START + 10), ['awn#day#2023'])
+        self.assertEqual(rollups.partitions_for_range('day', START, START, 'lerwick'), ['lerwick#day#2023'])
+
+    def test_resolution_for(self):
+        self.assertEqual(rollups.resolution_for(60), None)
+        self.assertEqual(rollups.resolution_for(7200), 'hour')
+        self.assertEqual(rollups.resolution_for(86400 * 7), 'day')
+
+    def test_summarise_hourly(self):
+        hourly = rollups.summarise([reading(0, 10), reading(1800, 30, 'amber'), reading(3600, 5)], 'hour')
+        self.assertEqual([rollup['epochtime'] for rollup in hourly], [START, START + 3600])
+        first = hourly[0]
+        self.assertEqual((first['count'], first['min'], first['max'], first['sum']),
+                         (2, Decimal(10), Decimal(30), Decimal(40)))
+        self.assertEqual(first['status_seconds'], {'green': 1800, 'amber': 1800})
+        self.assertEqual(hourly[1]['status_seconds'], {'green': 3600})
+        self.assertEqual(first['bucket'], 'awn#hour#2023-10')
+
+    def test_combine_daily(self):
+        hourly = rollups.summarise([reading(hour * 3600, hour) for hour in range(30)], 'hour')
+        daily = rollups.combine(hourly, 'day')
+        self.assertEqual([(rollup['count'], rollup['min'], rollup['max']) for rollup in daily],
+                         [(24, 0, 23), (6, 24, 29)])
+        self.assertEqual(daily[0]['status_seconds'], {'green': 86400})
+        self.assertEqual(daily[0]['bucket'], 'awn#day#2023')
+
+
+class TestUpdateRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_readings_table()
+        rollups.create_rollups_table()
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def write(self, readings):
+        aurora_store.batch_write([aurora_store.with_bucket(item) for item in readings])
+        return rollups.update_rollups([item['epochtime'] for item in readings])
+
+    def test_recomputes_touched_periods(self):
+        self.assertEqual(self.write([reading(hour * 3600, hour) for hour in range(24)]), {'hour': 24, 'day': 1})
+        # A later run revises one hour and adds the next day
+        self.write([reading(5 * 3600, 100, 'red'), reading(86400, 1)])
+        daily = rollups.read_rollups('day', START, START + 86400)
+        self.assertEqual([int(rollup['count']) for rollup in daily], [24, 1])
+        self.assertEqual(daily[0]['max'], 100)
+        self.assertEqual(daily[0]['status_seconds'], {'green': 23 * 3600, 'red': 3600})
+
+    def test_rebuild_matches_incremental_updates(self):
+        readings = [reading(hour * 3600, hour % 50, 'amber' if hour % 7 else 'green') for hour in range(40 * 24)]
+        self.write(readings)
+        incremental = rollups.read_rollups('hour', START, START + 40 * 86400)
+        aurora_store.batch_delete([{'bucket': rollup['bucket'], 'epochtime': rollup['epochtime']}
+                                   for rollup in incremental], rollups.ROLLUPS_TABLE)
+        self.assertEqual(rollups.rebuild_rollups(START, START + 39 * 86400 + 1), {'hour': 40 * 24, 'day': 40})
+        self.assertEqual(rollups.read_rollups('hour', START, START + 40 * 86400), incremental)
+        daily = rollups.read_rollups('day', START, START + 40 * 86400)
+        self.assertEqual([int(rollup['count']) for rollup in daily], [24] * 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import io
+import json
+import os
+import unittest
+from unittest.mock import patch
+from moto import mock_aws
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+import aurora_store
+import tracing
+
+
+class TestTracing(unittest.TestCase):
+
+    def tearDown(self):
+        tracing.finish()
+
+    def test_spans_aggregate_by_name(self):
+        tracing.start('test')
+        for _ in range(3):
+            with tracing.span('parse'):
+                pass
+        summary = tracing.current().summary()
+        self.assertEqual(summary['spans']['parse']['count'], 3)
+        self.assertGreaterEqual(summary['totalMs'], summary['spans']['parse']['ms'])
+
+    def test_spans_without_a_trace_are_ignored(self):
+        with tracing.span('parse'):
+            pass
+        self.assertIsNone(tracing.current())
+        self.assertIsNone(tracing.finish())
+
+    def test_finish_writes_one_emf_record(self):
+        tracing.start('graphql')
+        with tracing.span('execute'):
+            pass
+        tracing.current().add_capacity('Query', {'TableName': 'readings', 'CapacityUnits': 2.5})
+        tracing.current().add_capacity('BatchWriteItem', [{'TableName': 'readings', 'CapacityUnits': 4.0}])
+        with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            tracing.finish(statusCode=200)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        record = json.loads(lines[0])
+        metrics = {metric['Name'] for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']}
+        self.assertEqual(metrics, {'DurationMs', 'ReadCapacityUnits', 'WriteCapacityUnits', 'executeMs'})
+        self.assertEqual(record['Service'], 'graphql')
+        self.assertEqual((record['ReadCapacityUnits'], record['WriteCapacityUnits']), (2.5, 4.0))
+        self.assertEqual(record['tables'], {'readings': 6.5})
+        self.assertEqual(record['statusCode'], 200)
+        self.assertIsNone(tracing.current())
+
+
+class TestInstrumentedClient(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store._dynamodb = None
+        aurora_store.create_readings_table()
+
+    def tearDown(self):
+        tracing.finish()
+        self.mock.stop()
+
+    def test_dynamodb_calls_record_spans_and_capacity(self):
+        aurora_store.batch_write([aurora_store.with_bucket({'epochtime': 100, 'status_id': 'green', 'value': 1})])
+        tracing.start('test')
+        aurora_store.query_range(0, 200)
+        summary = tracing.current().summary()
+        self.assertEqual(summary['spans']['dynamodbQuery']['count'], 1)
+        self.assertGreater(summary['capacity']['read'], 0)
+        self.assertEqual(summary['capacity']['write'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
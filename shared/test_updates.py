@@ -0,0 +1,90 @@
+import os
+import threading
+import unittest
+from moto import mock_aws
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+import aurora_store
+import updates
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestMemoryBroker(unittest.TestCase):
+
+    def test_publish_numbers_messages(self):
+        broker = updates.MemoryBroker()
+        self.assertIsNone(broker.latest())
+        broker.publish(updates.message_for([{'epochtime': 200}, {'epochtime': 100}], published_at=300))
+        message = broker.publish(updates.message_for([{'epochtime': 400}], published_at=500))
+        self.assertEqual(message, {'sequence': 2, 'station': 'awn', 'first_epochtime': 400, 'last_epochtime': 400,
+                                   'count': 1, 'published_at': 500})
+
+    def test_wait_wakes_on_publish(self):
+        broker = updates.MemoryBroker()
+        timer = threading.Timer(0.05, broker.publish, [updates.message_for([{'epochtime': 100}])])
+        timer.start()
+        message = broker.wait(0, timeout=5)
+        timer.join()
+        self.assertEqual(message['sequence'], 1)
+
+    def test_wait_times_out_with_latest(self):
+        broker = updates.MemoryBroker()
+        broker.publish(updates.message_for([{'epochtime': 100}]))
+        self.assertEqual(broker.wait(1, timeout=0.01)['sequence'], 1)
+        self.assertIsNone(updates.MemoryBroker().wait(0, timeout=0.01))
+
+
+class TestDynamoBroker(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        aurora_store.create_meta_table()
+        self.clock = FakeClock()
+        self.broker = updates.DynamoBroker(poll_seconds=2, clock=self.clock, sleep=self.clock.sleep)
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_publish_increments_the_sequence(self):
+        self.assertIsNone(self.broker.latest())
+        self.broker.publish(updates.message_for([{'epochtime': 100}], published_at=1))
+        message = self.broker.publish(updates.message_for([{'epochtime': 200}, {'epochtime': 300}], published_at=2,
+                                                          station='lerwick'))
+        self.assertEqual(message, {'sequence': 2, 'station': 'lerwick', 'first_epochtime': 200, 'last_epochtime': 300,
+                                   'count': 2, 'published_at': 2})
+        self.assertEqual(self.broker.latest(), message)
+
+    def test_wait_returns_as_soon_as_the_sequence_passes(self):
+        self.broker.publish(updates.message_for([{'epochtime': 100}]))
+        self.assertEqual(self.broker.wait(0, timeout=10)['sequence'], 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_wait_polls_until_the_timeout(self):
+        self.broker.publish(updates.message_for([{'epochtime': 100}]))
+        self.assertEqual(self.broker.wait(1, timeout=5)['sequence'], 1)
+        self.assertEqual(self.clock.sleeps, [2, 2, 1])
+
+    def test_publish_without_activities_is_skipped(self):
+        self.assertIsNone(updates.publish([]))
+        self.assertEqual(aurora_store.get_meta(updates.META_ITEM), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# tracing.py
+# Lightweight per-invocation tracing shared by both Lambdas: named timing spans, DynamoDB
+# consumed capacity captured from every call, and one CloudWatch Embedded Metric Format record
+# written to stdout when the invocation finishes.
+#
+# A Lambda container serves one invocation at a time, so the trace is module state rather than a
+# context variable; that also lets the query threads in aurora_store record into it.
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'AuroraWarn')
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+
+READ_OPERATIONS = {'Query', 'Scan', 'GetItem', 'BatchGetItem', 'TransactGetItems'}
+WRITE_OPERATIONS = {'PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems'}
+
+_lock = threading.Lock()
+_current = None
+
+
+class Trace:
+
+    def __init__(self, service):
+        self.service = service
+        self.started = time.perf_counter()
+        self.spans = {}  # name -> [count, total seconds]
+        self.capacity = {'read': 0.0, 'write': 0.0}
+        self.tables = {}  # table name -> capacity units
+
+    def add_span(self, name, seconds):
+        with _lock:
+            entry = self.spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_capacity(self, operation, consumed):
+        entries = consumed if isinstance(consumed, list) else [consumed]
+        kind = 'read' if operation in READ_OPERATIONS else 'write'
+        with _lock:
+            for entry in entries:
+                units = float(entry.get('CapacityUnits', 0.0))
+                self.capacity[kind] += units
+                self.tables[entry.get('TableName', '')] = self.tables.get(entry.get('TableName', ''), 0.0) + units
+
+    def summary(self):
+        """Timings in ms; concurrent spans (parallel day queries) can add up to more than the total."""
+        with _lock:
+            return {
+                'totalMs': round((time.perf_counter() - self.started) * 1000, 2),
+                'spans': {name: {'count': count, 'ms': round(seconds * 1000, 2)}
+                          for name, (count, seconds) in self.spans.items()},
+                'capacity': {kind: round(units, 2) for kind, units in self.capacity.items()},
+                'tables': {table: round(units, 2) for table, units in self.tables.items()}
+            }
+
+
+def start(service):
+    global _current
+    _current = Trace(service)
+    return _current
+
+
+def current():
+    return _current
+
+
+def finish(**properties):
+    """End the invocation's trace, emitting its EMF record; returns the summary."""
+    global _current
+    trace, _current = _current, None
+    if trace is None:
+        return None
+    summary = trace.summary()
+    if METRICS_ENABLED:
+        sys.stdout.write(json.dumps(emf_record(trace.service, summary, properties)) + '\n')
+    return summary
+
+
+def emf_record(service, summary, properties):
+    metrics = {'DurationMs': summary['totalMs'],
+               'ReadCapacityUnits': summary['capacity']['read'],
+               'WriteCapacityUnits': summary['capacity']['write']}
+    metrics.update((f"{name}Ms", span['ms']) for name, span in summary['spans'].items())
+    units = {name: ('Count' if name.endswith('CapacityUnits') else 'Milliseconds') for name in metrics}
+    return {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['Service']],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()]
+            }]
+        },
+        'Service': service,
+        **metrics,
+        'spanCounts': {name: span['count'] for name, span in summary['spans'].items()},
+        'tables': summary['tables'],
+        **properties
+    }
+
+
+@contextmanager
+def span(name):
+    """Time a block into the current trace; a no-op when no invocation is being traced."""
+    trace = _current
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, time.perf_counter() - started)
+
+
+def instrument(client):
+    """Ask DynamoDB for consumed capacity on every data call and time each call as a span."""
+    client.meta.events.register('provide-client-params.dynamodb.*', request_capacity)
+    client.meta.events.register('before-call.dynamodb.*', before_call)
+    client.meta.events.register('after-call.dynamodb.*', after_call)
+    return client
+
+
+def request_capacity(params, model, **kwargs):
+    if model.name in READ_OPERATIONS or model.name in WRITE_OPERATIONS:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+
+def before_call(model, context, **kwargs):
+    context['trace_started'] = time.perf_counter()
+
+
+def after_call(parsed, model, context, **kwargs):
+    trace = _current
+    if trace is None:
+        return
+    if 'trace_started' in context:
+        trace.add_span(f"dynamodb{model.name}", time.perf_counter() - context['trace_started'])
+    if parsed.get('ConsumedCapacity'):
+        trace.add_capacity(model.name, parsed['ConsumedCapacity'])
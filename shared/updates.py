@@ -0,0 +1,104 @@
+# updates.py
+# Change notifications from the ingest Lambda to readers waiting for new readings. After each
+# write the ingester publishes the range of epochtimes it wrote under a rising sequence number;
+# a reader remembers the last sequence it saw and waits for a higher one, then reads only the
+# readings after its own epochtime cursor.
+#
+# The DynamoDB broker keeps the latest message on a meta item: one UpdateItem per ingest and
+# one strongly consistent GetItem per poll. The memory broker is the stand-in for tests and
+# local runs (UPDATES_BROKER=memory), where publisher and reader share a process.
+import os
+import threading
+import time
+import aurora_store
+
+UPDATES_BROKER = os.environ.get('UPDATES_BROKER', 'dynamodb')
+META_ITEM = 'updates'
+POLL_SECONDS = 1.0
+MESSAGE_FIELDS = ('sequence', 'first_epochtime', 'last_epochtime', 'count', 'published_at')  # Besides station
+
+_broker = None
+
+
+def message_for(activities, published_at=None, station=aurora_store.DEFAULT_STATION):
+    epochtimes = [int(activity['epochtime']) for activity in activities]
+    return {
+        'station': station,
+        'first_epochtime': min(epochtimes),
+        'last_epochtime': max(epochtimes),
+        'count': len(epochtimes),
+        'published_at': int(time.time()) if published_at is None else published_at
+    }
+
+
+def normalise(item):
+    """A stored message with DynamoDB's Decimals as ints, or None when nothing was published yet."""
+    if not item or 'sequence' not in item:
+        return None
+    message = {field: int(item[field]) for field in MESSAGE_FIELDS if field in item}
+    message['station'] = item.get('station', aurora_store.DEFAULT_STATION)
+    return message
+
+
+class MemoryBroker:
+    """In-process broker; publishers wake waiting readers at once."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.message = None
+
+    def publish(self, message):
+        with self.condition:
+            sequence = self.message['sequence'] + 1 if self.message else 1
+            self.message = dict(message, sequence=sequence)
+            self.condition.notify_all()
+            return self.message
+
+    def latest(self):
+        with self.condition:
+            return self.message
+
+    def wait(self, after, timeout):
+        """The latest message once its sequence passes `after`, or whatever is latest at the timeout."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.message is not None and self.message['sequence'] > after, timeout)
+            return self.message
+
+
+class DynamoBroker:
+    """Latest message on a meta item; readers poll it every poll_seconds."""
+
+    def __init__(self, name=META_ITEM, poll_seconds=POLL_SECONDS, clock=time.monotonic, sleep=time.sleep):
+        self.name = name
+        self.poll_seconds = poll_seconds
+        self.clock = clock
+        self.sleep = sleep
+
+    def publish(self, message):
+        return normalise(aurora_store.increment_meta(self.name, 'sequence', **message))
+
+    def latest(self):
+        return normalise(aurora_store.get_meta(self.name, consistent_read=True))
+
+    def wait(self, after, timeout):
+        deadline = self.clock() + timeout
+        while True:
+            message = self.latest()
+            remaining = deadline - self.clock()
+            if (message is not None and message['sequence'] > after) or remaining <= 0:
+                return message
+            self.sleep(min(self.poll_seconds, remaining))
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = MemoryBroker() if UPDATES_BROKER == 'memory' else DynamoBroker()
+    return _broker
+
+
+def publish(activities, station=aurora_store.DEFAULT_STATION):
+    """Announce a station's newly written activities; returns the published message, or None if there were none."""
+    if not activities:
+        return None
+    return get_broker().publish(message_for(activities, station=station))
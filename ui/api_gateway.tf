@@ -1,6 +1,10 @@
 # API Gateway
 resource "aws_api_gateway_rest_api" "main" {
   name = "${var.project_name}-${var.environment}-api"
+
+  # The service returns columnar and gzip/brotli bodies base64 encoded; treat every type as
+  # binary so they are decoded on the way out (proxy requests then arrive base64 encoded too)
+  binary_media_types = ["*/*"]
 }
 
 # Example API Resource
@@ -28,6 +32,27 @@ resource "aws_api_gateway_method" "example_post" {
   request_validator_id = aws_api_gateway_request_validator.example.id
 }
 
+# GET Method: GraphQL over query string, cacheable by CloudFront via ETag/Cache-Control
+resource "aws_api_gateway_method" "example_get" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.example.id
+  http_method   = "GET"
+  authorization = "COGNITO_USER_POOLS"
+  authorizer_id = aws_api_gateway_authorizer.cognito.id
+
+  authorization_scopes = ["aws.cognito.signin.user.admin"]
+
+  # Persisted queries send only a hash in extensions, so none of the GraphQL parameters is required
+  request_parameters = {
+    "method.request.header.Authorization"   = true
+    "method.request.querystring.query"      = false
+    "method.request.querystring.extensions" = false
+    "method.request.querystring.variables"  = false
+  }
+
+  request_validator_id = aws_api_gateway_request_validator.example.id
+}
+
 # OPTIONS Method for CORS
 resource "aws_api_gateway_method" "example_options" {
   rest_api_id   = aws_api_gateway_rest_api.main.id
@@ -55,6 +80,16 @@ resource "aws_api_gateway_integration" "example_integration" {
   uri                     = var.lambda_invoke_arn
 }
 
+# GET Integration
+resource "aws_api_gateway_integration" "example_get_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.main.id
+  resource_id             = aws_api_gateway_resource.example.id
+  http_method             = aws_api_gateway_method.example_get.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = var.lambda_invoke_arn
+}
+
 # OPTIONS Integration
 resource "aws_api_gateway_integration" "example_options" {
   rest_api_id = aws_api_gateway_rest_api.main.id
@@ -62,6 +97,9 @@ resource "aws_api_gateway_integration" "example_options" {
   http_method = aws_api_gateway_method.example_options.http_method
   type        = "MOCK"
 
+  # Keep the mock's template working now that every media type is binary
+  content_handling = "CONVERT_TO_TEXT"
+
   request_templates = {
     "application/json" = "{\"statusCode\": 200}"
   }
@@ -99,6 +137,34 @@ resource "aws_api_gateway_integration_response" "example_options" {
   }
 }
 
+# Current status as plain JSON for widgets and the home page: public, and cached by CloudFront
+# until the next ingest via the function's Cache-Control and ETag
+resource "aws_api_gateway_resource" "status" {
+  rest_api_id = aws_api_gateway_rest_api.main.id
+  parent_id   = aws_api_gateway_rest_api.main.root_resource_id
+  path_part   = "status"
+}
+
+resource "aws_api_gateway_method" "status_get" {
+  rest_api_id   = aws_api_gateway_rest_api.main.id
+  resource_id   = aws_api_gateway_resource.status.id
+  http_method   = "GET"
+  authorization = "NONE"
+
+  request_parameters = {
+    "method.request.querystring.station" = false
+  }
+}
+
+resource "aws_api_gateway_integration" "status_get_integration" {
+  rest_api_id             = aws_api_gateway_rest_api.main.id
+  resource_id             = aws_api_gateway_resource.status.id
+  http_method             = aws_api_gateway_method.status_get.http_method
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = var.lambda_invoke_arn
+}
+
 # Add Lambda permission for API Gateway
 resource "aws_lambda_permission" "api_gateway" {
   statement_id  = "AllowAPIGatewayInvoke"
@@ -114,17 +180,25 @@ resource "aws_api_gateway_deployment" "main" {
 
   triggers = {
     redeployment = sha1(jsonencode([
+      aws_api_gateway_rest_api.main.binary_media_types,
       aws_api_gateway_resource.example.id,
       aws_api_gateway_method.example_post.id,
       aws_api_gateway_integration.example_integration.id,
+      aws_api_gateway_method.example_get.id,
+      aws_api_gateway_integration.example_get_integration.id,
       aws_api_gateway_method.example_options.id,
       aws_api_gateway_integration.example_options.id,
+      aws_api_gateway_resource.status.id,
+      aws_api_gateway_method.status_get.id,
+      aws_api_gateway_integration.status_get_integration.id,
     ]))
   }
 
   depends_on = [
     aws_api_gateway_integration.example_integration,
+    aws_api_gateway_integration.example_get_integration,
     aws_api_gateway_integration.example_options,
+    aws_api_gateway_integration.status_get_integration,
     aws_api_gateway_method.example_post,
     aws_api_gateway_method.example_options,
     aws_api_gateway_method_response.post_200
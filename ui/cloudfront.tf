@@ -68,16 +68,43 @@ resource "aws_cloudfront_distribution" "website" {
         "Origin",
         "Access-Control-Request-Headers",
         "Access-Control-Request-Method",
-        "Content-Type"
+        "Content-Type",
+        "Accept",
+        "Accept-Encoding"
       ]
       cookies {
         forward = "none"
       }
     }
 
+    # POSTs are never cached; GET responses are cached for as long as their
+    # Cache-Control allows (at most one ingestion interval)
     min_ttl                = 0
     default_ttl            = 0
-    max_ttl                = 0
+    max_ttl                = 21600
+    compress               = true
+    viewer_protocol_policy = "https-only"
+  }
+
+  # Current status: public, keyed on the station only, cached for the function's max-age
+  ordered_cache_behavior {
+    path_pattern     = "/status"
+    allowed_methods  = ["GET", "HEAD", "OPTIONS"]
+    cached_methods   = ["GET", "HEAD"]
+    target_origin_id = "API-Gateway"
+
+    forwarded_values {
+      query_string            = true
+      query_string_cache_keys = ["station"]
+      headers                 = ["Origin"]
+      cookies {
+        forward = "none"
+      }
+    }
+
+    min_ttl                = 0
+    default_ttl            = 0
+    max_ttl                = 21600
     compress               = true
     viewer_protocol_policy = "https-only"
   }
@@ -1,6 +1,6 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import Graph from './Graph';
-import { fetchAuroraData } from './services/AuroraService';
+import { fetchAuroraData, fetchLatestEpochtime, waitForAuroraUpdates } from './services/AuroraService';
 import { authService } from './services/AuthService';
 
 interface AuroraEntry {
@@ -21,6 +21,8 @@ const AuthComponent: React.FC = () => {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [token, setToken] = useState<string>('');
   const [auroraData, setAuroraData] = useState<AuroraEntry[]>([]);
+  // Epochtime of the newest reading shown, from which live updates continue
+  const [cursor, setCursor] = useState<number | null>(null);
   const [error, setError] = useState<string>('');
 
   const isNumeric = (value: any): boolean => {
@@ -55,8 +57,39 @@ const AuthComponent: React.FC = () => {
     setIsAuthenticated(false);
     setToken('');
     setAuroraData([]);
+    setCursor(null);
   };
 
+  // Once a window is loaded, long-poll for the readings each ingest adds and append them
+  useEffect(() => {
+    if (!token || cursor === null) {
+      return;
+    }
+    let active = true;
+    const poll = async (since: number) => {
+      while (active) {
+        try {
+          const update = await waitForAuroraUpdates(token, since);
+          if (active && update.entries.length > 0) {
+            const fresh = processAuroraData(update.entries);
+            setAuroraData(current => current.concat(fresh.filter(entry => entry.epochtime > since)));
+            setCursor(update.cursor);
+            return;  // The new cursor restarts the loop
+          }
+        } catch (err) {
+          console.error('Error waiting for aurora updates:', err);
+          await new Promise(resolve => setTimeout(resolve, 30000));
+        }
+      }
+    };
+    poll(cursor);
+    return () => {
+      active = false;
+    };
+    // processAuroraData is a pure helper, so it is not a dependency
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [token, cursor]);
+
   const fetchData = async () => {
     try {
       if (!token) {
@@ -68,6 +101,9 @@ const AuthComponent: React.FC = () => {
         const processedData = processAuroraData(response.data.auroraEntries);
         console.log('Processed data:', processedData);
         setAuroraData(processedData);
+        if (processedData.length > 0) {
+          setCursor(await fetchLatestEpochtime(token, processedData[processedData.length - 1].epochtime));
+        }
       }
     } catch (err) {
       console.error('Error fetching aurora data:', err);
@@ -1,4 +1,5 @@
 import config from '../config';
+import { COLUMNAR_CONTENT_TYPE, decodeColumnar } from './Columnar';
 
 class ApiClient {
   private baseUrl: string;
@@ -8,7 +9,19 @@ class ApiClient {
     console.log('API Client initialized with URL:', this.baseUrl);
   }
 
-  async post<T>(query: string, token: string): Promise<T> {
+  // Persisted queries: send only the SHA-256 of the query, and the full text only when the
+  // server has not seen that hash yet
+  // With columnar set, list results arrive as { data: { field: { column: typedArray } } }
+  async post<T>(query: string, token: string, columnar = false, variables?: object): Promise<T> {
+    const persistedQuery = { version: 1, sha256Hash: await sha256Hex(query) };
+    const data = await this.send<T>({ variables, extensions: { persistedQuery } }, token, columnar);
+    if (isPersistedQueryNotFound(data)) {
+      return this.send<T>({ query, variables, extensions: { persistedQuery } }, token, columnar);
+    }
+    return data;
+  }
+
+  private async send<T>(body: object, token: string, columnar: boolean): Promise<T> {
     console.log('Making API request:');
     console.log('URL:', this.baseUrl);
     console.log('Token (first 20 chars):', token.substring(0, 20));
@@ -17,7 +30,7 @@ class ApiClient {
       'Content-Type': 'application/json',
       'Origin': config.cloudfrontUrl
     });
-    console.log('Query:', query);
+    console.log('Body:', body);
 
     try {
       const response = await fetch(this.baseUrl, {
@@ -25,9 +38,10 @@ class ApiClient {
         headers: {
           'Authorization': `Bearer ${token}`,
           'Content-Type': 'application/json',
+          'Accept': columnar ? `${COLUMNAR_CONTENT_TYPE}, application/json` : 'application/json',
           'Origin': config.cloudfrontUrl
         },
-        body: JSON.stringify({ query })
+        body: JSON.stringify(body)
       });
 
       console.log('Response status:', response.status);
@@ -39,11 +53,16 @@ class ApiClient {
       
       if (!response.ok) {
         const errorText = await response.text();
+        if (errorText.includes(PERSISTED_QUERY_NOT_FOUND)) {
+          return JSON.parse(errorText);
+        }
         console.error('API Error Response:', errorText);
         throw new Error(`API request failed: ${response.status} - ${errorText}`);
       }
 
-      const data = await response.json();
+      const data = response.headers.get('Content-Type') === COLUMNAR_CONTENT_TYPE
+        ? { data: decodeColumnar(await response.arrayBuffer()) }
+        : await response.json();
       console.log('API Response data:', data);
       return data;
     } catch (error) {
@@ -53,4 +72,16 @@ class ApiClient {
   }
 }
 
+const PERSISTED_QUERY_NOT_FOUND = 'PersistedQueryNotFound';
+
+const isPersistedQueryNotFound = (data: any): boolean =>
+  Array.isArray(data?.errors) && data.errors.includes(PERSISTED_QUERY_NOT_FOUND);
+
+const sha256Hex = async (text: string): Promise<string> => {
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+  return Array.from(new Uint8Array(digest))
+    .map(byte => byte.toString(16).padStart(2, '0'))
+    .join('');
+};
+
 export const apiClient = new ApiClient(); 
\ No newline at end of file
@@ -1,16 +1,73 @@
 import { apiClient } from './ApiClient';
+import { Sections } from './Columnar';
 
+// Requested in the columnar encoding: a few typed arrays instead of an object per point
 export const fetchAuroraData = async (token: string) => {
-  return apiClient.post(
+  const response = await apiClient.post<{ data: Sections }>(
     `
     query {
-      auroraEntries(days: 1) {
+      auroraEntries: auroraSeries(days: 1, maxPoints: 500) {
         epochtime
         statusId
-        value
+        value: max
       }
     }
     `,
-    token
+    token,
+    true
   );
-}; 
\ No newline at end of file
+  const columns = response.data?.auroraEntries;
+  if (!columns || Array.isArray(columns)) {
+    return response;  // Served as JSON after all
+  }
+  // An empty result has no columns at all
+  const epochtime = (columns.epochtime ?? new Float64Array(0)) as Float64Array;
+  const statusId = (columns.statusId ?? []) as string[];
+  const value = (columns.value ?? new Float32Array(0)) as Float32Array;
+  return {
+    data: {
+      auroraEntries: Array.from(epochtime, (time, i) => ({ epochtime: time, statusId: statusId[i], value: value[i] }))
+    }
+  };
+};
+
+// The series above is bucketed, so its last epochtime is a bucket start; the newest raw reading
+// in that bucket is the cursor live updates continue from
+export const fetchLatestEpochtime = async (token: string, bucketStart: number): Promise<number> => {
+  const response = await apiClient.post<{ data?: { auroraEntries: { epochtime: number }[] } }>(
+    `
+    query Latest($since: Int!) {
+      auroraEntries(days: 1, since: $since) { epochtime }
+    }
+    `,
+    token,
+    false,
+    { since: bucketStart - 1 }
+  );
+  const epochtimes = (response.data?.auroraEntries ?? []).map(entry => entry.epochtime);
+  return epochtimes.length > 0 ? Math.max(...epochtimes) : bucketStart;
+};
+
+export interface AuroraUpdates {
+  entries: { epochtime: number; statusId: string; value: string }[];
+  cursor: number;
+}
+
+// Long poll: resolves with the readings after `since` as soon as an ingest writes some,
+// or with none once the server's wait runs out
+export const waitForAuroraUpdates = async (token: string, since: number): Promise<AuroraUpdates> => {
+  const response = await apiClient.post<{ data?: { auroraUpdates: AuroraUpdates } }>(
+    `
+    query Updates($since: Int!) {
+      auroraUpdates(since: $since, waitSeconds: 20) {
+        entries { epochtime statusId value }
+        cursor
+      }
+    }
+    `,
+    token,
+    false,
+    { since }
+  );
+  return response.data?.auroraUpdates ?? { entries: [], cursor: since };
+};
@@ -0,0 +1,69 @@
+// Decoder for the service's application/vnd.aurora.columnar responses (see service/columnar.py).
+// Numeric columns come back as typed-array views over the response buffer, so a multi-week
+// window decodes without allocating an object per row.
+
+export const COLUMNAR_CONTENT_TYPE = 'application/vnd.aurora.columnar';
+
+export type Column = Float64Array | Int32Array | Float32Array | string[];
+export type Sections = { [field: string]: { [column: string]: Column } };
+
+export const decodeColumnar = (buffer: ArrayBuffer): Sections => {
+  const view = new DataView(buffer);
+  const bytes = new Uint8Array(buffer);
+  const text = new TextDecoder();
+  let offset = 0;
+
+  const align = () => { offset += (4 - (offset % 4)) % 4; };
+  const uint16 = () => { const value = view.getUint16(offset, true); offset += 2; return value; };
+  const uint32 = () => { const value = view.getUint32(offset, true); offset += 4; return value; };
+  const string = () => {
+    const length = uint16();
+    const value = text.decode(bytes.subarray(offset, offset + length));
+    offset += length;
+    return value;
+  };
+  const typed = <T>(Type: { new(buffer: ArrayBuffer, offset: number, length: number): T; BYTES_PER_ELEMENT: number },
+                    count: number): T => {
+    align();
+    const array = new Type(buffer, offset, count);
+    offset += count * Type.BYTES_PER_ELEMENT;
+    return array;
+  };
+
+  if (text.decode(bytes.subarray(0, 4)) !== 'AUR1') {
+    throw new Error('Not a columnar response');
+  }
+  offset = 4;
+  const sections: Sections = {};
+  const sectionCount = uint16();
+  for (let s = 0; s < sectionCount; s++) {
+    const field = string();
+    const rows = uint32();
+    const columnCount = uint16();
+    const columns: { [column: string]: Column } = {};
+    for (let c = 0; c < columnCount; c++) {
+      const name = string();
+      const kind = String.fromCharCode(bytes[offset++]);
+      if (kind === 'd') {
+        align();
+        const first = view.getFloat64(offset, true);
+        offset += 8;
+        const deltas = typed(Int32Array, Math.max(rows - 1, 0));
+        const values = new Float64Array(rows);
+        if (rows) values[0] = first;
+        for (let i = 1; i < rows; i++) values[i] = values[i - 1] + deltas[i - 1];
+        columns[name] = values;
+      } else if (kind === 'i') {
+        columns[name] = typed(Int32Array, rows);
+      } else if (kind === 'f') {
+        columns[name] = typed(Float32Array, rows);
+      } else {
+        const entries = Array.from({ length: uint16() }, string);
+        const indices = kind === 's' ? typed(Uint8Array, rows) : typed(Uint16Array, rows);
+        columns[name] = Array.from(indices, index => entries[index]);
+      }
+    }
+    sections[field] = columns;
+  }
+  return sections;
+};